@@ -0,0 +1,98 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the throughput of Database.save_many against a local stand-in
+for skygear-server, which answers record:save over HTTP after a fixed
+latency plus a cost for each record.
+
+    python benchmarks/bench_bulk.py --records 20000 --latency 0.02
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from skygear import codec
+from skygear.container import SkygearContainer
+from skygear.models import Record, RecordID
+from skygear.transmitter.http import send_action
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    latency = 0.02
+    record_cost = 0.00005
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        payload = codec.loads(self.rfile.read(length))
+        records = payload.get('records', [])
+        time.sleep(self.server.latency +
+                   self.server.record_cost * len(records))
+        body = codec.dumpb({'result': [
+            {'_id': r['_id'], '_type': 'record'} for r in records
+        ]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTransport:
+    def send_action(self, action_name, payload, url, timeout):
+        return send_action(url, payload, timeout=timeout)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--records', type=int, default=20000)
+    ap.add_argument('--latency', type=float, default=0.02)
+    args = ap.parse_args()
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = args.latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    container = SkygearContainer(
+        endpoint='http://127.0.0.1:%d' % server.server_address[1],
+        transport=HttpClientTransport())
+    database = container.public_database
+    records = [Record(RecordID('note', '%08d' % i), None, None,
+                      data={'title': 'Note %d' % i, 'count': i})
+               for i in range(args.records)]
+
+    print('%d records, %.0f ms latency' % (
+        args.records, args.latency * 1000))
+    print('%-6s %12s %10s %14s' % ('chunk', 'concurrency', 'time (s)',
+                                   'records/s'))
+    for chunk_size, concurrency in [(args.records, 1), (500, 1), (500, 4),
+                                    (500, 8), (2000, 4)]:
+        start = time.perf_counter()
+        result = database.save_many(records, chunk_size=chunk_size,
+                                    concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        assert result.ok
+        print('%-6d %12d %10.3f %14.0f' % (chunk_size, concurrency, elapsed,
+                                           args.records / elapsed))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the JSON backends of skygear.codec on record payloads in the
+format sent by skygear-server.
+
+    python benchmarks/bench_codec.py --records 100 --repeat 200
+"""
+import argparse
+import datetime
+import timeit
+
+from skygear import codec
+
+
+def record(i):
+    return {
+        '_id': 'note/%08d' % i,
+        '_type': 'record',
+        '_ownerID': 'user-%d' % (i % 10),
+        '_created_at': '2017-07-03T05:23:00.123456Z',
+        '_created_by': 'user-%d' % (i % 10),
+        '_updated_at': '2017-07-04T08:00:00Z',
+        '_updated_by': 'user-%d' % (i % 10),
+        '_access': [
+            {'level': 'read', 'public': True},
+            {'level': 'write', 'user_id': 'user-%d' % (i % 10)},
+        ],
+        'title': 'Note %d' % i,
+        'content': 'Lorem ipsum dolor sit amet, 中文 ' * 4,
+        'count': i,
+        'score': i / 7,
+        'done': i % 2 == 0,
+        'tags': ['tag-%d' % j for j in range(5)],
+        'due_at': {'$type': 'date', '$date': '2017-08-01T00:00:00Z'},
+        'location': {'$type': 'geo', '$lng': 114.17, '$lat': 22.28},
+        'category': {'$type': 'ref', '$id': 'category/%d' % (i % 3)},
+        'attachment': {
+            '$type': 'asset',
+            '$name': 'note-%d.png' % i,
+            '$content_type': 'image/png',
+            '$url': 'http://skygear.dev/files/note-%d.png' % i,
+        },
+    }
+
+
+def payload(records):
+    return {
+        'kind': 'hook',
+        'name': 'note_after_save',
+        'param': {
+            'records': [record(i) for i in range(records)],
+        },
+        'context': {
+            'user_id': 'user-1',
+            'request_id': 'REQ-ID',
+            'sent_at': datetime.datetime.now(datetime.timezone.utc),
+        },
+    }
+
+
+def bench(name, obj, repeat):
+    codec.set_backend(name)
+    data = codec.dumpb(obj)
+    encode = min(timeit.repeat(lambda: codec.dumpb(obj),
+                               number=repeat, repeat=3)) / repeat
+    decode = min(timeit.repeat(lambda: codec.loads(data),
+                               number=repeat, repeat=3)) / repeat
+    return len(data), encode, decode
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--records', type=int, default=100)
+    ap.add_argument('--repeat', type=int, default=200)
+    args = ap.parse_args()
+
+    obj = payload(args.records)
+    print('%d records per payload' % args.records)
+    print('%-8s %10s %12s %12s' % ('backend', 'bytes', 'encode (ms)',
+                                   'decode (ms)'))
+    for name in codec.available_backends():
+        size, encode, decode = bench(name, obj, args.repeat)
+        print('%-8s %10d %12.3f %12.3f' % (name, size, encode * 1000,
+                                           decode * 1000))
+
+
+if __name__ == '__main__':
+    main()
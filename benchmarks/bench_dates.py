@@ -0,0 +1,85 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the date codec of skygear.encoding with strict_rfc3339 on result
+sets of timestamps in the format sent by skygear-server.
+
+The `unique` result set has no repeated timestamps. The `repeated` result
+set has 100 distinct timestamps, as in records created in batches.
+
+    python benchmarks/bench_dates.py --count 100000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+import strict_rfc3339
+
+from skygear.encoding import format_datetime, parse_datetime
+
+
+def legacy_parse(s):
+    ts = strict_rfc3339.rfc3339_to_timestamp(s)
+    return datetime.fromtimestamp(ts)
+
+
+def legacy_format(dt):
+    return strict_rfc3339.timestamp_to_rfc3339_utcoffset(dt.timestamp())
+
+
+def timestamps(count, distinct):
+    start = datetime(2017, 7, 3, tzinfo=timezone.utc)
+    return [
+        format_datetime(start + timedelta(seconds=i % distinct,
+                                          microseconds=i % distinct * 7))
+        for i in range(count)
+    ]
+
+
+def measure(func, values):
+    parse_datetime.cache_clear()
+    started_at = time.perf_counter()
+    for v in values:
+        func(v)
+    return time.perf_counter() - started_at
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--count', type=int, default=100000)
+    args = ap.parse_args()
+
+    result_sets = [
+        ('unique', timestamps(args.count, args.count)),
+        ('repeated', timestamps(args.count, 100)),
+    ]
+    print('%d timestamps per result set' % args.count)
+    print('%-16s %12s %12s %8s' % ('', 'legacy (ms)', 'current (ms)',
+                                   'speedup'))
+    for name, values in result_sets:
+        legacy = measure(legacy_parse, values)
+        current = measure(parse_datetime, values)
+        print('%-16s %12.1f %12.1f %7.2fx' % ('parse ' + name,
+                                              legacy * 1000, current * 1000,
+                                              legacy / current))
+
+    dates = [parse_datetime(v) for v in result_sets[0][1]]
+    legacy = measure(legacy_format, dates)
+    current = measure(format_datetime, dates)
+    print('%-16s %12.1f %12.1f %7.2fx' % ('format', legacy * 1000,
+                                          current * 1000, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
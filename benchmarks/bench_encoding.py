@@ -0,0 +1,154 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the record encoder and decoder of skygear.encoding with the
+if-chain implementation they replaced, on wide records with nested lists,
+references, dates and assets.
+
+    python benchmarks/bench_encoding.py --fields 50 --repeat 2000
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+from skygear.encoding import (_RecordDecoder, _RecordEncoder,
+                              deserialize_record, serialize_record)
+from skygear.models import (Asset, Location, Record, RecordID, Reference,
+                            UnknownValue)
+
+
+class LegacyDecoder(_RecordDecoder):
+    def decode(self, d):
+        # The legacy decoder copied the data fields before decoding them.
+        d = dict(d)
+        data_dict = {k: v for k, v in d.items() if not k.startswith('_')}
+        record = super().decode({k: v for k, v in d.items()
+                                 if k.startswith('_')})
+        record._data = self.decode_dict(data_dict)
+        return record
+
+    def decode_dict(self, d):
+        return {k: self.decode_value(v) for k, v in d.items()}
+
+    def decode_list(self, values):
+        return [self.decode_value(v) for v in values]
+
+    def decode_value(self, v):
+        if isinstance(v, dict):
+            type_ = v.get('$type')
+            if type_ == 'date':
+                return self.decode_date(v)
+            elif type_ == 'asset':
+                return self.decode_asset(v)
+            elif type_ == 'geo':
+                return self.decode_location(v)
+            elif type_ == 'ref':
+                return self.decode_ref(v)
+            elif type_ == 'unknown':
+                return self.decode_unknown_value(v)
+            elif type_ == 'record':
+                return self.decode_record(v)
+            else:
+                return self.decode_dict(v)
+        elif isinstance(v, list):
+            return self.decode_list(v)
+        else:
+            return v
+
+
+class LegacyEncoder(_RecordEncoder):
+    def encode_dict(self, d):
+        return {k: self.encode_value(v) for k, v in d.items()}
+
+    def encode_list(self, values):
+        return [self.encode_value(v) for v in values]
+
+    def encode_value(self, v):
+        if isinstance(v, dict):
+            return self.encode_dict(v)
+        elif isinstance(v, list):
+            return self.encode_list(v)
+        elif isinstance(v, datetime):
+            return self.encode_datetime(v)
+        elif isinstance(v, Asset):
+            return self.encode_asset(v)
+        elif isinstance(v, Location):
+            return self.encode_location(v)
+        elif isinstance(v, Reference):
+            return self.encode_ref(v)
+        elif isinstance(v, UnknownValue):
+            return self.encode_unknown_value(v)
+        elif isinstance(v, Record):
+            return self.encode_record(v)
+        else:
+            return v
+
+
+def wide_record(fields):
+    data = {}
+    for i in range(fields):
+        kind = i % 6
+        if kind == 0:
+            value = 'string value %d' % i
+        elif kind == 1:
+            value = [i, i + 1.5, ['nested', {'depth': 2, 'flag': True}]]
+        elif kind == 2:
+            value = Reference(RecordID('category', 'c%d' % i))
+        elif kind == 3:
+            value = datetime(2017, 7, 3, 5, 23, i % 60)
+        elif kind == 4:
+            value = Asset('file-%d.png' % i, 'image/png')
+        else:
+            value = [Location(114.17, 22.28), Reference(
+                RecordID('user', 'u%d' % i))]
+        data['field_%d' % i] = value
+    return Record(RecordID('note', '1'), 'owner', None,
+                  created_at=datetime(2017, 7, 3), created_by='owner',
+                  updated_at=datetime(2017, 7, 4), updated_by='owner',
+                  data=data)
+
+
+def bench(func, repeat):
+    return min(timeit.repeat(func, number=repeat, repeat=3)) / repeat
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--fields', type=int, default=50)
+    ap.add_argument('--repeat', type=int, default=2000)
+    args = ap.parse_args()
+
+    record = wide_record(args.fields)
+    wire = serialize_record(record)
+    assert LegacyEncoder().encode(record) == wire
+    assert serialize_record(deserialize_record(wire)) == \
+        serialize_record(LegacyDecoder().decode(wire))
+
+    results = [
+        ('encode', bench(lambda: LegacyEncoder().encode(record), args.repeat),
+         bench(lambda: serialize_record(record), args.repeat)),
+        ('decode', bench(lambda: LegacyDecoder().decode(wire), args.repeat),
+         bench(lambda: deserialize_record(wire), args.repeat)),
+    ]
+    print('%d fields per record' % args.fields)
+    print('%-8s %12s %12s %8s' % ('', 'legacy (us)', 'current (us)',
+                                  'speedup'))
+    for name, legacy, current in results:
+        print('%-8s %12.1f %12.1f %7.2fx' % (name, legacy * 1e6,
+                                             current * 1e6,
+                                             legacy / current))
+
+
+if __name__ == '__main__':
+    main()
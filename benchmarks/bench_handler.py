@@ -0,0 +1,96 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the round trip of a handler request through
+CommonTransport.handler, from the param sent by skygear-server to the
+response sent back, compared with building the request with werkzeug's
+EnvironBuilder.
+
+    python benchmarks/bench_handler.py --repeat 2000
+"""
+import argparse
+import base64
+import os
+import timeit
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from skygear.registry import Registry
+from skygear.transmitter.common import CommonTransport
+
+
+class EnvironBuilderTransport(CommonTransport):
+    def _handler_request(self, param):
+        builder = EnvironBuilder(
+            method=param['method'],
+            path=param['path'],
+            query_string=param.get('query_string'),
+            headers=param['header'],
+            data=base64.b64decode(param['body'])
+        )
+        environ = builder.get_environ()
+        return Request(environ, populate_request=False, shallow=False)
+
+
+def make_param(body):
+    return {
+        'method': 'POST',
+        'path': '/note',
+        'query_string': 'limit=10',
+        'header': {'Content-Type': ['application/json'],
+                   'X-Skygear-Api-Key': ['secret']},
+        'body': base64.b64encode(body).decode('ascii'),
+    }
+
+
+def json_handler(request):
+    return {'path': request.path, 'ok': True}
+
+
+def read_handler(request):
+    return {'length': len(request.get_data())}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--repeat', type=int, default=2000)
+    args = ap.parse_args()
+
+    cases = [
+        ('small json, unread', make_param(b'{"hello": "world"}'),
+         json_handler),
+        ('small json, read', make_param(b'{"hello": "world"}'),
+         read_handler),
+        ('1 MB, unread', make_param(os.urandom(1 << 20)), json_handler),
+        ('1 MB, read', make_param(os.urandom(1 << 20)), read_handler),
+    ]
+    transports = [('EnvironBuilder', EnvironBuilderTransport(Registry())),
+                  ('handler_environ', CommonTransport(Registry()))]
+
+    print('%-20s %18s %18s' % ('case', 'EnvironBuilder (us)',
+                               'handler_environ (us)'))
+    for name, param, handler in cases:
+        repeat = args.repeat if len(param['body']) < 1024 \
+            else max(args.repeat // 100, 10)
+        times = []
+        for _, transport in transports:
+            elapsed = timeit.timeit(
+                lambda: transport.handler(handler, param), number=repeat)
+            times.append(elapsed / repeat * 1e6)
+        print('%-20s %18.1f %18.1f' % (name, times[0], times[1]))
+
+
+if __name__ == '__main__':
+    main()
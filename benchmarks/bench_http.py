@@ -0,0 +1,110 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the throughput of HttpTransport serving an op with the werkzeug
+development server used by `run_simple`, and with PooledWSGIServer.
+
+Each client thread sends requests one after another over its own
+connection, kept alive when the server allows it, as skygear-server does.
+
+    python benchmarks/bench_http.py --clients 32 --requests 200
+"""
+import argparse
+import http.client
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from skygear import codec
+from skygear.registry import Registry
+from skygear.transmitter.http import HttpTransport, PooledWSGIServer
+
+
+def make_transport(work):
+    registry = Registry()
+
+    def bench_op(value):
+        time.sleep(work)
+        return value
+
+    registry.register_op('bench', bench_op)
+    return HttpTransport('127.0.0.1:0', registry)
+
+
+def run_clients(port, clients, requests):
+    body = codec.dumpb({'kind': 'op', 'name': 'bench',
+                        'param': {'args': ['x' * 64]}})
+    errors = []
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        try:
+            for _ in range(requests):
+                conn.request('POST', '/', body,
+                             {'Content-Type': 'application/json'})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    errors.append(resp.status)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, errors
+
+
+def bench(name, server, clients, requests):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    elapsed, errors = run_clients(server.server_address[1], clients,
+                                  requests)
+    server.shutdown()
+    total = clients * requests
+    print('%-22s %10.3f %12.0f %8d' % (name, elapsed, total / elapsed,
+                                       len(errors)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--clients', type=int, default=32)
+    ap.add_argument('--requests', type=int, default=200)
+    ap.add_argument('--work', type=float, default=0.001,
+                    help='Seconds each op sleeps')
+    ap.add_argument('--threads', type=int, default=32)
+    args = ap.parse_args()
+
+    transport = make_transport(args.work)
+    print('%d clients x %d requests, %.1f ms per op' % (
+        args.clients, args.requests, args.work * 1000))
+    print('%-22s %10s %12s %8s' % ('server', 'time (s)', 'requests/s',
+                                   'errors'))
+    bench('run_simple', make_server('127.0.0.1', 0, transport.dispatch,
+                                    threaded=True),
+          args.clients, args.requests)
+    bench('pooled (%d threads)' % args.threads,
+          PooledWSGIServer('127.0.0.1', 0, transport.dispatch,
+                           threads=args.threads),
+          args.clients, args.requests)
+
+
+if __name__ == '__main__':
+    main()
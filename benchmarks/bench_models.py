@@ -0,0 +1,125 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measures the memory used by records with references and ACL entries,
+comparing the slot-based models of skygear.models with models that keep
+their attributes in a per-instance __dict__, as they used to.
+
+    python benchmarks/bench_models.py --records 10000
+"""
+import argparse
+import tracemalloc
+
+from skygear import models
+
+
+class LegacyRecord:
+    def __init__(self, id, owner_id, acl, created_at=None, created_by=None,
+                 updated_at=None, updated_by=None, data=None):
+        self._id = id
+        self._owner_id = owner_id
+        self._acl = acl
+        self._created_at = created_at
+        self._created_by = created_by
+        self._updated_at = updated_at
+        self._updated_by = updated_by
+        self._data = data or {}
+
+
+class LegacyRecordID:
+    def __init__(self, type_, key):
+        self._type = type_
+        self._key = key
+
+
+class LegacyReference:
+    def __init__(self, recordID):
+        self._recordID = recordID
+
+
+class LegacyLocation:
+    def __init__(self, lng, lat):
+        self.lng = lng
+        self.lat = lat
+
+
+class LegacyPublicAccessControlEntry:
+    def __init__(self, level):
+        self.level = level
+
+
+class LegacyDirectAccessControlEntry:
+    def __init__(self, user_id, level):
+        self.level = level
+        self.user_id = user_id
+
+
+LEGACY = {
+    'Record': LegacyRecord,
+    'RecordID': LegacyRecordID,
+    'Reference': LegacyReference,
+    'Location': LegacyLocation,
+    'PublicAccessControlEntry': LegacyPublicAccessControlEntry,
+    'DirectAccessControlEntry': LegacyDirectAccessControlEntry,
+}
+CURRENT = {name: getattr(models, name) for name in LEGACY}
+
+
+def build(m, count):
+    records = []
+    for i in range(count):
+        records.append(m['Record'](
+            m['RecordID']('note', 'note-%d' % i),
+            'user-%d' % (i % 10),
+            [m['PublicAccessControlEntry']('read'),
+             m['DirectAccessControlEntry']('user-%d' % (i % 10), 'write')],
+            data={
+                'category': m['Reference'](m['RecordID']('category',
+                                                         'c%d' % (i % 3))),
+                'author': m['Reference'](m['RecordID']('user',
+                                                       'u%d' % (i % 10))),
+                'location': m['Location'](114.17, 22.28),
+            }))
+    return records
+
+
+def measure(m, count):
+    tracemalloc.start()
+    records = build(m, count)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--records', type=int, default=10000)
+    args = ap.parse_args()
+
+    print('%d records, each with 2 ACL entries, 2 references and a '
+          'location' % args.records)
+    print('%-8s %14s %14s %16s' % ('models', 'total (KiB)', 'peak (KiB)',
+                                   'per record (B)'))
+    results = {}
+    for name, m in [('legacy', LEGACY), ('current', CURRENT)]:
+        size, peak = results[name] = measure(m, args.records)
+        print('%-8s %14.1f %14.1f %16.1f' % (name, size / 1024, peak / 1024,
+                                             size / args.records))
+    print('saved    %13.1f%%' % (
+        100 - 100 * results['current'][0] / results['legacy'][0]))
+
+
+if __name__ == '__main__':
+    main()
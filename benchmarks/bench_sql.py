@@ -0,0 +1,111 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares loading rows one by one with the bulk helpers of skygear.utils.db
+against a local Postgres, such as the test-db of docker-compose.test.yml.
+
+    DATABASE_URL=postgres://postgres@127.0.0.1/postgres \\
+        python benchmarks/bench_sql.py --rows 50000
+"""
+import argparse
+import io
+import time
+
+from skygear.container import SkygearContainer
+from skygear.utils import db
+
+APP_NAME = 'bench_sql'
+
+
+def setup():
+    SkygearContainer.set_default_app_name(APP_NAME)
+    schema_name = db.quotedIdentifier(db._get_schema_name())
+    with db.conn() as conn:
+        conn.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(schema_name))
+        conn.execute('DROP TABLE IF EXISTS {}.bench_note'.format(
+            schema_name))
+        conn.execute("""
+            CREATE TABLE {}.bench_note (
+                id text PRIMARY KEY,
+                title text,
+                count integer
+            )""".format(schema_name))
+    db.invalidate_schema()
+    return db.get_table('bench_note')
+
+
+def truncate(table):
+    with db.conn() as conn:
+        conn.execute(table.delete())
+
+
+def row_by_row(table, rows):
+    with db.conn() as conn:
+        for row in rows:
+            conn.execute(table.insert(), row)
+
+
+def csv_file(rows):
+    f = io.StringIO()
+    for row in rows:
+        f.write('{id},{title},{count}\n'.format(**row))
+    f.seek(0)
+    return f
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--rows', type=int, default=50000)
+    args = ap.parse_args()
+
+    table = setup()
+    rows = [{'id': '%08d' % i, 'title': 'Note %d' % i, 'count': i}
+            for i in range(args.rows)]
+
+    cases = [
+        ('row by row', lambda: row_by_row(table, rows)),
+        ('bulk_insert', lambda: db.bulk_insert(table, rows)),
+        ('copy_rows', lambda: db.copy_rows(table, rows)),
+        ('copy_csv', lambda: db.copy_csv(table, csv_file(rows))),
+    ]
+    print('%d rows' % args.rows)
+    print('%-14s %10s %12s' % ('method', 'time (s)', 'rows/s'))
+    for name, load in cases:
+        truncate(table)
+        start = time.perf_counter()
+        load()
+        elapsed = time.perf_counter() - start
+        print('%-14s %10.3f %12.0f' % (name, elapsed, args.rows / elapsed))
+
+    # Every row exists now, so each upsert updates a row.
+    start = time.perf_counter()
+    db.bulk_upsert(table, rows)
+    elapsed = time.perf_counter() - start
+    print('%-14s %10.3f %12.0f' % ('bulk_upsert', elapsed,
+                                   args.rows / elapsed))
+
+    start = time.perf_counter()
+    count = sum(1 for _ in db.stream(table.select(), chunk_size=2000))
+    elapsed = time.perf_counter() - start
+    assert count == args.rows
+    print('%-14s %10.3f %12.0f' % ('stream', elapsed, count / elapsed))
+
+    with db.conn() as conn:
+        conn.execute(
+            'DROP TABLE {}.bench_note'.format(
+                db.quotedIdentifier(db._get_schema_name())))
+
+
+if __name__ == '__main__':
+    main()
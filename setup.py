@@ -12,9 +12,9 @@ classifiers = [
     'License :: OSI Approved :: Apache Software License',
     'Intended Audience :: Developers',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.3',
-    'Programming Language :: Python :: 3.4',
     'Programming Language :: Python :: 3.5',
+    'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3.7',
     'Operating System :: POSIX',
     'Operating System :: MacOS :: MacOS X',
     'Environment :: Web Environment',
@@ -65,7 +65,10 @@ class Doc(Command):
         rmtree(temp_dir)
 
 extras_require={
-    'zmq': ['pyzmq>=14.7'],
+    'zmq': ['pyzmq>=17.0'],
+    'orjson': ['orjson>=3.0'],
+    'ujson': ['ujson>=2.0'],
+    'brotli': ['brotli>=1.0'],
     'doc': ['Sphinx==1.6.7',
             'sphinx-rtd-theme>=0.2.4',
             'sphinxcontrib-napoleon>=0.6.1',
@@ -91,7 +94,7 @@ setup(
             'websocket-client>=0.32.0',
             'bcrypt==3.1.4',
             'ConfigArgParse>=0.12.0',
-            'werkzeug>=0.11.0',
+            'werkzeug>=0.11.0,<0.17',
             'boto3>=1.4',
             'python-json-logger>=0.1.8',
       ],
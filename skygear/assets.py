@@ -17,6 +17,7 @@ import os
 import shutil
 
 from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import wrap_file
 
 from . import Response
 from .registry import get_registry
@@ -82,4 +83,5 @@ def serve_static_assets(request, basepath):
         raise NotFound()
 
     content_type, _ = mimetypes.guess_type(subpath)
-    return Response(loader.get_asset(subpath), content_type=content_type)
+    return Response(wrap_file(request.environ, loader.open_asset(subpath)),
+                    content_type=content_type)
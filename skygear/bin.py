@@ -16,13 +16,20 @@ import os.path
 import signal
 import sys
 
-from . import commands
+from . import codec, commands
 from .__version__ import __version__
 from .container import SkygearContainer
 from .importutil import LoadException, load_modules
 from .options import parse_args
 from .settings import parse_all as parse_all_settings
-from .transmitter import ConsoleTransport, HttpTransport, ZmqTransport
+from .supervisor import Supervisor
+from .transmitter import (AsyncZmqTransport, ConsoleTransport, HttpTransport,
+                          ZmqTransport)
+from .transmitter.background import configure_hook_executor
+from .transmitter.compression import configure_compression
+from .transmitter.http import listen_socket
+from .utils.db import configure_engine, configure_schema_cache
+from .utils.http import configure_client
 from .utils.logging import (CloudLogFormatter, RequestContextFilter,
                             RequestTagFilter, setLoggerTag)
 
@@ -33,6 +40,19 @@ setLoggerTag(log, 'plugin')
 def main():
     options = parse_args()
     setup_logging(options)
+    codec.set_backend(options.json_codec)
+    configure_client(pool_size=options.http_pool_size,
+                     retries=options.http_retries)
+    configure_engine(pool_size=options.db_pool_size,
+                     max_overflow=options.db_max_overflow,
+                     pool_recycle=options.db_pool_recycle,
+                     pool_pre_ping=options.db_pool_pre_ping)
+    configure_schema_cache(options.db_schema_cache)
+    configure_hook_executor(max_workers=options.async_hook_workers,
+                            max_queue=options.async_hook_queue)
+    configure_compression(enabled=options.compress,
+                          level=options.compress_level,
+                          min_size=options.compress_min_size)
     if options.collect_assets:
         load(options)
         parse_all_settings()
@@ -84,18 +104,80 @@ def run_plugin(options):
 
     if options.subprocess is not None:
         transport = ConsoleTransport(options.subprocess)
+    elif options.http and options.http_processes > 1 and not options.debug:
+        log.info("Starting %d worker processes" % options.http_processes)
+        transport = http_transport(options)
+        sock = listen_socket(transport.hostname, transport.port,
+                             options.http_backlog)
+        supervisor = Supervisor(
+            lambda: start_http_transport(options, sock.fileno()),
+            options.http_processes)
+        run_supervisor(supervisor)
+        return
     elif options.http:
-        transport = HttpTransport(options.http_addr, debug=options.debug)
+        if options.http_processes > 1:
+            log.warning('Serving http in a single process in debug mode')
+        transport = http_transport(options)
+    elif options.zmq_processes > 1:
+        log.info("Starting %d worker processes" % options.zmq_processes)
+        supervisor = Supervisor(lambda: start_zmq_transport(options),
+                                options.zmq_processes)
+        run_supervisor(supervisor)
+        return
     else:
-        log.info(
-            "Connecting to address %s" % options.skygear_address)
-        transport = ZmqTransport(options.skygear_address,
-                                 threading=options.zmq_thread_pool,
-                                 limit=options.zmq_thread_limit)
+        transport = zmq_transport(options)
     SkygearContainer.set_default_transport(transport)
     transport.run()
 
 
+def run_supervisor(supervisor):
+    supervisor.run()
+    if supervisor.failed:
+        sys.exit(1)
+
+
+def http_transport(options, fd=None):
+    return HttpTransport(options.http_addr, debug=options.debug,
+                         threads=options.http_threads,
+                         queue_size=options.http_queue,
+                         backlog=options.http_backlog,
+                         timeout=options.http_timeout,
+                         idle_timeout=options.http_idle_timeout,
+                         fd=fd)
+
+
+def start_http_transport(options, fd):
+    """
+    Creates the http transport serving the shared socket in a worker
+    process forked by the supervisor.
+    """
+    transport = http_transport(options, fd)
+    SkygearContainer.set_default_transport(transport)
+    return transport
+
+
+def zmq_transport(options):
+    log.info(
+        "Connecting to address %s" % options.skygear_address)
+    if options.zmq_async:
+        return AsyncZmqTransport(options.skygear_address,
+                                 sockets=options.zmq_async_sockets,
+                                 limit=options.zmq_thread_limit)
+    return ZmqTransport(options.skygear_address,
+                        threading=options.zmq_thread_pool,
+                        limit=options.zmq_thread_limit,
+                        outbound_pool=options.zmq_outbound_pool)
+
+
+def start_zmq_transport(options):
+    """
+    Creates the ZMQ transport in a worker process forked by the supervisor.
+    """
+    transport = zmq_transport(options)
+    SkygearContainer.set_default_transport(transport)
+    return transport
+
+
 def setup_logging(options):
     # TODO: Make it load a stadard python logging config.
     logger = logging.getLogger()
@@ -0,0 +1,273 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+In-process cache of records of the public database.
+
+Once a cache is set as the default cache of `Database`, records fetched
+with `Database.fetch` are read from the cache, and records fetched with
+`Database.fetch` or `Database.query` are stored in the cache. Only records
+of the record types given to the cache are cached:
+
+>>> cache = RecordCache(types=['category'], maxsize=10000, ttl=300)
+>>> Database.set_default_cache(cache)
+
+Records saved or deleted with `Database` are removed from the cache.
+For each cached record type, the cache registers async `after_save` and
+`after_delete` hooks that also remove a record when it is saved or
+deleted by a client or another plugin, without delaying the save.
+
+Records fetched while a record of the same type is removed are not
+stored, as they may have been read before the record was saved.
+
+The cache does not check the access control of records, so it is only
+used by containers without an access token, which act as the plugin
+rather than as a user.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from . import codec
+from .encoding import (_RecordDecoder, deserialize_lazy_record,
+                       serialize_record)
+from .models import RecordID
+from .registry import get_registry
+from .utils import metrics
+from .utils.logging import setLoggerTag
+
+log = logging.getLogger(__name__)
+setLoggerTag(log, 'plugin')
+
+_decode_id = _RecordDecoder().decode_id
+
+
+class CacheBackend:
+    """
+    CacheBackend is the interface of a cache shared by plugin processes,
+    such as a Redis or memcached server. Values are JSON encoded records
+    in bytes, keyed by record ID strings like `note/1`.
+    """
+
+    def get(self, key):
+        """
+        Returns the value of the key, or None if the key is not found.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl):
+        """
+        Sets the value of the key, which expires after `ttl` seconds.
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+
+class RecordCache:
+    """
+    RecordCache keeps recently used records of the record types in
+    `types` in memory, keyed by RecordID. The invalidation hooks of the
+    types are registered with `registry`, or the default registry.
+
+    A record expires `ttl` seconds after it is stored. The least recently
+    used records are evicted when there are more than `maxsize` records,
+    or when the records take more than `max_bytes` bytes when encoded as
+    JSON.
+
+    When `backend` is set, records missing from memory are read from the
+    backend, and records are stored in and removed from the backend as
+    well.
+
+    The number of hits, misses and evictions are reported as the
+    `cache.<name>.hits`, `cache.<name>.misses` and `cache.<name>.evictions`
+    metrics.
+    """
+
+    def __init__(self, types=(), maxsize=1024, ttl=60, max_bytes=None,
+                 backend=None, name='records', registry=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.size_bytes = 0
+        self._types = set()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = metrics.counter('cache.%s.hits' % name,
+                                    'Records found in the cache')
+        self.misses = metrics.counter('cache.%s.misses' % name,
+                                      'Records not found in the cache')
+        self.evictions = metrics.counter('cache.%s.evictions' % name,
+                                         'Records evicted from the cache')
+        for record_type in types:
+            self.watch(record_type, registry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, record_id):
+        """
+        Returns the cached record, or None if the record is not cached.
+        """
+        raw = self.get_raw(record_id)
+        if raw is None:
+            return None
+        return deserialize_lazy_record(raw)
+
+    def set(self, record):
+        self.set_raw(serialize_record(record))
+
+    def get_raw(self, record_id):
+        """
+        Returns the cached record as a dict in the format of
+        skygear-server, or None if the record is not cached.
+        """
+        record_id = _to_record_id(record_id)
+        if record_id.type not in self._types:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(record_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(record_id)
+                self.hits.inc()
+                return entry[1]
+            if entry is not None:
+                self._remove(record_id)
+
+        raw = self._get_from_backend(record_id)
+        if raw is None:
+            self.misses.inc()
+            return None
+        self.hits.inc()
+        self._store(record_id, raw, now)
+        return raw
+
+    def set_raw(self, raw, generations=None):
+        """
+        Stores a record in the format of skygear-server.
+
+        With `generations` returned by `generations` before the record was
+        fetched, the record is not stored if a record of its type has been
+        invalidated since.
+        """
+        record_id = _decode_id(raw['_id'])
+        if record_id.type not in self._types:
+            return
+        if not self._store(record_id, raw, time.monotonic(), generations):
+            return
+        if self.backend is not None:
+            try:
+                self.backend.set(raw['_id'], codec.dumpb(raw), self.ttl)
+            except Exception:
+                log.exception('Failed to store %s in cache backend',
+                              raw['_id'])
+
+    def invalidate(self, record_id):
+        """
+        Removes a record from the cache.
+        """
+        record_id = _to_record_id(record_id)
+        with self._lock:
+            self._generations[record_id.type] = \
+                self._generations.get(record_id.type, 0) + 1
+            if record_id in self._entries:
+                self._remove(record_id)
+        if self.backend is not None:
+            try:
+                self.backend.delete(_encode_id(record_id))
+            except Exception:
+                log.exception('Failed to remove %s from cache backend',
+                              _encode_id(record_id))
+
+    def clear(self):
+        """
+        Removes all records from memory. Records in the backend are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def generations(self):
+        """
+        Returns the number of times records of each type have been
+        invalidated, to be passed to `set_raw` with the records fetched
+        afterwards.
+        """
+        with self._lock:
+            return dict(self._generations)
+
+    def watch(self, record_type, registry=None):
+        """
+        Caches records of the record type, registering async hooks that
+        invalidate them when they are saved or deleted.
+        """
+        registry = registry or get_registry()
+
+        def invalidate(record, original_record, db):
+            self.invalidate(record.id)
+
+        for trigger in ('afterSave', 'afterDelete'):
+            registry.register_hook(
+                'skygear.cache.{}.{}.{}'.format(id(self), record_type,
+                                                trigger),
+                invalidate, type=record_type, trigger=trigger, async_=True)
+        self._types.add(record_type)
+
+    def _store(self, record_id, raw, now, generations=None):
+        size = len(codec.dumpb(raw)) if self.max_bytes else 0
+        with self._lock:
+            if generations is not None and \
+                    generations.get(record_id.type, 0) != \
+                    self._generations.get(record_id.type, 0):
+                return False
+            if record_id in self._entries:
+                self._remove(record_id)
+            self._entries[record_id] = (now + self.ttl, raw, size)
+            self.size_bytes += size
+            while len(self._entries) > self.maxsize or \
+                    (self.max_bytes and self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions.inc()
+        return True
+
+    def _remove(self, record_id):
+        _, _, size = self._entries.pop(record_id)
+        self.size_bytes -= size
+
+    def _get_from_backend(self, record_id):
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(_encode_id(record_id))
+        except Exception:
+            log.exception('Failed to read %s from cache backend',
+                          _encode_id(record_id))
+            return None
+        if value is None:
+            return None
+        return codec.loads(value)
+
+
+def _to_record_id(record_id):
+    if isinstance(record_id, RecordID):
+        return record_id
+    return _decode_id(record_id)
+
+
+def _encode_id(record_id):
+    return record_id.type + '/' + record_id.key
@@ -0,0 +1,191 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+JSON codec of the plugin runtime.
+
+All JSON sent to and received from skygear-server goes through this module.
+The fastest JSON library installed is used, trying `orjson`, then `ujson`
+and then the `json` module of the standard library. The library can be
+chosen with `set_backend`.
+
+`datetime.datetime` objects are encoded as RFC 3339 strings in UTC.
+Integers beyond 64 bits and non-finite floats are encoded by the `json`
+module, which other libraries reject or encode as null.
+"""
+import datetime
+import json
+import math
+import warnings
+
+from .encoding import format_datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def default(obj):
+    """
+    Returns a JSON serializable version of objects that are not supported
+    by the JSON libraries.
+    """
+    if isinstance(obj, datetime.datetime):
+        return format_datetime(obj)
+    warnings.warn('Object of type {} is not JSON serializable, encoding '
+                  'it as null is deprecated'.format(type(obj).__name__),
+                  DeprecationWarning)
+    return None
+
+
+def _has_nonfinite(obj):
+    """
+    Returns whether the object contains a NaN or infinite float.
+    """
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_nonfinite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_nonfinite(v) for v in obj)
+    return False
+
+
+class PayloadEncoder(json.JSONEncoder):
+    def default(self, obj):
+        return default(obj)
+
+
+class JSONBackend:
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=default)
+
+    def dumpb(self, obj):
+        return self.dumps(obj).encode('utf-8')
+
+    def loads(self, data):
+        if not isinstance(data, str):
+            data = bytes(data).decode('utf-8')
+        return json.loads(data)
+
+
+class UJSONBackend(JSONBackend):
+    name = 'ujson'
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(obj, default=default,
+                               escape_forward_slashes=False)
+        except OverflowError:
+            # Integers beyond 64 bits, or non-finite floats
+            return json.dumps(obj, default=default)
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return ujson.loads(data)
+
+
+class ORJSONBackend(JSONBackend):
+    name = 'orjson'
+
+    def __init__(self):
+        # Datetimes are passed to `default` so that they are encoded in
+        # the same way by all backends.
+        self.option = orjson.OPT_PASSTHROUGH_DATETIME | \
+            orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return self.dumpb(obj).decode('utf-8')
+
+    def dumpb(self, obj):
+        try:
+            data = orjson.dumps(obj, default=default, option=self.option)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits
+            return json.dumps(obj, default=default).encode('utf-8')
+        # orjson encodes non-finite floats as null
+        if b'null' in data and _has_nonfinite(obj):
+            return json.dumps(obj, default=default).encode('utf-8')
+        return data
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def available_backends():
+    """
+    Returns the names of the installed backends, fastest first.
+    """
+    backends = []
+    if orjson is not None:
+        backends.append(ORJSONBackend.name)
+    if ujson is not None:
+        backends.append(UJSONBackend.name)
+    backends.append(JSONBackend.name)
+    return backends
+
+
+_backend_classes = {
+    cls.name: cls for cls in [ORJSONBackend, UJSONBackend, JSONBackend]
+}
+_backend = None
+
+
+def set_backend(name='auto'):
+    """
+    Selects the JSON library by name. With `auto`, the fastest installed
+    library is selected.
+    """
+    global _backend
+    if name == 'auto':
+        name = available_backends()[0]
+    elif name not in available_backends():
+        raise ValueError('JSON backend {} is not available'.format(name))
+    _backend = _backend_classes[name]()
+
+
+def get_backend():
+    return _backend
+
+
+def dumps(obj):
+    """
+    Encodes the object to a JSON string.
+    """
+    return _backend.dumps(obj)
+
+
+def dumpb(obj):
+    """
+    Encodes the object to UTF-8 encoded JSON bytes.
+    """
+    return _backend.dumpb(obj)
+
+
+def loads(data):
+    """
+    Decodes JSON from a string, or UTF-8 encoded bytes.
+    """
+    return _backend.loads(data)
+
+
+set_backend()
@@ -12,37 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import datetime
-import json
+import asyncio
 import logging
+from functools import partial
 
-import requests
-import strict_rfc3339
-
+from . import codec
 from .__version__ import __version__
+from .codec import PayloadEncoder  # noqa: F401
 from .database import Database
+from .utils.http import get_client
 from .utils.logging import setLoggerTag
 
 log = logging.getLogger(__name__)
 setLoggerTag(log, 'plugin')
 
 
-class PayloadEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime.datetime):
-            ts = obj.timestamp()
-            return strict_rfc3339.timestamp_to_rfc3339_utcoffset(ts)
-
-
 def send_action(url, payload, timeout=60):
     log.error("skygear.container.send_action is deprecated.\n"
               "Please use SkygearContainer().send_action instead.")
     headers = {'Content-type': 'application/json',
                'Accept': 'application/json',
                'X-Skygear-SDK-Version': 'py-skygear/' + __version__}
-    _data = json.dumps(payload, cls=PayloadEncoder)
-    return requests.post(url, data=_data, headers=headers, timeout=timeout) \
-        .json()
+    _data = codec.dumpb(payload)
+    resp = get_client().post(url, _data, headers=headers, timeout=timeout)
+    return codec.loads(resp.content)
 
 
 class SkygearContainer(object):
@@ -118,3 +111,24 @@ class SkygearContainer(object):
         payload = self._payload(action_name, params, plugin_request)
         resp = self.transport.send_action(action_name, payload, url, timeout)
         return resp
+
+    async def send_action_async(self, action_name, params,
+                                plugin_request=False, timeout=60):
+        """
+        Sends an action without blocking the event loop. Actions sent with
+        `send_action_async` can be in flight at the same time:
+
+        >>> results = await asyncio.gather(
+        ...     container.send_action_async('record:fetch', params1),
+        ...     container.send_action_async('record:fetch', params2))
+        """
+        url = self._request_url(action_name)
+        payload = self._payload(action_name, params, plugin_request)
+        if hasattr(self.transport, 'send_action_async'):
+            return await self.transport.send_action_async(action_name,
+                                                          payload, url,
+                                                          timeout)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, partial(self.transport.send_action, action_name, payload,
+                          url, timeout))
@@ -12,11 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import contextlib
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from .asset import get_signer
-from .encoding import deserialize_record, serialize_record
-from .error import RecordQueryInvalid, SkygearException
-from .models import Record
+from .encoding import deserialize_lazy_record, serialize_record
+from .error import RecordQueryInvalid, SkygearException, UnexpectedError
+from .models import Record, RecordID
+from .query import Query
+from .utils.context import current_context, start_context
 
 
 class Database(object):
@@ -29,10 +36,39 @@ class Database(object):
 
     """
 
+    _default_cache = None
+
     def __init__(self, container, database_id):
         self.container = container
         self.database_id = database_id
 
+    @classmethod
+    def set_default_cache(cls, cache):
+        """Set the RecordCache of the public database.
+
+        Records of the public database fetched with `fetch` or `query`
+        are stored in the cache, and `fetch` reads records from the cache
+        before asking skygear server. Set to None to stop caching.
+        """
+        cls._default_cache = cache
+
+    @property
+    def cache(self):
+        """
+        RecordCache of this database, or None if records are not cached.
+        Private databases are never cached, and neither are the records
+        of a container with an access token, which are subject to the
+        access control of its user.
+        """
+        if getattr(self.container, 'access_token', None):
+            return None
+        return self._shared_cache()
+
+    def _shared_cache(self):
+        if self.database_id != '_public':
+            return None
+        return Database._default_cache
+
     def save(self, arg, atomic=False):
         """Save Function.
 
@@ -47,21 +83,126 @@ class Database(object):
             SkygearException: If skygear server returns an error.
         """
 
+        payload = self._save_payload(arg, atomic)
+        with self._invalidating(r.get('_id') for r in payload['records']):
+            return self.container.send_action('record:save', payload)
+
+    async def save_async(self, arg, atomic=False):
+        """Save records without blocking the event loop.
+
+        See `save`.
+        """
+        payload = self._save_payload(arg, atomic)
+        with self._invalidating(r.get('_id') for r in payload['records']):
+            return await self.container.send_action_async('record:save',
+                                                          payload)
+
+    def _save_payload(self, arg, atomic):
         if not isinstance(arg, list):
             arg = [arg]
         records = [serialize_record(item)
                    if isinstance(item, Record) else item
                    for item in arg]
-        return self.container.send_action('record:save', {
+        return {
             'database_id': self.database_id,
             'records': records,
             'atomic': atomic
-        })
+        }
 
     @staticmethod
     def _encode_id(record_id):
         return record_id.type + "/" + record_id.key
 
+    def save_many(self, records, chunk_size=500, concurrency=4,
+                  atomic=False):
+        """Save many records in chunks.
+
+        The records are split into chunks of `chunk_size` records, each
+        saved with its own request. Up to `concurrency` chunks are saved
+        at the same time. A chunk that fails does not stop the other
+        chunks from being saved.
+
+        Atomic saves cannot be split, so an atomic save of more than
+        `chunk_size` records is refused.
+
+        Args:
+            records (list): A list of records
+            chunk_size (int): Number of records saved in each request
+            concurrency (int): Number of requests in flight
+            atomic (bool): Atomic save if true. Defaults to False
+
+        Returns:
+            BulkResult: The result and error of each record, in order
+
+        Raises:
+            ValueError: If an atomic save has more than `chunk_size`
+                records.
+        """
+        _check_atomic_chunk(records, chunk_size, atomic)
+        return self._run_chunks(
+            lambda chunk: self.save(chunk, atomic=atomic),
+            records, chunk_size, concurrency)
+
+    async def save_many_async(self, records, chunk_size=500, concurrency=4,
+                              atomic=False):
+        """Save many records in chunks without blocking the event loop.
+
+        See `save_many`.
+        """
+        _check_atomic_chunk(records, chunk_size, atomic)
+        return await _run_chunks_async(
+            lambda chunk: self.save_async(chunk, atomic=atomic),
+            records, chunk_size, concurrency)
+
+    def delete_many(self, records, chunk_size=500, concurrency=4):
+        """Delete many records in chunks.
+
+        The records are split into chunks of `chunk_size` records, each
+        deleted with its own request. Up to `concurrency` chunks are
+        deleted at the same time.
+
+        Args:
+            records (list): List of records or ID
+            chunk_size (int): Number of records deleted in each request
+            concurrency (int): Number of requests in flight
+
+        Returns:
+            BulkResult: The result and error of each record, in order
+        """
+        return self._run_chunks(self.delete, records, chunk_size,
+                                concurrency)
+
+    async def delete_many_async(self, records, chunk_size=500,
+                                concurrency=4):
+        """Delete many records in chunks without blocking the event loop.
+
+        See `delete_many`.
+        """
+        return await _run_chunks_async(self.delete_async, records,
+                                       chunk_size, concurrency)
+
+    def _run_chunks(self, send, records, chunk_size, concurrency):
+        chunks = [records[i:i + chunk_size]
+                  for i in range(0, len(records), chunk_size)]
+        result = BulkResult()
+        if len(chunks) <= 1 or concurrency <= 1:
+            for chunk in chunks:
+                result.add_chunk(chunk, _call(send, chunk))
+            return result
+        # Chunks are sent from executor threads in the request context of
+        # the caller, as a single chunk is.
+        ctx = current_context()
+
+        def send_in_context(chunk):
+            with start_context(ctx):
+                return _call(send, chunk)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            responses = executor.map(send_in_context, chunks)
+            for chunk, response in zip(chunks, responses):
+                result.add_chunk(chunk, response)
+        return result
+
     def delete(self, arg):
         """
         Delete records.
@@ -76,16 +217,122 @@ class Database(object):
         Raises:
             SkygearException: If skygear server returns an error.
         """
+        payload = self._delete_payload(arg)
+        with self._invalidating(payload['ids']):
+            return self.container.send_action('record:delete', payload)
+
+    async def delete_async(self, arg):
+        """Delete records without blocking the event loop.
+
+        See `delete`.
+        """
+        payload = self._delete_payload(arg)
+        with self._invalidating(payload['ids']):
+            return await self.container.send_action_async('record:delete',
+                                                          payload)
+
+    def _delete_payload(self, arg):
         if not isinstance(arg, list):
             arg = [arg]
         ids = [Database._encode_id(item.id)
                if isinstance(item, Record)
                else item
                for item in arg]
-        return self.container.send_action('record:delete', {
+        return {
             'database_id': self.database_id,
             'ids': ids
+        }
+
+    def _cache_generations(self):
+        """
+        Returns the generations of the cache before records are fetched,
+        so that records invalidated in the meantime are not cached.
+        """
+        cache = self.cache
+        return cache.generations() if cache is not None else None
+
+    @contextlib.contextmanager
+    def _invalidating(self, ids):
+        """
+        Removes records from the cache before and after they are saved or
+        deleted, so that a fetch in between does not cache them again.
+        Records saved with an access token are removed as well.
+        """
+        cache = self._shared_cache()
+        ids = [record_id for record_id in ids if record_id]
+        if cache is None:
+            yield
+            return
+        for record_id in ids:
+            cache.invalidate(record_id)
+        try:
+            yield
+        finally:
+            for record_id in ids:
+                cache.invalidate(record_id)
+
+    def fetch(self, arg):
+        """Fetch records by ID.
+
+        Records found in the cache of the database are not fetched from
+        skygear server again. See `set_default_cache`.
+
+        Args:
+            arg (list): List of RecordID or ID string
+
+        Returns:
+            list: List of Record, in the order of the IDs. The item is
+            None if the record is not found.
+
+        Raises:
+            SkygearException: If skygear server returns an error.
+        """
+        if not isinstance(arg, list):
+            arg = [arg]
+        ids = [Database._encode_id(item)
+               if isinstance(item, RecordID) else item
+               for item in arg]
+        found = self._fetch_cached(ids)
+        missing = [i for i in dict.fromkeys(ids) if i not in found]
+        if missing:
+            found.update(self._fetch_raw(missing))
+        return [deserialize_lazy_record(found[i]) if i in found else None
+                for i in ids]
+
+    def _fetch_cached(self, ids):
+        """
+        Returns the records found in the cache, keyed by ID.
+        """
+        cache = self.cache
+        found = {}
+        if cache is not None:
+            for record_id in ids:
+                raw = cache.get_raw(record_id)
+                if raw is not None:
+                    found[record_id] = raw
+        return found
+
+    def _fetch_raw(self, ids):
+        """
+        Fetches records from skygear server, returning the records found
+        keyed by ID and storing them in the cache.
+        """
+        generations = self._cache_generations()
+        result = self.container.send_action('record:fetch', {
+            'database_id': self.database_id,
+            'ids': ids,
         })
+        if 'error' in result:
+            raise SkygearException.from_dict(result['error'])
+        cache = self.cache
+        found = {}
+        for raw in result.get('result', []):
+            if raw.get('_type') == 'error':
+                continue
+            found[raw['_id']] = raw
+            if cache is not None:
+                cache.set_raw(raw, generations)
+        return found
 
     def query(self, query):
         """Query records.
@@ -94,38 +341,157 @@ class Database(object):
             query (Query): Query object
 
         Returns:
-            list: List of Record
+            list: List of Record, whose fields are decoded on first
+            access
 
         Raises:
             SkygearException: If skygear server returns an error.
         """
 
+        records, _ = self._query(query, query.offset, query.limit,
+                                 query.count)
+        return records
+
+    async def query_async(self, query):
+        """Query records without blocking the event loop.
+
+        See `query`.
+        """
+        payload = self._query_payload(query, query.offset, query.limit,
+                                      query.count)
+        generations = self._cache_generations()
+        result = await self.container.send_action_async('record:query',
+                                                        payload)
+        records, _ = self._query_result(result, generations)
+        return records
+
+    async def query_many_async(self, queries):
+        """Run queries at the same time.
+
+        Example:
+
+        >>> notes, comments = await database.query_many_async([
+        ...     Query('note'), Query('comment')])
+
+        Args:
+            queries (list): List of Query objects
+
+        Returns:
+            list: List of the records of each query, in order
+
+        Raises:
+            SkygearException: If skygear server returns an error for any
+                query.
+        """
+        return await asyncio.gather(*[self.query_async(q) for q in queries])
+
+    def iter_query(self, query, page_size=None, prefetch=False,
+                   keyset=False):
+        """Iterate over records matching a query, a page at a time.
+
+        Pages are fetched with `page_size` records, starting from
+        `query.offset`, until a page is empty, or until all records are
+        fetched when the query has `count` set.
+        Only the current page, and the next page when prefetching, are
+        kept in memory.
+
+        Example:
+
+        >>> records = database.iter_query(Query('note', count=True))
+        >>> records.count
+        1024
+        >>> for record in records:
+        ...     print(record['content'])
+
+        Args:
+            query (Query): Query object
+            page_size (int): Number of records fetched in each request.
+                Defaults to `query.limit`.
+            prefetch (bool): Fetch the next page in the background while
+                the current page is iterated.
+            keyset (bool): Continue each page after the last record of the
+                previous page with `Query.seek_after` instead of an
+                offset. `_id` is added to the sort order of the query.
+
+        Returns:
+            QueryIterator: Iterator of Record
+
+        Raises:
+            SkygearException: If skygear server returns an error.
+        """
+        return QueryIterator(self, query, page_size or query.limit or 50,
+                             prefetch, keyset)
+
+    def walk(self, record_type, predicate=None, page_size=100,
+             prefetch=False):
+        """Iterate over all records of a record type.
+
+        Records are fetched in the order of `_id`, a page at a time. Each
+        page continues after the last record of the previous page, so
+        every page costs the same to fetch however deep into the record
+        type it is.
+
+        Example:
+
+        >>> for record in database.walk('note'):
+        ...     export(record)
+
+        Args:
+            record_type (str): Record type
+            predicate (Predicate): Only iterate over the matching records
+            page_size (int): Number of records fetched in each request
+            prefetch (bool): Fetch the next page in the background while
+                the current page is iterated.
+
+        Returns:
+            QueryIterator: Iterator of Record
+
+        Raises:
+            SkygearException: If skygear server returns an error.
+        """
+        query = Query(record_type, predicate=predicate, limit=page_size)
+        return self.iter_query(query, prefetch=prefetch, keyset=True)
+
+    def _query(self, query, offset, limit, count):
+        payload = self._query_payload(query, offset, limit, count)
+        generations = self._cache_generations()
+        result = self.container.send_action('record:query', payload)
+        return self._query_result(result, generations)
+
+    def _query_payload(self, query, offset, limit, count):
         include = {v: {"$type": "keypath", "$val": v}
                    for v in list(set(query.include))}
 
         payload = {'database_id': self.database_id,
                    'record_type': query.record_type,
-                   'predicate': query.predicate.to_dict(),
-                   'count': query.count,
+                   'predicate': query.effective_predicate().to_dict(),
+                   'count': count,
                    'sort': query.sort,
                    'include': include}
 
-        if query.offset is not None:
-            payload['offset'] = query.offset
-        if query.limit is not None:
-            payload['limit'] = query.limit
-        result = self.container.send_action('record:query', payload)
+        if offset is not None:
+            payload['offset'] = offset
+        if limit is not None:
+            payload['limit'] = limit
+        return payload
+
+    def _query_result(self, result, generations=None):
         if 'error' in result:
             raise SkygearException(result['error']['message'],
                                    code=RecordQueryInvalid)
+        info = result.get('info', {})
         result = result['result']
         output = []
         signer = None
+        cache = self.cache
         for r in result:
-            record = deserialize_record(r)
+            if cache is not None:
+                cache.set_raw({k: v for k, v in r.items()
+                               if k != '_transient'}, generations)
+            record = deserialize_lazy_record(r)
             if '_transient' in r:
                 t = r['_transient']
-                record['_transient'] = {k: deserialize_record(t[k])
+                record['_transient'] = {k: deserialize_lazy_record(t[k])
                                         for k in t.keys()}
             if 'attachment' in r:
                 if signer is None:
@@ -134,4 +500,216 @@ class Database(object):
                 record['attachment']['$url'] =\
                     signer.sign(r['attachment']['$name'])
             output.append(record)
-        return output
+        return output, info
+
+
+def _call(send, chunk):
+    try:
+        return send(chunk)
+    except SkygearException as e:
+        return {'error': e.as_dict()}
+    except Exception as e:
+        return {'error': SkygearException(str(e)).as_dict()}
+
+
+def _check_atomic_chunk(records, chunk_size, atomic):
+    if atomic and len(records) > chunk_size:
+        raise ValueError('atomic save of {} records cannot be split '
+                         'into chunks of {}'.format(len(records), chunk_size))
+
+
+async def _call_async(send, chunk, semaphore):
+    async with semaphore:
+        try:
+            return await send(chunk)
+        except SkygearException as e:
+            return {'error': e.as_dict()}
+        except Exception as e:
+            return {'error': SkygearException(str(e)).as_dict()}
+
+
+async def _run_chunks_async(send, records, chunk_size, concurrency):
+    chunks = [records[i:i + chunk_size]
+              for i in range(0, len(records), chunk_size)]
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    responses = await asyncio.gather(*[_call_async(send, chunk, semaphore)
+                                       for chunk in chunks])
+    result = BulkResult()
+    for chunk, response in zip(chunks, responses):
+        result.add_chunk(chunk, response)
+    return result
+
+
+class BulkResult:
+    """
+    BulkResult collects the result of each record of `Database.save_many`
+    and `Database.delete_many`.
+
+    `results` and `errors` have one item for each record, in the order of
+    the records. For a record that is saved or deleted, the item of
+    `results` is the record returned by skygear server, and the item of
+    `errors` is None. For a record that failed, the item of `results` is
+    None and the item of `errors` is a SkygearException.
+    """
+
+    def __init__(self):
+        self.results = []
+        self.errors = []
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def ok(self):
+        """
+        True if no record failed.
+        """
+        return not any(self.errors)
+
+    @property
+    def failed(self):
+        """
+        Indexes of the records that failed.
+        """
+        return [i for i, e in enumerate(self.errors) if e is not None]
+
+    def add_chunk(self, chunk, response):
+        if 'error' in response:
+            error = SkygearException.from_dict(response['error'])
+            self.results.extend([None] * len(chunk))
+            self.errors.extend([error] * len(chunk))
+            return
+
+        items = response.get('result', [])
+        if len(items) != len(chunk):
+            error = SkygearException(
+                'expected {} results, got {}'.format(len(chunk), len(items)),
+                code=UnexpectedError)
+            items = [{'_type': 'error', **error.as_dict()}] * len(chunk)
+        for item in items:
+            if item.get('_type') == 'error':
+                self.results.append(None)
+                self.errors.append(SkygearException.from_dict(item))
+            else:
+                self.results.append(item)
+                self.errors.append(None)
+
+
+class QueryIterator:
+    """
+    QueryIterator iterates over the records matching a query, fetching
+    them from skygear server a page at a time.
+
+    When the query has `count` set, the total number of matching records
+    is available as `count`.
+
+    With `keyset`, each page is fetched with `Query.seek_after` the last
+    record of the previous page, instead of an offset.
+    """
+
+    def __init__(self, database, query, page_size, prefetch=False,
+                 keyset=False):
+        self.database = database
+        self.query = query
+        self.page_size = page_size
+        self.keyset = keyset
+        self._offset = query.offset or 0
+        if keyset:
+            self.query = query.copy().add_tiebreaker()
+            self._offset = query.offset
+        self._count = None
+        self._remaining = float('inf')
+        self._page = deque()
+        self._fetched = False
+        self._done = False
+        self._pending = None
+        self._executor = None
+        if prefetch:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            # Stops the prefetch thread of an iterator which is dropped
+            # before it is exhausted or closed.
+            self._finalizer = weakref.finalize(self, self._executor.shutdown,
+                                               wait=False)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._page:
+            if self._done:
+                raise StopIteration
+            self._fetch_next_page()
+        return self._page.popleft()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def count(self):
+        """
+        Total number of records matching the query, or None if the query
+        does not have `count` set.
+        """
+        if not self._fetched and self.query.count:
+            self._fetch_next_page()
+        return self._count
+
+    def close(self):
+        """
+        Stops fetching pages. Records already fetched can still be
+        iterated.
+        """
+        self._done = True
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._executor is not None:
+            self._finalizer()
+            self._executor = None
+
+    def _fetch(self, offset, count):
+        return self.database._query(self.query, offset, self.page_size,
+                                    count)
+
+    def _prefetch(self, ctx, offset):
+        with start_context(ctx):
+            return self._fetch(offset, False)
+
+    def _advance(self, records):
+        if self.keyset:
+            # Later pages continue after the last record instead.
+            self._offset = None
+            if records:
+                self.query.seek_after(records[-1])
+        else:
+            self._offset += len(records)
+
+    def _fetch_next_page(self):
+        if self._pending is not None:
+            records, info = self._pending.result()
+            self._pending = None
+        else:
+            # The total is only counted with the first page.
+            records, info = self._fetch(self._offset,
+                                        self.query.count and not self._fetched)
+        if not self._fetched:
+            self._fetched = True
+            self._count = info.get('count')
+            if self._count is not None:
+                self._remaining = self._count - (self.query.offset or 0)
+
+        self._advance(records)
+        self._page.extend(records)
+        self._remaining -= len(records)
+        # skygear-server may cap the limit of a query below the page size,
+        # so only an empty page, or the count, tells that the records are
+        # exhausted.
+        if not records or self._remaining <= 0:
+            self.close()
+        elif self._executor is not None:
+            # The page is fetched in the request context of the iteration.
+            self._pending = self._executor.submit(
+                self._prefetch, current_context(), self._offset)
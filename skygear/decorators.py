@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import datetime
 from functools import wraps
 
@@ -67,14 +68,39 @@ def handler(name, *args, **kwargs):
     return skygear_handler
 
 
+def _save_hook_func(func):
+    """
+    Returns a hook function that calls `func` and returns the record
+    for user. The hook function is a coroutine function if `func` is.
+    """
+    if asyncio.iscoroutinefunction(func):
+        async def hook_func(record, original_record, db):
+            await func(record, original_record, db)
+            return record
+    else:
+        def hook_func(record, original_record, db):
+            func(record, original_record, db)
+            return record
+    return hook_func
+
+
+def _delete_hook_func(func):
+    if asyncio.iscoroutinefunction(func):
+        async def hook_func(record, original_record, db):
+            await func(record, db)
+            return record
+    else:
+        def hook_func(record, original_record, db):
+            func(record, db)
+            return record
+    return hook_func
+
+
 def hook(trigger, *args, **kwargs):
     kwargs['trigger'] = trigger
 
     def skygear_hook(func):
-        def hook_func(record, original_record, db):
-            # return the record for user
-            func(record, original_record, db)
-            return record
+        hook_func = _save_hook_func(func)
 
         name = kwargs.pop('name', None) or \
             func.__module__ + "." + func.__name__
@@ -86,9 +112,7 @@ def hook(trigger, *args, **kwargs):
 
 
 def register_save_hook(func, *args, **kwargs):
-    def hook_func(record, original_record, db):
-        func(record, original_record, db)
-        return record
+    hook_func = _save_hook_func(func)
 
     name = kwargs.pop('name', None) or \
         func.__module__ + "." + func.__name__
@@ -97,9 +121,7 @@ def register_save_hook(func, *args, **kwargs):
 
 
 def register_delete_hook(func, *args, **kwargs):
-    def hook_func(record, original_record, db):
-        func(record, db)
-        return record
+    hook_func = _delete_hook_func(func)
 
     name = kwargs.pop('name', None) or \
         func.__module__ + "." + func.__name__
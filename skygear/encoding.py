@@ -11,8 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import re
 import traceback
-from datetime import datetime
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+from functools import lru_cache
 
 import strict_rfc3339
 
@@ -33,58 +36,129 @@ def _serialize_exc(e):
         {'trace': traceback.format_exc()})
 
 
+# The format of timestamps sent by skygear-server, which is RFC 3339 in UTC
+# with up to nanosecond precision.
+_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,9}))?Z\Z',
+    re.ASCII)
+
+
+@lru_cache(maxsize=1024)
+def parse_datetime(s):
+    """
+    Parses an RFC 3339 timestamp into a timezone-aware datetime in UTC.
+
+    Timestamps in the format sent by skygear-server are parsed directly,
+    other timestamps are parsed by strict_rfc3339. Recently parsed
+    timestamps are cached.
+    """
+    m = _DATETIME_RE.match(s)
+    if m is not None:
+        year, month, day, hour, minute, second, fraction = m.groups()
+        microsecond = int(fraction[:6].ljust(6, '0')) if fraction else 0
+        try:
+            return datetime(int(year), int(month), int(day),
+                            int(hour), int(minute), int(second),
+                            microsecond, timezone.utc)
+        except ValueError:
+            # Out of range fields such as leap seconds
+            pass
+    ts = strict_rfc3339.rfc3339_to_timestamp(s)
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+def format_datetime(dt):
+    """
+    Formats a datetime as an RFC 3339 timestamp in UTC. A naive datetime
+    is assumed to be in local time.
+    """
+    if dt.tzinfo is None:
+        # astimezone does not take naive datetimes before Python 3.6
+        dt = datetime.fromtimestamp(dt.timestamp(), timezone.utc) \
+            .replace(microsecond=dt.microsecond)
+    else:
+        dt = dt.astimezone(timezone.utc)
+    s = '%04d-%02d-%02dT%02d:%02d:%02d' % (
+        dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+    if dt.microsecond:
+        s += ('.%06d' % dt.microsecond).rstrip('0')
+    return s + 'Z'
+
+
 def deserialize_record(obj):
-    return _RecordDecoder().decode(obj)
+    return _decoder.decode(obj)
 
 
-def deserialize_or_none(obj):
-    if obj:
-        return deserialize_record(obj)
-    else:
+def deserialize_lazy_record(obj):
+    return _decoder.decode_lazy(obj)
+
+
+def deserialize_or_none(obj, lazy=False):
+    if not obj:
         return None
+    elif lazy:
+        return deserialize_lazy_record(obj)
+    else:
+        return deserialize_record(obj)
 
 
 def deserialize_value(value):
-    return _RecordDecoder().decode_value(value)
+    return _decoder.decode_value(value)
 
 
 def serialize_record(record):
-    return _RecordEncoder().encode(record)
+    return _encoder.encode(record)
 
 
 def serialize_value(value):
-    return _RecordEncoder().encode_value(value)
+    return _encoder.encode_value(value)
 
 
 class _RecordDecoder:
+    """
+    Decodes records and values in the format of skygear-server.
+
+    Values of the special types are decoded by the function registered for
+    their `$type` in a dispatch table. The decoder has no state other than
+    the table, so one instance is shared by all threads.
+    """
+    def __init__(self):
+        self._type_decoders = {
+            'date': self.decode_date,
+            'asset': self.decode_asset,
+            'geo': self.decode_location,
+            'ref': self.decode_ref,
+            'unknown': self.decode_unknown_value,
+            'record': self.decode_record,
+        }
+
     def decode(self, d):
-        id = self.decode_id(d['_id'])
-        owner_id = d.get('_ownerID', None)
-        acl = self.decode_acl(d.get('_access', None))
+        decode_value = self.decode_value
+        data = {k: decode_value(v) for k, v in d.items()
+                if not k.startswith('_')}
+        return Record(data=data, **self.decode_metadata(d))
 
+    def decode_lazy(self, d):
+        return LazyRecord(d, self.decode_value, **self.decode_metadata(d))
+
+    def decode_metadata(self, d):
         created_at = None
         if d.get('_created_at', None):
             created_at = self.decode_date_value(d['_created_at'])
-        created_by = d.get('_created_by', None)
 
         updated_at = None
         if d.get('_updated_at', None):
             updated_at = self.decode_date_value(d['_updated_at'])
-        updated_by = d.get('_updated_by', None)
-
-        data_dict = {k: v for k, v in d.items() if not k.startswith('_')}
-
-        data = self.decode_dict(data_dict)
 
-        return Record(
-            id=id,
-            owner_id=owner_id,
-            acl=acl,
-            created_at=created_at,
-            created_by=created_by,
-            updated_at=updated_at,
-            updated_by=updated_by,
-            data=data)
+        return {
+            'id': self.decode_id(d['_id']),
+            'owner_id': d.get('_ownerID', None),
+            'acl': self.decode_acl(d.get('_access', None)),
+            'created_at': created_at,
+            'created_by': d.get('_created_by', None),
+            'updated_at': updated_at,
+            'updated_by': d.get('_updated_by', None),
+        }
 
     def decode_id(self, s):
         ss = s.split('/')
@@ -118,39 +192,40 @@ class _RecordDecoder:
             raise ValueError("invalid ace")
 
     def decode_dict(self, d):
-        return {k: self.decode_value(v) for k, v in d.items()}
+        decode_value = self.decode_value
+        return {k: decode_value(v) for k, v in d.items()}
 
     def decode_list(self, l):
-        return [self.decode_value(v) for v in l]
+        decode_value = self.decode_value
+        return [decode_value(v) for v in l]
 
     def decode_value(self, v):
-        if isinstance(v, dict):
-            type_ = v.get('$type')
-            if type_ == 'date':
-                return self.decode_date(v)
-            elif type_ == 'asset':
-                return self.decode_asset(v)
-            elif type_ == 'geo':
-                return self.decode_location(v)
-            elif type_ == 'ref':
-                return self.decode_ref(v)
-            elif type_ == 'unknown':
-                return self.decode_unknown_value(v)
-            elif type_ == 'record':
-                return self.decode_record(v)
+        # Exact type checks first, as JSON decoders only return plain
+        # dicts and lists.
+        cls = type(v)
+        if cls is not dict and cls is not list:
+            if isinstance(v, dict):
+                cls = dict
+            elif isinstance(v, list):
+                cls = list
             else:
-                return self.decode_dict(v)
-        elif isinstance(v, list):
+                return v
+        if cls is list:
             return self.decode_list(v)
-        else:
-            return v
+        try:
+            decoder = self._type_decoders.get(v.get('$type'))
+        except TypeError:
+            # $type is not hashable, so it is not a special type
+            decoder = None
+        if decoder is None:
+            return self.decode_dict(v)
+        return decoder(v)
 
     def decode_date(self, d):
         return self.decode_date_value(d['$date'])
 
     def decode_date_value(self, s):
-        ts = strict_rfc3339.rfc3339_to_timestamp(s)
-        return datetime.fromtimestamp(ts)
+        return parse_datetime(s)
 
     def decode_asset(self, d):
         return Asset(d['$name'], d.get('$content_type', None))
@@ -169,8 +244,35 @@ class _RecordDecoder:
 
 
 class _RecordEncoder:
+    """
+    Encodes records and values in the format of skygear-server.
+
+    Values are encoded by the function registered for their type in a
+    dispatch table. The function found for a class, following its MRO, is
+    cached so that each value is encoded with a single dict lookup. Values
+    of other types are returned as is.
+    """
+    def __init__(self):
+        self._type_encoders = {
+            dict: self.encode_dict,
+            list: self.encode_list,
+            datetime: self.encode_datetime,
+            Asset: self.encode_asset,
+            Location: self.encode_location,
+            Reference: self.encode_ref,
+            UnknownValue: self.encode_unknown_value,
+            Record: self.encode_record,
+        }
+        self._encoders = {
+            cls: None for cls in (str, int, float, bool, type(None))
+        }
+        self._encoders.update(self._type_encoders)
+
     def encode(self, record):
-        d = self.encode_dict(record.data)
+        if isinstance(record, LazyRecord) and record.is_lazy:
+            d = record._data.encode(self.encode_value)
+        else:
+            d = self.encode_dict(record.data)
         d['_id'] = self.encode_id(record.id)
         if record.owner_id:
             d['_ownerID'] = record.owner_id
@@ -218,34 +320,33 @@ class _RecordEncoder:
             raise ValueError('Unknown type of ACE = %s', type(ace))
 
     def encode_dict(self, d):
-        return {k: self.encode_value(v) for k, v in d.items()}
+        encode_value = self.encode_value
+        return {k: encode_value(v) for k, v in d.items()}
 
     def encode_list(self, l):
-        return [self.encode_value(v) for v in l]
+        encode_value = self.encode_value
+        return [encode_value(v) for v in l]
 
     def encode_value(self, v):
-        if isinstance(v, dict):
-            return self.encode_dict(v)
-        elif isinstance(v, list):
-            return self.encode_list(v)
-        elif isinstance(v, datetime):
-            return self.encode_datetime(v)
-        elif isinstance(v, Asset):
-            return self.encode_asset(v)
-        elif isinstance(v, Location):
-            return self.encode_location(v)
-        elif isinstance(v, Reference):
-            return self.encode_ref(v)
-        elif isinstance(v, UnknownValue):
-            return self.encode_unknown_value(v)
-        elif isinstance(v, Record):
-            return self.encode_record(v)
-        else:
+        try:
+            encoder = self._encoders[type(v)]
+        except KeyError:
+            encoder = self._encoder_for_class(type(v))
+        if encoder is None:
             return v
+        return encoder(v)
+
+    def _encoder_for_class(self, cls):
+        encoder = None
+        for base in cls.__mro__:
+            if base in self._type_encoders:
+                encoder = self._type_encoders[base]
+                break
+        self._encoders[cls] = encoder
+        return encoder
 
     def _encode_datetime(self, dt):
-        ts = dt.timestamp()
-        return strict_rfc3339.timestamp_to_rfc3339_utcoffset(ts)
+        return format_datetime(dt)
 
     def encode_datetime(self, dt):
         return {
@@ -286,3 +387,106 @@ class _RecordEncoder:
             '$type': 'record',
             '$record': self.encode(record)
         }
+
+
+class LazyFields(MutableMapping):
+    """
+    LazyFields holds the fields of a record in their wire format, and
+    decodes a field when it is first accessed.
+
+    Fields that are never accessed or assigned are encoded by passing
+    through their original wire value.
+    """
+    def __init__(self, raw, decode_value):
+        self._raw = raw
+        self._decode_value = decode_value
+        self._values = {}
+        self._deleted = set()
+
+    def _has_raw(self, key):
+        return isinstance(key, str) and not key.startswith('_') \
+            and key in self._raw and key not in self._deleted
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            if not self._has_raw(key):
+                raise
+        value = self._values[key] = self._decode_value(self._raw[key])
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if self._has_raw(key):
+            self._deleted.add(key)
+            self._values.pop(key, None)
+        else:
+            del self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values or self._has_raw(key)
+
+    def __iter__(self):
+        for key in self._raw:
+            if self._has_raw(key):
+                yield key
+        for key in self._values:
+            if not self._has_raw(key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self))
+
+    def copy(self):
+        return dict(self)
+
+    def encode(self, encode_value):
+        """
+        Returns the fields in wire format, encoding the fields that have
+        been accessed or assigned with `encode_value`.
+        """
+        values = self._values
+        return {k: encode_value(values[k]) if k in values else self._raw[k]
+                for k in self}
+
+
+class LazyRecord(Record):
+    """
+    LazyRecord is a Record which decodes its fields on first access.
+
+    The metadata of the record, such as its ID and ACL, are decoded when
+    the record is created. Fields that are never accessed are serialized
+    with their original wire value.
+
+    `data` is a dict as with Record, so accessing it decodes all the
+    fields.
+    """
+    __slots__ = ()
+
+    def __init__(self, raw, decode_value, **kwargs):
+        super().__init__(**kwargs)
+        self._data = LazyFields(raw, decode_value)
+
+    @property
+    def is_lazy(self):
+        """
+        Whether the fields have not been decoded all at once by `data`.
+        """
+        return isinstance(self._data, LazyFields)
+
+    @property
+    def data(self):
+        if self.is_lazy:
+            self._data = self._data.copy()
+        return self._data
+
+
+_decoder = _RecordDecoder()
+_encoder = _RecordEncoder()
@@ -13,7 +13,35 @@
 # limitations under the License.
 
 
+class _Value:
+    """
+    Base class of models that are compared and hashed by the values of the
+    attributes named in `_fields`.
+
+    A value must not be modified while it is in a set or used as a dict
+    key.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def _values(self):
+        return tuple(getattr(self, f) for f in self._fields)
+
+    def __eq__(self, other):
+        # Values of different classes, including a subclass and its base
+        # class, are never equal, as their hashes differ.
+        if type(self) is type(other):
+            return self._values() == other._values()
+        return False
+
+    def __hash__(self):
+        return hash((type(self),) + self._values())
+
+
 class Record:
+    __slots__ = ('_id', '_owner_id', '_acl', '_created_at', '_created_by',
+                 '_updated_at', '_updated_by', '_data')
+
     def __init__(
             self, id, owner_id, acl,
             created_at=None, created_by=None,
@@ -89,7 +117,10 @@ class Record:
 
 # RecordID is immutable. Developer is not expected to modify a record's id
 # once instantiated
-class RecordID:
+class RecordID(_Value):
+    __slots__ = ('_type', '_key')
+    _fields = ('_type', '_key')
+
     def __init__(self, type_, key):
         if not type_:
             raise ValueError('RecordID.type cannot be None or empty')
@@ -106,17 +137,15 @@ class RecordID:
     def key(self):
         return self._key
 
-    def __eq__(self, other):
-        if isinstance(self, other.__class__):
-            return self.__dict__ == other.__dict__
-        return False
-
 
 ACCESS_CONTROL_ENTRY_LEVEL_WRITE = 'write'
 ACCESS_CONTROL_ENTRY_LEVEL_READ = 'read'
 
 
-class AccessControlEntry:
+class AccessControlEntry(_Value):
+    __slots__ = ('level',)
+    _fields = ('level',)
+
     def __init__(self, level):
         self.level = level
 
@@ -126,29 +155,43 @@ ACCESS_CONTROL_ENTRY_RELATION_FOLLOW = 'follow'
 
 
 class PublicAccessControlEntry(AccessControlEntry):
+    __slots__ = ()
+
     def __init__(self, level):
         super().__init__(level)
 
 
 class RelationalAccessControlEntry(AccessControlEntry):
+    __slots__ = ('relation',)
+    _fields = ('level', 'relation')
+
     def __init__(self, relation, level):
         super().__init__(level)
         self.relation = relation
 
 
 class RoleAccessControlEntry(AccessControlEntry):
+    __slots__ = ('role',)
+    _fields = ('level', 'role')
+
     def __init__(self, role, level):
         super().__init__(level)
         self.role = role
 
 
 class DirectAccessControlEntry(AccessControlEntry):
+    __slots__ = ('user_id',)
+    _fields = ('level', 'user_id')
+
     def __init__(self, user_id, level):
         super().__init__(level)
         self.user_id = user_id
 
 
-class Asset:
+class Asset(_Value):
+    __slots__ = ('_name', 'content_type')
+    _fields = ('_name', 'content_type')
+
     def __init__(self, name, content_type):
         self.name = name
         self.content_type = content_type
@@ -163,24 +206,20 @@ class Asset:
             raise ValueError('Asset.name cannot be None or empty')
         self._name = name
 
-    def __eq__(self, other):
-        if isinstance(self, other.__class__):
-            return self.__dict__ == other.__dict__
-        return False
 
+class Location(_Value):
+    __slots__ = ('lng', 'lat')
+    _fields = ('lng', 'lat')
 
-class Location:
     def __init__(self, lng, lat):
         self.lng = lng
         self.lat = lat
 
-    def __eq__(self, other):
-        if isinstance(self, other.__class__):
-            return self.__dict__ == other.__dict__
-        return False
 
+class Reference(_Value):
+    __slots__ = ('_recordID',)
+    _fields = ('_recordID',)
 
-class Reference:
     def __init__(self, recordID):
         self.recordID = recordID
 
@@ -194,13 +233,11 @@ class Reference:
             raise ValueError('Reference.recordID cannot be None')
         self._recordID = recordID
 
-    def __eq__(self, other):
-        if isinstance(self, other.__class__):
-            return self.__dict__ == other.__dict__
-        return False
 
+class UnknownValue(_Value):
+    __slots__ = ('_underlyingType',)
+    _fields = ('_underlyingType',)
 
-class UnknownValue:
     def __init__(self, underlyingType):
         self.underlyingType = underlyingType
 
@@ -211,8 +248,3 @@ class UnknownValue:
     @underlyingType.setter
     def underlyingType(self, underlyingType):
         self._underlyingType = underlyingType
-
-    def __eq__(self, other):
-        if isinstance(self, other.__class__):
-            return self.__dict__ == other.__dict__
-        return False
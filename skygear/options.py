@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import sys
 
 import configargparse as argparse
 
@@ -47,6 +48,16 @@ def add_skygear_arguments(ap: argparse.ArgumentParser):
                     env_var='PUBSUB_URL',
                     help="The URL of the pubsub server, should start with "
                          "ws:// or wss:// and include the path")
+    ap.add_argument('--http-pool-size', metavar='HTTP_POOL_SIZE',
+                    action='store', default=10, type=int,
+                    help='Max number of connections kept open to each '
+                         'skygear-server host for sending actions',
+                    env_var='HTTP_POOL_SIZE')
+    ap.add_argument('--http-retries', metavar='HTTP_RETRIES',
+                    action='store', default=2, type=int,
+                    help='Number of times an idempotent action is retried '
+                         'when skygear-server cannot be reached',
+                    env_var='HTTP_RETRIES')
 
 
 def add_static_asset_arguments(ap: argparse.ArgumentParser):
@@ -75,6 +86,40 @@ def add_plugin_arguments(ap: argparse.ArgumentParser):
                     help='Address where http web server listen to. In the \
                     format of {HOST}:{PORT}.',
                     env_var='HTTP_ADDR')
+    ap.add_argument('--http-threads', metavar='HTTP_THREADS',
+                    action='store',
+                    default=0, type=int,
+                    help='Number of threads serving http requests, 0 to '
+                         'use the werkzeug development server (default)',
+                    env_var='HTTP_THREADS')
+    ap.add_argument('--http-queue', metavar='HTTP_QUEUE',
+                    action='store',
+                    default=64, type=int,
+                    help='Number of accepted http connections waiting for '
+                         'a thread',
+                    env_var='HTTP_QUEUE')
+    ap.add_argument('--http-backlog', metavar='HTTP_BACKLOG',
+                    action='store',
+                    default=128, type=int,
+                    help='Listen backlog of the http server',
+                    env_var='HTTP_BACKLOG')
+    ap.add_argument('--http-timeout', metavar='HTTP_TIMEOUT',
+                    action='store',
+                    default=30, type=int,
+                    help='Seconds to wait for a http request to be read',
+                    env_var='HTTP_TIMEOUT')
+    ap.add_argument('--http-idle-timeout', metavar='HTTP_IDLE_TIMEOUT',
+                    action='store',
+                    default=2, type=float,
+                    help='Seconds an idle keep-alive http connection is '
+                         'kept open, holding a thread',
+                    env_var='HTTP_IDLE_TIMEOUT')
+    ap.add_argument('--http-processes', metavar='HTTP_PROCESSES',
+                    action='store',
+                    default=1, type=int,
+                    help='Number of worker processes forked to serve http '
+                         'requests on a shared socket',
+                    env_var='HTTP_PROCESSES')
     ap.add_argument('--zmq-thread-pool', metavar='ZMQ_THREAD_POOL',
                     action='store',
                     default=4, type=int,
@@ -85,6 +130,62 @@ def add_plugin_arguments(ap: argparse.ArgumentParser):
                     default=10, type=int,
                     help='Max number of thread in ZMQTransport thread pool',
                     env_var='ZMQ_THREAD_LIMIT')
+    ap.add_argument('--zmq-outbound-pool', metavar='ZMQ_OUTBOUND_POOL',
+                    action='store',
+                    default=2, type=int,
+                    help='Number of sockets kept open by ZMQTransport for '
+                         'requests sent to skygear-server outside of a '
+                         'request',
+                    env_var='ZMQ_OUTBOUND_POOL')
+    ap.add_argument('--zmq-processes', metavar='ZMQ_PROCESSES',
+                    action='store',
+                    default=1, type=int,
+                    help='Number of worker processes forked to run '
+                         'ZMQTransport, each with its own thread pool',
+                    env_var='ZMQ_PROCESSES')
+    ap.add_argument('--zmq-async', action='store_true',
+                    help='Serve with the asyncio ZMQ transport, which '
+                         'supports async def extension points',
+                    env_var='ZMQ_ASYNC')
+    ap.add_argument('--zmq-async-sockets', metavar='ZMQ_ASYNC_SOCKETS',
+                    action='store',
+                    default=2, type=int,
+                    help='Number of sockets used by the asyncio ZMQ '
+                         'transport',
+                    env_var='ZMQ_ASYNC_SOCKETS')
+    ap.add_argument('--async-hook-workers', metavar='ASYNC_HOOK_WORKERS',
+                    action='store',
+                    default=4, type=int,
+                    help='Number of threads running hooks registered with '
+                         'async_=True in the background',
+                    env_var='ASYNC_HOOK_WORKERS')
+    ap.add_argument('--async-hook-queue', metavar='ASYNC_HOOK_QUEUE',
+                    action='store',
+                    default=1000, type=int,
+                    help='Number of async hooks waiting for a thread before '
+                         'new hooks are blocked',
+                    env_var='ASYNC_HOOK_QUEUE')
+    ap.add_argument('--compress', action='store_true',
+                    help='Compress handler responses and messages to '
+                         'skygear-server when they accept it',
+                    env_var='COMPRESS')
+    ap.add_argument('--compress-level', metavar='COMPRESS_LEVEL',
+                    action='store',
+                    default=6, type=int,
+                    help='Compression level, from 1 (fastest) to 9 '
+                         '(smallest)',
+                    env_var='COMPRESS_LEVEL')
+    ap.add_argument('--compress-min-size', metavar='COMPRESS_MIN_SIZE',
+                    action='store',
+                    default=1024, type=int,
+                    help='Smallest response in bytes which is compressed',
+                    env_var='COMPRESS_MIN_SIZE')
+    ap.add_argument('--json-codec', metavar='JSON_CODEC', action='store',
+                    default='auto',
+                    choices=['auto', 'orjson', 'ujson', 'json'],
+                    help='JSON library used to encode and decode messages, '
+                         'auto selects the fastest one installed',
+                    env_var='JSON_CODEC')
     ap.add_argument('modules', nargs='*', default=[])  # env_var: LOAD_MODULES
 
 
@@ -143,6 +244,32 @@ def add_asset_arguments(ap: argparse.ArgumentParser):
     add_cloud_asset_store_arguments(ap)
 
 
+def add_database_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument('--db-pool-size', metavar='DB_POOL_SIZE',
+                    action='store', default=5, type=int,
+                    help='Number of database connections kept open',
+                    env_var='DB_POOL_SIZE')
+    ap.add_argument('--db-max-overflow', metavar='DB_MAX_OVERFLOW',
+                    action='store', default=10, type=int,
+                    help='Number of database connections opened beyond '
+                         'the pool size when all are in use',
+                    env_var='DB_MAX_OVERFLOW')
+    ap.add_argument('--db-pool-recycle', metavar='DB_POOL_RECYCLE',
+                    action='store', default=-1, type=int,
+                    help='Seconds after which a database connection is '
+                         'replaced, -1 to keep connections forever',
+                    env_var='DB_POOL_RECYCLE')
+    ap.add_argument('--db-pool-pre-ping', action='store_true',
+                    help='Test database connections before they are used',
+                    env_var='DB_POOL_PRE_PING')
+    ap.add_argument('--db-schema-cache', metavar='DIR', action='store',
+                    default=None,
+                    help='Directory where reflected database tables are '
+                         'saved, so that they are not reflected again '
+                         'after restart',
+                    env_var='DB_SCHEMA_CACHE')
+
+
 def add_logging_arguments(ap: argparse.ArgumentParser):
     ap.add_argument('--loglevel', action='store', default='INFO',
                     help="Log level",
@@ -165,6 +292,7 @@ def get_argument_parser():
     add_plugin_arguments(ap)
     add_asset_arguments(ap)
     add_static_asset_arguments(ap)
+    add_database_arguments(ap)
     add_logging_arguments(ap)
     add_debug_arguments(ap)
     return ap
@@ -204,7 +332,17 @@ def _parse_load_modules_envvar(val):
 
 def parse_args():
     global options
-    options = get_argument_parser().parse_args(namespace=options)
+    parser = get_argument_parser()
+    options = parser.parse_args(namespace=options)
+
+    # The request context is only kept per asyncio task from Python 3.7.
+    if options.zmq_async and sys.version_info < (3, 7):
+        parser.error('--zmq-async requires Python 3.7 or later')
+
+    # Worker processes share a socket served by the pooled http server.
+    if options.http and options.http_processes > 1 and \
+            not options.http_threads:
+        parser.error('--http-processes requires --http-threads')
 
     # configargparse does not support env_var for positional argument,
     # therefore the LOAD_MODULES env_var is loaded manually.
@@ -11,14 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 from urllib.parse import urlparse, urlunparse
 
 from websocket import create_connection
 
+from . import codec
 from .options import options
 
-encoder = json.dumps
+encoder = codec.dumps
 _hub = None
 
 
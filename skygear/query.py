@@ -12,8 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+
+from .encoding import serialize_value
 from .predicate import Predicate
 
+# Record attributes that can be sorted on, keyed by keypath.
+_METADATA_KEYS = {
+    '_created_at': lambda record: record.created_at,
+    '_updated_at': lambda record: record.updated_at,
+    '_created_by': lambda record: record.created_by,
+    '_updated_by': lambda record: record.updated_by,
+    '_ownerID': lambda record: record.owner_id,
+}
+
+# Keys that are never NULL. The other metadata keys are NULL for records
+# created without a user.
+_NOT_NULL_KEYS = {'_id', '_created_at', '_updated_at'}
+
 
 class Query:
     """ Skygear Query Class
@@ -25,6 +41,14 @@ class Query:
         >>> database = container.public_database
         >>> result = database.query(query)
 
+    Instead of `offset`, a query can continue after the last record of
+    the previous page with `seek_after`, which costs the same for every
+    page:
+
+        >>> query = Query("student").add_order("age", "asc")
+        >>> page = database.query(query)
+        >>> page = database.query(query.seek_after(page[-1]))
+
     """
     def __init__(self, record_type,
                  predicate=None, count=False,
@@ -38,7 +62,112 @@ class Query:
         self.limit = limit
         self.offset = offset
         self.include = include
+        self.cursor = None
 
     def add_order(self, key, order):
         self.sort.append([{'$type': 'keypath', '$val': key}, order])
         return self
+
+    def copy(self):
+        query = copy.copy(self)
+        query.sort = list(self.sort)
+        return query
+
+    def order_keys(self):
+        """
+        Returns the sort order as a list of (key, order) tuples.
+        """
+        return [(keypath['$val'], order) for keypath, order in self.sort]
+
+    def add_tiebreaker(self):
+        """
+        Sorts records by `_id` after the existing sort order, so that
+        every record has a distinct position in the results. This is
+        required by `seek_after`, and should be done before the first page
+        is fetched.
+        """
+        if '_id' not in (key for key, _ in self.order_keys()):
+            self.add_order('_id', 'asc')
+        return self
+
+    def seek_after(self, record):
+        """
+        Makes the query return the records that are sorted after `record`,
+        which is usually the last record of the previous page. The offset
+        of the query is reset.
+
+        Records are compared by the keys of `add_order`, followed by `_id`,
+        which is added to the sort order if missing.
+        """
+        self.add_tiebreaker()
+        self.cursor = [(key, order, _sort_value(record, key))
+                       for key, order in self.order_keys()]
+        self.offset = None
+        return self
+
+    def seek_predicate(self):
+        """
+        Returns the predicate that matches the records sorted after the
+        record of `seek_after`, or None if no record is set.
+
+        For the sort order (a asc, b desc), the predicate is
+        a > x or (a == x and b < y).
+
+        NULL is sorted after every value as by PostgreSQL, so for a field
+        that may be NULL, a > x becomes (a > x or a is NULL), and a < NULL
+        becomes a is not NULL.
+        """
+        if self.cursor is None:
+            return None
+        alternatives = []
+        for i, (key, order, value) in enumerate(self.cursor):
+            p = _sorted_after(key, order, value)
+            if p is None:
+                continue
+            for prev_key, _, prev_value in reversed(self.cursor[:i]):
+                p = Predicate(**{prev_key + '__eq': prev_value}) & p
+            alternatives.append(p)
+        predicate = alternatives[0]
+        for p in alternatives[1:]:
+            predicate = predicate | p
+        return predicate
+
+    def effective_predicate(self):
+        """
+        Returns the predicate of the query combined with the predicate of
+        `seek_after`.
+        """
+        seek = self.seek_predicate()
+        if seek is None:
+            return self.predicate
+        if not self.predicate.conditions:
+            return seek
+        return self.predicate & seek
+
+
+def _sorted_after(key, order, value):
+    """
+    Returns the predicate that matches the values of `key` sorted after
+    `value`, or None if no value is.
+    """
+    if key in _NOT_NULL_KEYS:
+        op = 'gt' if order == 'asc' else 'lt'
+        return Predicate(**{key + '__' + op: value})
+    if order == 'asc':
+        if value is None:
+            return None
+        return Predicate(**{key + '__gt': value, key + '__eq': None},
+                         op=Predicate.OR)
+    if value is None:
+        return Predicate(**{key + '__neq': None})
+    return Predicate(**{key + '__lt': value})
+
+
+def _sort_value(record, key):
+    if key == '_id':
+        return record.id.key
+    if key in _METADATA_KEYS:
+        value = _METADATA_KEYS[key](record)
+    else:
+        value = record.get(key)
+    return serialize_value(value)
@@ -57,6 +57,7 @@ class Registry:
             'event': [],
             'provider': [],
         }
+        self.async_hooks = set()
         self.handler = defaultdict(dict)
         self.providers = {}
         self.static_assets = {}
@@ -124,6 +125,10 @@ class Registry:
             log.warning("Replacing previously registered hook '%s'.", name)
 
         self.func_map['hook'][name] = func
+        if kwargs.get('async'):
+            self.async_hooks.add(name)
+        else:
+            self.async_hooks.discard(name)
         self._add_param('hook', kwargs)
 
         log.debug("Registered hook '%s' to skygear!", name)
@@ -218,6 +223,13 @@ class Registry:
     def get_func(self, kind, name):
         return self.func_map[kind][name]
 
+    def is_async_hook(self, name):
+        """
+        Returns whether the hook is registered with `async_=True`, which
+        skygear-server does not wait for.
+        """
+        return name in self.async_hooks
+
     def get_event_funcs(self, name):
         return self.event_map[name]
 
@@ -11,13 +11,16 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 import logging
+import threading
 import uuid
+from concurrent.futures import Future
 
 from skygear.container import SkygearContainer
 from skygear.error import BadRequest, SkygearException, UnexpectedError
 
+from . import codec
+from .utils import metrics
 from .utils.logging import setLoggerTag
 
 log = logging.getLogger(__name__)
@@ -52,7 +55,7 @@ class RestfulResource:
         if data == '':
             return {}
         try:
-            payload = json.loads(data)
+            payload = codec.loads(data)
             return payload
         except ValueError:
             raise SkygearException('unable to decode json', BadRequest)
@@ -87,14 +90,139 @@ class RestfulResource:
             raise SkygearException('invalid request method', BadRequest)
 
 
+class _FetchBatch:
+    def __init__(self, container, database_id):
+        self.container = container
+        self.database_id = database_id
+        self.ids = []
+        self.futures = {}
+        self.full = threading.Event()
+
+    def add(self, record_id, future):
+        if record_id not in self.futures:
+            self.ids.append(record_id)
+            self.futures[record_id] = []
+        self.futures[record_id].append(future)
+
+    def resolve(self, results):
+        for record_id, futures in self.futures.items():
+            for future in futures:
+                future.set_result(results[record_id])
+
+    def fail(self, exception):
+        """
+        Fails the futures that are not resolved yet.
+        """
+        for futures in self.futures.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exception)
+
+
+class FetchBatcher:
+    """
+    FetchBatcher coalesces concurrent `record:fetch` of single records into
+    one `record:fetch` of many records.
+
+    The first fetch waits `window` seconds for other fetches of the same
+    database with the same access token, then fetches all their records
+    at once. A batch is sent early when it has `max_batch` records, and
+    a fetch raises `concurrent.futures.TimeoutError` if its batch is not
+    fetched within `timeout` seconds.
+
+    The number of fetches, the number of `record:fetch` sent and the
+    ratio between them are reported as the `restful.fetch.requests`,
+    `restful.fetch.batches` and `restful.fetch.batching_ratio` metrics.
+
+    Example:
+
+    >>> @skygear.rest('/note')
+    ... class Note(RestfulRecord):
+    ...     record_type = 'note'
+    ...     fetch_batcher = FetchBatcher()
+    """
+
+    def __init__(self, window=0.005, max_batch=100, timeout=60):
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._batches = {}
+        self._lock = threading.Lock()
+        self.requests = metrics.counter(
+            'restful.fetch.requests', 'Records fetched by FetchBatcher')
+        self.batches = metrics.counter(
+            'restful.fetch.batches', 'record:fetch sent by FetchBatcher')
+        self.batching_ratio = metrics.gauge(
+            'restful.fetch.batching_ratio',
+            'Records fetched for each record:fetch sent by FetchBatcher')
+
+    def fetch(self, container, database_id, record_id):
+        """
+        Fetches a record, returning the response of skygear-server as if
+        the record was fetched alone.
+        """
+        key = (container.endpoint, container.api_key, container.access_token,
+               database_id)
+        future = Future()
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = _FetchBatch(container, database_id)
+                self._batches[key] = batch
+            batch.add(record_id, future)
+            if len(batch.ids) >= self.max_batch:
+                del self._batches[key]
+                batch.full.set()
+        self.requests.inc()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batches.get(key) is batch:
+                    del self._batches[key]
+            self._send(batch)
+        return future.result(self.window + self.timeout)
+
+    def _send(self, batch):
+        try:
+            self.batches.inc()
+            self.batching_ratio.set(self.requests.value / self.batches.value)
+            result = batch.container.send_action('record:fetch', {
+                'database_id': batch.database_id,
+                'ids': batch.ids,
+            }, timeout=self.timeout)
+            self._resolve(batch, result)
+        except Exception as e:
+            batch.fail(e)
+        finally:
+            # Nothing is left waiting, even on KeyboardInterrupt.
+            batch.fail(SkygearException('record:fetch was interrupted',
+                                        UnexpectedError))
+
+    def _resolve(self, batch, result):
+        items = result.get('result')
+        if 'error' in result or not isinstance(items, list) \
+                or len(items) != len(batch.ids):
+            batch.resolve({record_id: result for record_id in batch.ids})
+            return
+        batch.resolve({record_id: {'result': [item]}
+                       for record_id, item in zip(batch.ids, items)})
+
+
 class RestfulRecord(RestfulResource):
     record_type = None
     database_id = '_public'
+    fetch_batcher = None
+    """FetchBatcher used by `get`, records are fetched one by one if None"""
 
     @property
     def container(self):
         token = self._access_token()
-        container = SkygearContainer(access_token=token)
+        container = getattr(self, '_container', None)
+        if container is None or container.access_token != token:
+            container = SkygearContainer(access_token=token)
+            self._container = container
         return container
 
     def _send_multi(self, action, **payload):
@@ -108,6 +236,9 @@ class RestfulRecord(RestfulResource):
 
     def _send_single(self, action, **payload):
         result = self.container.send_action(action, payload)
+        return self._single_result(result)
+
+    def _single_result(self, result):
         if 'error' in result:
             raise SkygearException.from_dict(result['error'])
         elif 'result' in result and isinstance(result['result'], list) \
@@ -128,7 +259,7 @@ class RestfulRecord(RestfulResource):
             return token
 
         try:
-            data = json.loads(self.request.get_data(as_text=True))
+            data = codec.loads(self.request.get_data())
             return data.get('access_token', None)
         except ValueError:
             return None
@@ -177,6 +308,10 @@ class RestfulRecord(RestfulResource):
 
     def get(self, ident):
         record_id = self._record_id(ident)
+        if self.fetch_batcher is not None:
+            result = self.fetch_batcher.fetch(self.container,
+                                              self.database_id, record_id)
+            return self._single_result(result)
         return self._send_single('record:fetch',
                                  database_id=self.database_id,
                                  ids=[record_id])
@@ -0,0 +1,221 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from .utils import db, metrics
+from .utils.logging import setLoggerTag
+
+log = logging.getLogger(__name__)
+setLoggerTag(log, 'plugin')
+
+SUPERVISE_INTERVAL = 1
+STATS_INTERVAL = 1
+SHUTDOWN_TIMEOUT = 10
+# A worker process exiting within FAST_FAILURE_TIME seconds is restarted
+# after a delay doubling from RESTART_BACKOFF up to RESTART_BACKOFF_MAX
+# seconds, and the supervisor gives up after MAX_FAST_FAILURES in a row.
+FAST_FAILURE_TIME = 10
+RESTART_BACKOFF = 1
+RESTART_BACKOFF_MAX = 60
+MAX_FAST_FAILURES = 5
+
+
+class Supervisor:
+    """
+    Supervisor forks worker processes that each run their own transport.
+
+    Cloud code modules should be loaded before the supervisor is run so
+    that the modules are loaded once and shared by all worker processes.
+    The transport is created by `transport_factory` in the worker process,
+    after the fork, so that no ZMQ context is shared between processes.
+
+    The supervisor restarts worker processes that exit unexpectedly and
+    forwards SIGTERM to worker processes. A worker process that keeps
+    exiting soon after it is started is restarted with exponential
+    backoff, and the supervisor stops with `failed` set when it has
+    failed MAX_FAST_FAILURES times in a row.
+
+    Each worker process reports the number of requests it is handling,
+    which is aggregated by `busy_count`.
+
+    The requests in progress in all worker processes, the worker processes
+    running and the worker processes restarted are reported as the
+    `supervisor.busy`, `supervisor.processes` and `supervisor.restarts`
+    metrics of the supervisor process.
+    """
+
+    def __init__(self, transport_factory, processes):
+        self.transport_factory = transport_factory
+        self.processes = processes
+        self.children = {}
+        self.restart_count = 0
+        self.failed = False
+        self._busy = multiprocessing.RawArray('i', processes)
+        self._started_at = [0] * processes
+        self._failures = [0] * processes
+        self._restart_at = {}
+        self._stopper = threading.Event()
+        self.busy = metrics.gauge(
+            'supervisor.busy', 'Requests in progress in all worker processes')
+        self.running = metrics.gauge(
+            'supervisor.processes', 'Worker processes running')
+        self.restarts = metrics.counter(
+            'supervisor.restarts', 'Worker processes restarted')
+
+    def run(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._handle_signal)
+            signal.signal(signal.SIGINT, self._handle_signal)
+
+        for index in range(self.processes):
+            self.spawn(index)
+
+        stats_at = time.time() + STATS_INTERVAL
+        while not self._stopper.wait(SUPERVISE_INTERVAL):
+            self.reap()
+            self.restart_due()
+            if time.time() > stats_at:
+                stats_at = time.time() + STATS_INTERVAL
+                self.update_metrics()
+        self.shutdown()
+        self.update_metrics()
+
+    def spawn(self, index):
+        self._busy[index] = 0
+        self._started_at[index] = time.time()
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(index)
+        self.children[pid] = index
+        log.info('Started worker process %d (pid %d)', index, pid)
+
+    def reap(self):
+        """
+        Schedules the restart of worker processes that have exited.
+        """
+        for pid, index in list(self.children.items()):
+            try:
+                exited_pid, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                exited_pid, status = pid, 0
+            if exited_pid == 0:
+                continue
+            del self.children[pid]
+            if self._stopper.is_set():
+                continue
+            log.warning('Worker process %d (pid %d) exited with status %d',
+                        index, pid, status)
+            self.schedule_restart(index)
+
+    def schedule_restart(self, index):
+        if time.time() - self._started_at[index] < FAST_FAILURE_TIME:
+            self._failures[index] += 1
+        else:
+            self._failures[index] = 0
+        failures = self._failures[index]
+        if failures > MAX_FAST_FAILURES:
+            log.error('Worker process %d failed %d times in a row, '
+                      'shutting down', index, failures)
+            self.failed = True
+            self.stop()
+            return
+        delay = 0
+        if failures:
+            delay = min(RESTART_BACKOFF * 2 ** (failures - 1),
+                        RESTART_BACKOFF_MAX)
+        log.warning('Restarting worker process %d in %gs', index, delay)
+        self._restart_at[index] = time.time() + delay
+        self.restart_due()
+
+    def restart_due(self):
+        """
+        Starts the worker processes whose restart delay has passed.
+        """
+        now = time.time()
+        for index, restart_at in list(self._restart_at.items()):
+            if restart_at > now or self._stopper.is_set():
+                continue
+            del self._restart_at[index]
+            self.restart_count += 1
+            self.restarts.inc()
+            self.spawn(index)
+
+    def busy_count(self):
+        """
+        Returns the number of requests in progress in all worker
+        processes.
+        """
+        return sum(self._busy)
+
+    def update_metrics(self):
+        self.busy.set(self.busy_count() if self.children else 0)
+        self.running.set(len(self.children))
+
+    def stop(self):
+        self._stopper.set()
+
+    def shutdown(self):
+        log.info('Shutting down all worker processes')
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        while self.children and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            log.warning('Worker process (pid %d) did not exit, killing it',
+                        pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children = {}
+
+    def _handle_signal(self, signum, frame):
+        self.stop()
+
+    def _run_child(self, index):
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            # The database connections of the supervisor process must not
+            # be shared with the worker process.
+            db.reset_engine_after_fork()
+            transport = self.transport_factory()
+            signal.signal(signal.SIGTERM,
+                          lambda signum, frame: transport.stop())
+            reporter = threading.Thread(target=self._report_busy_count,
+                                        args=(index, transport),
+                                        daemon=True)
+            reporter.start()
+            transport.run()
+        except BaseException:
+            log.exception('Worker process %d crashed', index)
+            status = 1
+        finally:
+            # Never return to the code of the supervisor process.
+            os._exit(status)
+
+    def _report_busy_count(self, index, transport):
+        while True:
+            self._busy[index] = transport.busy_count()
+            time.sleep(STATS_INTERVAL)
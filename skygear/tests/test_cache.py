@@ -0,0 +1,232 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+from unittest.mock import patch
+
+from ..cache import CacheBackend, RecordCache
+from ..database import Database
+from ..models import Record, RecordID
+from ..query import Query
+from ..registry import Registry
+
+
+def raw_record(key, **data):
+    return dict({'_id': 'category/' + key, '_access': None}, **data)
+
+
+def category_cache(**kwargs):
+    return RecordCache(types=['category'], registry=Registry(), **kwargs)
+
+
+class DictBackend(CacheBackend):
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class TestRecordCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = category_cache()
+        hits, misses = cache.hits.value, cache.misses.value
+        self.assertIsNone(cache.get(RecordID('category', '1')))
+        cache.set_raw(raw_record('1', name='food'))
+        record = cache.get('category/1')
+        self.assertEqual(record.id, RecordID('category', '1'))
+        self.assertEqual(record['name'], 'food')
+        self.assertEqual(cache.hits.value - hits, 1)
+        self.assertEqual(cache.misses.value - misses, 1)
+
+    def test_set_record(self):
+        cache = category_cache()
+        cache.set(Record(RecordID('category', '1'), None, None,
+                         data={'name': 'food'}))
+        self.assertEqual(cache.get('category/1')['name'], 'food')
+
+    @patch('skygear.cache.time.monotonic')
+    def test_ttl(self, monotonic):
+        cache = category_cache(ttl=10)
+        monotonic.return_value = 100
+        cache.set_raw(raw_record('1'))
+        monotonic.return_value = 109
+        self.assertIsNotNone(cache.get_raw('category/1'))
+        monotonic.return_value = 110
+        self.assertIsNone(cache.get_raw('category/1'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        cache = category_cache(maxsize=2)
+        evictions = cache.evictions.value
+        cache.set_raw(raw_record('1'))
+        cache.set_raw(raw_record('2'))
+        cache.get_raw('category/1')
+        cache.set_raw(raw_record('3'))
+        self.assertIsNotNone(cache.get_raw('category/1'))
+        self.assertIsNone(cache.get_raw('category/2'))
+        self.assertEqual(cache.evictions.value - evictions, 1)
+
+    def test_max_bytes(self):
+        cache = category_cache(max_bytes=150)
+        cache.set_raw(raw_record('1', name='x' * 50))
+        cache.set_raw(raw_record('2', name='x' * 50))
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.size_bytes, 150)
+        cache.invalidate('category/2')
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_backend(self):
+        backend = DictBackend()
+        cache = category_cache(backend=backend)
+        cache.set_raw(raw_record('1', name='food'))
+        self.assertIn('category/1', backend.values)
+
+        other = category_cache(backend=backend)
+        self.assertEqual(other.get('category/1')['name'], 'food')
+        other.invalidate(RecordID('category', '1'))
+        self.assertEqual(backend.values, {})
+
+    def test_other_types_not_cached(self):
+        cache = category_cache()
+        cache.set_raw({'_id': 'note/1', '_access': None})
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get_raw('note/1'))
+
+    def test_invalidation_hooks(self):
+        registry = Registry()
+        cache = RecordCache(types=['category'], registry=registry)
+        hooks = registry.param_map['hook']
+        self.assertEqual(sorted(p['trigger'] for p in hooks),
+                         ['afterDelete', 'afterSave'])
+        self.assertTrue(all(registry.is_async_hook(p['name'])
+                            for p in hooks))
+
+        cache.set_raw(raw_record('1'))
+        record = Record(RecordID('category', '1'), None, None)
+        registry.get_func('hook', hooks[0]['name'])(record, None, None)
+        self.assertIsNone(cache.get_raw('category/1'))
+
+    def test_invalidated_while_fetching(self):
+        cache = category_cache()
+        generations = cache.generations()
+        # The record is saved after it has been read by the fetch
+        cache.invalidate('category/1')
+        cache.set_raw(raw_record('1'), generations)
+        self.assertIsNone(cache.get_raw('category/1'))
+
+        cache.set_raw(raw_record('1'), cache.generations())
+        self.assertIsNotNone(cache.get_raw('category/1'))
+
+
+class FetchContainer:
+    def __init__(self):
+        self.actions = []
+
+    def send_action(self, action, payload):
+        self.actions.append((action, payload))
+        if action == 'record:fetch':
+            return {'result': [
+                raw_record(i.split('/')[1]) if i != 'category/missing'
+                else {'_type': 'error', '_id': i, 'code': 110}
+                for i in payload['ids']]}
+        if action == 'record:query':
+            return {'result': [raw_record('1'), raw_record('2')]}
+        return {'result': []}
+
+
+class TestDatabaseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = category_cache()
+        Database.set_default_cache(self.cache)
+        self.container = FetchContainer()
+        self.database = Database(self.container, '_public')
+
+    def tearDown(self):
+        Database.set_default_cache(None)
+
+    def test_fetch(self):
+        records = self.database.fetch([RecordID('category', '1'),
+                                       'category/missing'])
+        self.assertEqual(records[0].id, RecordID('category', '1'))
+        self.assertIsNone(records[1])
+        self.database.fetch(['category/1', 'category/2'])
+        self.assertEqual([p['ids'] for _, p in self.container.actions],
+                         [['category/1', 'category/missing'],
+                          ['category/2']])
+
+    def test_query_fills_cache(self):
+        self.database.query(Query('category'))
+        self.database.fetch(['category/1', 'category/2'])
+        self.assertEqual([a for a, _ in self.container.actions],
+                         ['record:query'])
+
+    def test_save_and_delete_invalidate(self):
+        self.cache.set_raw(raw_record('1'))
+        self.cache.set_raw(raw_record('2'))
+        self.database.save(Record(RecordID('category', '1'), None, None))
+        self.database.delete(['category/2'])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_after_save(self):
+        send_action = self.container.send_action
+
+        def save_while_fetching(action, payload):
+            if action == 'record:save':
+                # A fetch of the old record while it is being saved
+                self.database.fetch('category/1')
+                self.assertEqual(len(self.cache), 1)
+            return send_action(action, payload)
+
+        self.container.send_action = save_while_fetching
+        self.database.save(Record(RecordID('category', '1'), None, None))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_fetch_invalidated_by_hook(self):
+        send_action = self.container.send_action
+
+        def saved_while_fetching(action, payload):
+            result = send_action(action, payload)
+            # The after save hook of another client's save arrives before
+            # the response to the fetch.
+            self.cache.invalidate('category/1')
+            return result
+
+        self.container.send_action = saved_while_fetching
+        self.database.fetch(['category/1'])
+        self.database.query(Query('category'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_access_token_not_cached(self):
+        self.cache.set_raw(raw_record('1'))
+        self.container.access_token = 'ACCESS_TOKEN'
+        self.assertIsNone(self.database.cache)
+        self.database.fetch(['category/1', 'category/2'])
+        self.assertEqual([p['ids'] for _, p in self.container.actions],
+                         [['category/1', 'category/2']])
+        self.assertIsNone(self.cache.get_raw('category/2'))
+
+        self.database.delete(['category/1'])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_private_database_not_cached(self):
+        database = Database(self.container, '_private')
+        self.assertIsNone(database.cache)
+        database.fetch('category/1')
+        self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,79 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import json
+import unittest
+
+from .. import codec
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.backend = codec.get_backend().name
+
+    def tearDown(self):
+        codec.set_backend(self.backend)
+
+    def backends(self):
+        for name in codec.available_backends():
+            codec.set_backend(name)
+            with self.subTest(backend=name):
+                yield name
+
+    def test_auto_backend(self):
+        codec.set_backend('auto')
+        self.assertEqual(codec.get_backend().name,
+                         codec.available_backends()[0])
+
+    def test_unavailable_backend(self):
+        with self.assertRaises(ValueError):
+            codec.set_backend('simplejson')
+
+    def test_round_trip(self):
+        obj = {'_id': 'note/1', 'tags': ['a', 'b'], 'count': 3,
+               'score': 1.5, 'content': '中文', 'deleted': None}
+        for _ in self.backends():
+            self.assertIsInstance(codec.dumps(obj), str)
+            self.assertIsInstance(codec.dumpb(obj), bytes)
+            self.assertEqual(codec.loads(codec.dumps(obj)), obj)
+            self.assertEqual(codec.loads(codec.dumpb(obj)), obj)
+            self.assertEqual(codec.loads(memoryview(codec.dumpb(obj))), obj)
+
+    def test_datetime(self):
+        dt = datetime.datetime(2014, 9, 27, 17, 40, 0,
+                               tzinfo=datetime.timezone.utc)
+        for _ in self.backends():
+            self.assertEqual(codec.loads(codec.dumpb({'print_at': dt})),
+                             {'print_at': '2014-09-27T17:40:00Z'})
+
+    def test_unserializable(self):
+        for _ in self.backends():
+            with self.assertWarns(DeprecationWarning):
+                data = codec.dumpb({'obj': object()})
+            self.assertEqual(codec.loads(data), {'obj': None})
+
+    def test_big_int(self):
+        obj = {'id': 2 ** 64, 'ids': [-2 ** 70]}
+        for _ in self.backends():
+            self.assertEqual(codec.dumpb(obj), json.dumps(obj).encode())
+
+    def test_nonfinite_float(self):
+        obj = {'score': [1.5, float('nan')], 'max': float('inf')}
+        for _ in self.backends():
+            self.assertEqual(codec.dumps(obj), json.dumps(obj))
+
+    def test_invalid_json(self):
+        for _ in self.backends():
+            with self.assertRaises(ValueError):
+                codec.loads(b'{"key":')
@@ -11,40 +11,58 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import datetime
+import json
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from ..container import SkygearContainer
 from ..transmitter.http import send_action
 
 
 class TestSendAction(unittest.TestCase):
-    @patch('skygear.transmitter.http.requests', autospec=True)
-    def test_send_str(self, mock_requests):
-        send_action('http://skygear.dev/', {
+    @patch('skygear.transmitter.http.get_client', autospec=True)
+    def test_send_str(self, mock_get_client):
+        mock_client = mock_get_client.return_value
+        mock_client.post.return_value.content = b'{"result": "OK"}'
+        result = send_action('http://skygear.dev/', {
             'key': 'string'
         })
-        self.assertEqual(len(mock_requests.method_calls), 1)
-        call = mock_requests.method_calls[0]
+        self.assertEqual(len(mock_client.method_calls), 1)
+        call = mock_client.method_calls[0]
         self.assertEqual(call[0], 'post')
         self.assertEqual(call[1][0], 'http://skygear.dev/')
-        self.assertEqual(call[2]['data'], '{"key": "string"}')
+        self.assertEqual(json.loads(call[1][1].decode()),
+                         {'key': 'string'})
+        self.assertFalse(call[2]['idempotent'])
+        self.assertEqual(result, {'result': 'OK'})
 
-    @patch('skygear.transmitter.http.requests', autospec=True)
-    def test_send_date(self, mock_requests):
+    @patch('skygear.transmitter.http.get_client', autospec=True)
+    def test_send_date(self, mock_get_client):
         dt = datetime.datetime(2014, 9, 27, 17, 40, 0,
                                tzinfo=datetime.timezone.utc)
+        mock_client = mock_get_client.return_value
+        mock_client.post.return_value.content = b'{}'
         send_action('http://skygear.dev/', {
             'print_at': dt
         })
-        self.assertEqual(len(mock_requests.method_calls), 1)
-        call = mock_requests.method_calls[0]
+        self.assertEqual(len(mock_client.method_calls), 1)
+        call = mock_client.method_calls[0]
         self.assertEqual(call[0], 'post')
         self.assertEqual(call[1][0], 'http://skygear.dev/')
         self.assertEqual(
-            call[2]['data'],
-            '{"print_at": "2014-09-27T17:40:00Z"}')
+            json.loads(call[1][1].decode()),
+            {'print_at': '2014-09-27T17:40:00Z'})
+
+    def test_send_idempotent_action(self):
+        client = MagicMock()
+        client.post.return_value.content = b'{}'
+        send_action('http://skygear.dev/', {'action': 'record:query'},
+                    client=client)
+        self.assertTrue(client.post.call_args[1]['idempotent'])
 
 
 class TestContainer():
@@ -88,3 +106,53 @@ class TestContainer():
         assert payload['access_token'] == 'access-token'
         assert payload['api_key'] == 'master-key'
         assert payload['_from_plugin']
+
+
+class BlockingTransport:
+    def __init__(self):
+        self.threads = []
+
+    def send_action(self, action_name, payload, url, timeout):
+        self.threads.append(threading.current_thread())
+        time.sleep(0.1)
+        return {'result': payload['action']}
+
+
+class TestSendActionAsync(unittest.TestCase):
+    def test_send_action_async(self):
+        transport = BlockingTransport()
+        container = SkygearContainer(endpoint='http://skygear.dev/',
+                                     transport=transport)
+
+        async def send_all():
+            return await asyncio.gather(*[
+                container.send_action_async('action:%d' % i, {})
+                for i in range(3)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            started_at = time.time()
+            results = loop.run_until_complete(send_all())
+        finally:
+            loop.close()
+        self.assertLess(time.time() - started_at, 0.25)
+        self.assertEqual(results, [{'result': 'action:%d' % i}
+                                   for i in range(3)])
+        self.assertNotIn(threading.current_thread(), transport.threads)
+
+    def test_send_action_async_transport(self):
+        transport = MagicMock()
+
+        async def send_action_async(action_name, payload, url, timeout):
+            return {'result': url}
+        transport.send_action_async = send_action_async
+        container = SkygearContainer(endpoint='http://skygear.dev/',
+                                     transport=transport)
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(
+                container.send_action_async('record:query', {}))
+        finally:
+            loop.close()
+        self.assertEqual(result, {'result': 'http://skygear.dev/record/query'})
+        transport.send_action.assert_not_called()
@@ -0,0 +1,352 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import gc
+import threading
+import time
+import unittest
+
+from ..database import Database
+from ..error import SkygearException
+from ..models import Record, RecordID
+from ..query import Query
+from ..utils.context import current_context, start_context
+
+
+class FakeContainer:
+    """
+    FakeContainer answers record:query with a slice of a list of records.
+    """
+    def __init__(self, count, max_limit=None):
+        self.max_limit = max_limit
+        self.records = [{'_id': 'note/%03d' % i, '_access': None,
+                         'index': i}
+                        for i in range(count)]
+        self.payloads = []
+        self.threads = []
+        self.contexts = []
+        self.error = None
+
+    def send_action(self, action, payload):
+        self.payloads.append(payload)
+        self.threads.append(threading.current_thread())
+        self.contexts.append(current_context())
+        if self.error:
+            return {'error': {'message': self.error}}
+        records = self.records
+        if payload['predicate']:
+            # Only the predicate of seeking after an _id is supported.
+            op, keypath, key = payload['predicate']
+            assert op == 'gt' and keypath['$val'] == '_id'
+            records = [r for r in records
+                       if r['_id'].split('/')[1] > key]
+        offset = payload.get('offset', 0)
+        limit = min(payload.get('limit', len(records)),
+                    self.max_limit or len(records))
+        result = {'result': records[offset:offset + limit]}
+        if payload['count']:
+            result['info'] = {'count': len(self.records)}
+        return result
+
+
+class TestIterQuery(unittest.TestCase):
+    def iter_query(self, count, query, max_limit=None, **kwargs):
+        self.container = FakeContainer(count, max_limit)
+        database = Database(self.container, '_public')
+        return database.iter_query(query, **kwargs)
+
+    def test_pages(self):
+        records = self.iter_query(25, Query('note'), page_size=10)
+        self.assertEqual([r['index'] for r in records], list(range(25)))
+        self.assertEqual([(p['offset'], p['limit'])
+                          for p in self.container.payloads],
+                         [(0, 10), (10, 10), (20, 10), (25, 10)])
+        self.assertIsNone(records.count)
+
+    def test_limit_capped_by_server(self):
+        records = self.iter_query(25, Query('note'), page_size=10,
+                                  max_limit=4)
+        self.assertEqual([r['index'] for r in records], list(range(25)))
+        self.assertEqual([p['offset'] for p in self.container.payloads],
+                         [0, 4, 8, 12, 16, 20, 24, 25])
+
+    def test_last_page_full(self):
+        records = self.iter_query(20, Query('note', offset=5), page_size=5)
+        self.assertEqual([r['index'] for r in records], list(range(5, 20)))
+        self.assertEqual([p['offset'] for p in self.container.payloads],
+                         [5, 10, 15, 20])
+
+    def test_page_size_from_query(self):
+        records = self.iter_query(3, Query('note', limit=2))
+        self.assertEqual(len(list(records)), 3)
+        self.assertEqual(records.page_size, 2)
+
+    def test_count(self):
+        records = self.iter_query(25, Query('note', count=True),
+                                  page_size=10)
+        self.assertEqual(records.count, 25)
+        self.assertEqual(len(self.container.payloads), 1)
+        self.assertEqual(len(list(records)), 25)
+        self.assertEqual([p['count'] for p in self.container.payloads],
+                         [True, False, False])
+
+    def test_count_with_offset(self):
+        records = self.iter_query(25, Query('note', count=True, offset=5),
+                                  page_size=10)
+        self.assertEqual(len(list(records)), 20)
+        self.assertEqual([p['offset'] for p in self.container.payloads],
+                         [5, 15])
+
+    def test_prefetch(self):
+        records = self.iter_query(25, Query('note'), page_size=10,
+                                  prefetch=True)
+        first = next(records)
+        self.assertEqual(first['index'], 0)
+        self.assertEqual(len(list(records)), 24)
+        self.assertEqual(len(self.container.payloads), 4)
+        self.assertIsNot(self.container.threads[1], threading.current_thread())
+
+    def test_prefetch_in_request_context(self):
+        with start_context({'request_id': 'REQUEST_ID'}):
+            records = self.iter_query(25, Query('note'), page_size=10,
+                                      prefetch=True)
+            self.assertEqual(len(list(records)), 25)
+        self.assertEqual([c.get('request_id')
+                          for c in self.container.contexts],
+                         ['REQUEST_ID'] * 4)
+
+    def test_prefetch_thread_stopped_when_dropped(self):
+        records = self.iter_query(25, Query('note'), page_size=10,
+                                  prefetch=True)
+        next(records)
+        thread = self.container.threads[1]
+        finalizer = records._finalizer
+        del records
+        gc.collect()
+        self.assertFalse(finalizer.alive)
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_close(self):
+        with self.iter_query(25, Query('note'), page_size=10) as records:
+            next(records)
+        self.assertEqual(len(list(records)), 9)
+        self.assertEqual(len(self.container.payloads), 1)
+
+    def test_error(self):
+        records = self.iter_query(25, Query('note'), page_size=10)
+        self.container.error = 'invalid query'
+        with self.assertRaises(SkygearException):
+            next(records)
+
+
+class TestWalk(unittest.TestCase):
+    def setUp(self):
+        self.container = FakeContainer(25)
+        self.database = Database(self.container, '_public')
+
+    def test_walk(self):
+        records = self.database.walk('note', page_size=10)
+        self.assertEqual([r['index'] for r in records], list(range(25)))
+        payloads = self.container.payloads
+        self.assertEqual(len(payloads), 4)
+        for payload in payloads:
+            self.assertNotIn('offset', payload)
+            self.assertEqual(payload['sort'],
+                             [[{'$type': 'keypath', '$val': '_id'}, 'asc']])
+        self.assertEqual(payloads[0]['predicate'], [])
+        self.assertEqual(payloads[1]['predicate'],
+                         ['gt', {'$type': 'keypath', '$val': '_id'}, '009'])
+        self.assertEqual(payloads[2]['predicate'],
+                         ['gt', {'$type': 'keypath', '$val': '_id'}, '019'])
+        self.assertEqual(payloads[3]['predicate'],
+                         ['gt', {'$type': 'keypath', '$val': '_id'}, '024'])
+
+    def test_walk_prefetch(self):
+        records = self.database.walk('note', page_size=10, prefetch=True)
+        self.assertEqual([r['index'] for r in records], list(range(25)))
+        self.assertEqual(len(self.container.payloads), 4)
+
+    def test_iter_query_keyset_keeps_query(self):
+        query = Query('note', limit=10)
+        records = self.database.iter_query(query, keyset=True)
+        self.assertEqual(len(list(records)), 25)
+        self.assertEqual(query.sort, [])
+        self.assertIsNone(query.cursor)
+
+
+class BulkContainer:
+    """
+    BulkContainer answers record:save and record:delete, failing records
+    whose ID is in `bad` and requests with a record whose ID is in
+    `broken`.
+    """
+    def __init__(self, bad=(), broken=()):
+        self.bad = bad
+        self.broken = broken
+        self.payloads = []
+        self.threads = set()
+        self.contexts = []
+        self.lock = threading.Lock()
+
+    def send_action(self, action, payload):
+        with self.lock:
+            self.payloads.append((action, payload))
+            self.threads.add(threading.current_thread())
+            self.contexts.append(current_context())
+        if action == 'record:save':
+            ids = [r['_id'] for r in payload['records']]
+        else:
+            ids = payload['ids']
+        if any(i in self.broken for i in ids):
+            raise ConnectionError('connection reset')
+        return {'result': [
+            {'_id': i, '_type': 'error', 'message': 'bad', 'code': 108}
+            if i in self.bad else {'_id': i, '_type': 'record'}
+            for i in ids
+        ]}
+
+
+class TestBulk(unittest.TestCase):
+    def records(self, count):
+        return [Record(RecordID('note', '%03d' % i), None, None, data={})
+                for i in range(count)]
+
+    def test_save_many(self):
+        container = BulkContainer(bad=['note/003'])
+        database = Database(container, '_public')
+        result = database.save_many(self.records(25), chunk_size=10,
+                                    concurrency=3)
+        self.assertEqual(len(result), 25)
+        self.assertEqual(result.failed, [3])
+        self.assertFalse(result.ok)
+        self.assertEqual(result.errors[3].code, 108)
+        self.assertIsNone(result.results[3])
+        self.assertEqual([r['_id'] for r in result.results if r],
+                         ['note/%03d' % i for i in range(25) if i != 3])
+        self.assertEqual(sorted(len(p['records'])
+                                for _, p in container.payloads),
+                         [5, 10, 10])
+        self.assertNotIn(threading.current_thread(), container.threads)
+
+    def test_save_many_in_request_context(self):
+        container = BulkContainer()
+        database = Database(container, '_public')
+        with start_context({'user_id': 'user'}):
+            database.save_many(self.records(25), chunk_size=10,
+                               concurrency=3)
+            database.save_many(self.records(5), chunk_size=10)
+        self.assertEqual(container.contexts, [{'user_id': 'user'}] * 4)
+
+    def test_save_many_failed_chunk(self):
+        container = BulkContainer(broken=['note/012'])
+        database = Database(container, '_public')
+        result = database.save_many(self.records(25), chunk_size=10)
+        self.assertEqual(result.failed, list(range(10, 20)))
+        self.assertEqual(result.errors[10].message, 'connection reset')
+
+    def test_save_many_atomic(self):
+        container = BulkContainer()
+        database = Database(container, '_public')
+        with self.assertRaises(ValueError):
+            database.save_many(self.records(25), chunk_size=10, atomic=True)
+        self.assertEqual(container.payloads, [])
+
+        result = database.save_many(self.records(10), chunk_size=10,
+                                    atomic=True)
+        self.assertTrue(result.ok)
+        self.assertTrue(container.payloads[0][1]['atomic'])
+
+    def test_delete_many(self):
+        container = BulkContainer()
+        database = Database(container, '_public')
+        result = database.delete_many(self.records(5), chunk_size=2,
+                                      concurrency=1)
+        self.assertTrue(result.ok)
+        self.assertEqual([p['ids'] for _, p in container.payloads],
+                         [['note/000', 'note/001'],
+                          ['note/002', 'note/003'],
+                          ['note/004']])
+        self.assertEqual(container.threads, {threading.current_thread()})
+
+
+class AsyncContainer(BulkContainer):
+    """
+    AsyncContainer answers actions sent with send_action_async after a
+    delay, keeping track of the number of actions in flight.
+    """
+    delay = 0.1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_action_async(self, action, payload):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if action == 'record:query':
+            return {'result': [{'_id': payload['record_type'] + '/1',
+                                '_access': None}]}
+        return self.send_action(action, payload)
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def records(self, count):
+        return [Record(RecordID('note', '%03d' % i), None, None, data={})
+                for i in range(count)]
+
+    def test_query_many_async(self):
+        container = AsyncContainer()
+        database = Database(container, '_public')
+        started_at = time.time()
+        results = self.loop.run_until_complete(database.query_many_async(
+            [Query('note'), Query('comment'), Query('user')]))
+        self.assertLess(time.time() - started_at, container.delay * 2)
+        self.assertEqual(container.max_in_flight, 3)
+        self.assertEqual([records[0].id.type for records in results],
+                         ['note', 'comment', 'user'])
+
+    def test_save_many_async(self):
+        container = AsyncContainer(bad=['note/003'], broken=['note/012'])
+        database = Database(container, '_public')
+        result = self.loop.run_until_complete(database.save_many_async(
+            self.records(25), chunk_size=5, concurrency=2))
+        self.assertEqual(len(result), 25)
+        self.assertEqual(result.failed, [3] + list(range(10, 15)))
+        self.assertEqual(container.max_in_flight, 2)
+
+    def test_save_many_async_atomic(self):
+        database = Database(AsyncContainer(), '_public')
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(database.save_many_async(
+                self.records(25), chunk_size=10, atomic=True))
+
+    def test_delete_many_async(self):
+        container = AsyncContainer()
+        database = Database(container, '_public')
+        result = self.loop.run_until_complete(database.delete_many_async(
+            self.records(5), chunk_size=2))
+        self.assertTrue(result.ok)
+        self.assertEqual(container.max_in_flight, 3)
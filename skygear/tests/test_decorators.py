@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import unittest
 from unittest.mock import ANY, call, patch
 
@@ -88,6 +89,27 @@ class TestHookDecorators(unittest.TestCase):
             'skygear.tests.test_decorators.fn', ANY,
             type='note', trigger='beforeSave')
 
+    @patch('skygear.registry.Registry.register_hook')
+    def test_async_hook(self, mocker):
+        @d.after_save('note')
+        async def fn(record, original_record, db):
+            pass
+        hook_func = mocker.call_args[0][1]
+        assert asyncio.iscoroutinefunction(hook_func)
+        record = object()
+        loop = asyncio.new_event_loop()
+        assert loop.run_until_complete(
+            hook_func(record, None, None)) is record
+        loop.close()
+
+    @patch('skygear.registry.Registry.register_hook')
+    def test_async_delete_hook(self, mocker):
+        @d.before_delete('note')
+        async def fn(record, db):
+            pass
+        hook_func = mocker.call_args[0][1]
+        assert asyncio.iscoroutinefunction(hook_func)
+
 
 def test_fix_handler_path():
     assert d._fix_handler_path('hello:world') == 'hello/world'
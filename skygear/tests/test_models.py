@@ -11,10 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import pickle
 from datetime import datetime
 
-from ..models import (ACCESS_CONTROL_ENTRY_LEVEL_READ,
-                      PublicAccessControlEntry, Record, RecordID)
+from ..models import (ACCESS_CONTROL_ENTRY_LEVEL_READ, Asset,
+                      DirectAccessControlEntry, Location,
+                      PublicAccessControlEntry, Record, RecordID, Reference,
+                      RoleAccessControlEntry, UnknownValue)
 
 
 class TestRecord():
@@ -51,3 +54,61 @@ class TestRecord():
 
         assert len(r.acl) == 1
         assert r.acl[0].level == ACCESS_CONTROL_ENTRY_LEVEL_READ
+
+
+class TestValues():
+    def test_record_id_as_key(self):
+        ids = {RecordID("note", "1"): 1, RecordID("note", "2"): 2}
+        assert ids[RecordID("note", "1")] == 1
+        assert RecordID("note", "1") != RecordID("comment", "1")
+
+    def test_reference_in_set(self):
+        refs = {Reference(RecordID("note", "1")),
+                Reference(RecordID("note", "1")),
+                Reference(RecordID("note", "2"))}
+        assert len(refs) == 2
+        assert Reference(RecordID("note", "2")) in refs
+
+    def test_access_control_entries(self):
+        assert RoleAccessControlEntry("admin", "read") == \
+            RoleAccessControlEntry("admin", "read")
+        assert RoleAccessControlEntry("admin", "read") != \
+            RoleAccessControlEntry("admin", "write")
+        assert DirectAccessControlEntry("admin", "read") != \
+            RoleAccessControlEntry("admin", "read")
+        assert len({PublicAccessControlEntry("read"),
+                    PublicAccessControlEntry("read")}) == 1
+
+    def test_values(self):
+        assert Location(1, 2) == Location(1, 2)
+        assert hash(Location(1, 2)) == hash(Location(1, 2))
+        assert Asset("a.png", "image/png") != Asset("a.png", None)
+        assert UnknownValue("money") == UnknownValue("money")
+
+    def test_subclass_values(self):
+        class Place(Location):
+            __slots__ = ()
+
+        assert Place(1, 2) == Place(1, 2)
+        assert Place(1, 2) != Location(1, 2)
+        assert Location(1, 2) != Place(1, 2)
+        assert len({Place(1, 2), Location(1, 2)}) == 2
+
+    def test_no_instance_dict(self):
+        values = [Record(RecordID("note", "1"), "OWNER_ID", None),
+                  RecordID("note", "1"), Reference(RecordID("note", "1")),
+                  Location(1, 2), Asset("a.png", "image/png"),
+                  UnknownValue("money"), RoleAccessControlEntry("admin",
+                                                                "read")]
+        for value in values:
+            assert not hasattr(value, '__dict__')
+
+    def test_pickle(self):
+        ref = Reference(RecordID("note", "1"))
+        assert pickle.loads(pickle.dumps(ref)) == ref
+        r = Record(RecordID("note", "1"), "OWNER_ID",
+                   [PublicAccessControlEntry("read")], data={"ref": ref})
+        copied = pickle.loads(pickle.dumps(r))
+        assert copied.id == r.id
+        assert copied.acl == r.acl
+        assert copied["ref"] == ref
@@ -11,9 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import sys
 import unittest
+from unittest.mock import patch
 
-from ..options import _parse_load_modules_envvar
+from ..options import _parse_load_modules_envvar, parse_args
 
 
 class TestParseLoadModules(unittest.TestCase):
@@ -31,3 +33,18 @@ class TestParseLoadModules(unittest.TestCase):
 
     def test_ignore(self):
         self.assertEqual(_parse_load_modules_envvar('a~js,b,c~py'), ['b', 'c'])
+
+
+class TestParseArgs(unittest.TestCase):
+    @patch('sys.version_info', (3, 6, 9))
+    def test_zmq_async_requires_py37(self):
+        with patch.object(sys, 'argv', ['py-skygear', '--zmq-async']), \
+                patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                parse_args()
+
+    def test_http_processes_requires_threads(self):
+        argv = ['py-skygear', '--http', '--http-processes', '2']
+        with patch.object(sys, 'argv', argv), patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                parse_args()
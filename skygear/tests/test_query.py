@@ -0,0 +1,124 @@
+# Copyright 2017 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import unittest
+
+from ..models import Record, RecordID
+from ..query import Predicate, Query
+
+
+def keypath(key):
+    return {'$type': 'keypath', '$val': key}
+
+
+class TestSeekAfter(unittest.TestCase):
+    def record(self, key, **data):
+        return Record(RecordID('note', key), None, None, data=data)
+
+    def test_no_cursor(self):
+        query = Query('note')
+        self.assertIsNone(query.seek_predicate())
+        self.assertIs(query.effective_predicate(), query.predicate)
+
+    def test_seek_after_id(self):
+        query = Query('note', offset=100)
+        query.seek_after(self.record('a'))
+        self.assertIsNone(query.offset)
+        self.assertEqual(query.sort, [[keypath('_id'), 'asc']])
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['gt', keypath('_id'), 'a'])
+
+    def test_seek_after_sort_keys(self):
+        query = Query('note').add_order('score', 'desc')
+        query.seek_after(self.record('a', score=3))
+        self.assertEqual(query.sort, [[keypath('score'), 'desc'],
+                                      [keypath('_id'), 'asc']])
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['or',
+                          ['lt', keypath('score'), 3],
+                          ['and',
+                           ['eq', keypath('score'), 3],
+                           ['gt', keypath('_id'), 'a']]])
+
+    def test_seek_after_nullable_keys(self):
+        query = Query('note').add_order('score', 'asc')
+        query.seek_after(self.record('a', score=3))
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['or',
+                          ['eq', keypath('score'), None],
+                          ['gt', keypath('score'), 3],
+                          ['and',
+                           ['eq', keypath('score'), 3],
+                           ['gt', keypath('_id'), 'a']]])
+
+        # Only NULL values follow NULL in ascending order.
+        query.seek_after(self.record('a'))
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['and',
+                          ['eq', keypath('score'), None],
+                          ['gt', keypath('_id'), 'a']])
+
+    def test_seek_after_null_descending(self):
+        query = Query('note').add_order('score', 'desc')
+        query.seek_after(self.record('a'))
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['or',
+                          ['neq', keypath('score'), None],
+                          ['and',
+                           ['eq', keypath('score'), None],
+                           ['gt', keypath('_id'), 'a']]])
+
+    def test_seek_after_with_predicate(self):
+        query = Query('note', predicate=Predicate(deleted__eq=False))
+        query.add_order('_id', 'desc')
+        query.seek_after(self.record('a'))
+        self.assertEqual(query.sort, [[keypath('_id'), 'desc']])
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['and',
+                          ['eq', keypath('deleted'), False],
+                          ['lt', keypath('_id'), 'a']])
+
+    def test_seek_after_metadata(self):
+        created_at = datetime.datetime(2017, 1, 2, 3, 4, 5,
+                                       tzinfo=datetime.timezone.utc)
+        record = Record(RecordID('note', 'a'), None, None,
+                        created_at=created_at)
+        query = Query('note').add_order('_created_at', 'asc')
+        query.seek_after(record)
+        self.assertEqual(
+            query.effective_predicate().to_dict()[1],
+            ['gt', keypath('_created_at'),
+             {'$type': 'date', '$date': '2017-01-02T03:04:05Z'}])
+
+    def test_seek_after_nullable_metadata(self):
+        # A record created without a user has no owner
+        query = Query('note').add_order('_ownerID', 'asc')
+        query.seek_after(self.record('a'))
+        self.assertEqual(query.effective_predicate().to_dict(),
+                         ['and',
+                          ['eq', keypath('_ownerID'), None],
+                          ['gt', keypath('_id'), 'a']])
+
+        record = Record(RecordID('note', 'a'), 'user', None, created_by='user')
+        query = Query('note').add_order('_created_by', 'asc')
+        query.seek_after(record)
+        self.assertEqual(query.effective_predicate().to_dict()[1],
+                         ['eq', keypath('_created_by'), None])
+
+    def test_copy(self):
+        query = Query('note').add_order('score', 'asc')
+        copied = query.copy().seek_after(self.record('a', score=1))
+        self.assertEqual(len(query.sort), 1)
+        self.assertIsNone(query.cursor)
+        self.assertEqual(len(copied.sort), 2)
@@ -184,6 +184,7 @@ class TestRegistry(unittest.TestCase):
         assert param_map[0]['type'] == 'note'
         assert param_map[0]['trigger'] == 'beforeSave'
         assert param_map[0]['async'] is True
+        assert registry.is_async_hook('hook_name')
 
     def test_register_hook_twice(self):
         def fn1():
@@ -209,6 +210,7 @@ class TestRegistry(unittest.TestCase):
         assert param_map[0]['name'] == 'hook_name'
         assert param_map[0]['type'] == 'note'
         assert param_map[0]['trigger'] == 'beforeSave'
+        assert not registry.is_async_hook('hook_name')
 
     def test_register_timer(self):
         def fn():
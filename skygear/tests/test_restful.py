@@ -11,13 +11,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import threading
+import time
 import unittest
+from concurrent.futures import TimeoutError
 from unittest.mock import patch
 
 from werkzeug.test import EnvironBuilder
 from werkzeug.wrappers import Request
 
 from .. import restful
+from ..container import SkygearContainer
 from ..error import SkygearException
 
 
@@ -274,3 +278,155 @@ class TestRestfulRecord(unittest.TestCase):
         assert MockRestfulRecord()._send_single('action', data='hello') \
             == {'data': 'json'}
         mock.assert_called_once_with('action', {'data': 'hello'})
+
+
+class FetchContainer(SkygearContainer):
+    """
+    FetchContainer answers record:fetch after a delay, failing records
+    whose ID ends with `missing`.
+    """
+    def __init__(self, access_token='ACCESS_TOKEN', error=None):
+        super().__init__(endpoint='http://skygear.dev/',
+                         access_token=access_token)
+        self.error = error
+        self.calls = []
+
+    def send_action(self, action, params, *args, **kwargs):
+        self.calls.append(params['ids'])
+        time.sleep(0.01)
+        if isinstance(self.error, Exception):
+            raise self.error
+        if self.error:
+            return {'error': {'message': self.error, 'code': 108}}
+        return {'result': [
+            {'_id': i, '_type': 'error', 'message': 'not found',
+             'code': 110}
+            if i.endswith('missing') else {'_id': i, '_type': 'record'}
+            for i in params['ids']
+        ]}
+
+
+class TestFetchBatcher(unittest.TestCase):
+    def fetch_all(self, batcher, requests):
+        results = [None] * len(requests)
+
+        def fetch(index, container, record_id):
+            try:
+                results[index] = batcher.fetch(container, '_public',
+                                               record_id)
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=fetch, args=(i,) + r)
+                   for i, r in enumerate(requests)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesce(self):
+        container = FetchContainer()
+        batcher = restful.FetchBatcher(window=0.2)
+        ids = ['note/1', 'note/2', 'note/1', 'note/missing']
+        results = self.fetch_all(batcher, [(container, i) for i in ids])
+        self.assertEqual(container.calls,
+                         [['note/1', 'note/2', 'note/missing']])
+        self.assertEqual(results[0], {'result': [{'_id': 'note/1',
+                                                  '_type': 'record'}]})
+        self.assertEqual(results[2], results[0])
+        self.assertEqual(results[1]['result'][0]['_id'], 'note/2')
+        self.assertEqual(results[3]['result'][0]['_type'], 'error')
+
+    def test_separate_tokens(self):
+        alice = FetchContainer('alice')
+        bob = FetchContainer('bob')
+        batcher = restful.FetchBatcher(window=0.2)
+        self.fetch_all(batcher, [(alice, 'note/1'), (bob, 'note/2'),
+                                 (alice, 'note/3')])
+        self.assertEqual([sorted(ids) for ids in alice.calls],
+                         [['note/1', 'note/3']])
+        self.assertEqual(bob.calls, [['note/2']])
+
+    def test_max_batch(self):
+        container = FetchContainer()
+        batcher = restful.FetchBatcher(window=5, max_batch=2)
+        started_at = time.time()
+        self.fetch_all(batcher, [(container, 'note/%d' % i)
+                                 for i in range(4)])
+        self.assertLess(time.time() - started_at, 5)
+        self.assertEqual(sorted(len(ids) for ids in container.calls), [2, 2])
+
+    def test_error(self):
+        container = FetchContainer(error='denied')
+        batcher = restful.FetchBatcher(window=0.2)
+        results = self.fetch_all(batcher, [(container, 'note/1'),
+                                           (container, 'note/2')])
+        self.assertEqual(results[0], {'error': {'message': 'denied',
+                                                'code': 108}})
+        self.assertEqual(results[1], results[0])
+
+    def test_exception(self):
+        container = FetchContainer(error=ConnectionError('reset'))
+        batcher = restful.FetchBatcher(window=0.2)
+        results = self.fetch_all(batcher, [(container, 'note/1'),
+                                           (container, 'note/2')])
+        self.assertIsInstance(results[0], ConnectionError)
+        self.assertIs(results[1], results[0])
+
+    def test_unexpected_response(self):
+        container = FetchContainer()
+        container.send_action = lambda *args, **kwargs: None
+        batcher = restful.FetchBatcher(window=0.2, timeout=5)
+        started_at = time.time()
+        results = self.fetch_all(batcher, [(container, 'note/1'),
+                                           (container, 'note/2')])
+        self.assertLess(time.time() - started_at, 5)
+        self.assertIsInstance(results[0], AttributeError)
+        self.assertIs(results[1], results[0])
+
+    def test_timeout(self):
+        container = FetchContainer()
+        send_action = container.send_action
+
+        def slow_send_action(*args, **kwargs):
+            time.sleep(0.5)
+            return send_action(*args, **kwargs)
+
+        container.send_action = slow_send_action
+        batcher = restful.FetchBatcher(window=0.1, timeout=0.1)
+        results = self.fetch_all(batcher, [(container, 'note/1'),
+                                           (container, 'note/2')])
+        self.assertEqual(sum(isinstance(r, TimeoutError) for r in results),
+                         1)
+
+    def test_metrics(self):
+        container = FetchContainer()
+        batcher = restful.FetchBatcher(window=0.2)
+        requests = batcher.requests.value
+        batches = batcher.batches.value
+        self.fetch_all(batcher, [(container, 'note/%d' % i)
+                                 for i in range(4)])
+        self.assertEqual(batcher.requests.value - requests, 4)
+        self.assertEqual(batcher.batches.value - batches, 1)
+        self.assertEqual(batcher.batching_ratio.value,
+                         batcher.requests.value / batcher.batches.value)
+
+    def test_restful_record_get(self):
+        container = FetchContainer()
+
+        class BatchedRecord(MockRestfulRecord):
+            fetch_batcher = restful.FetchBatcher(window=0)
+
+        resource = BatchedRecord()
+        resource._container = container
+        self.assertEqual(resource.get('1'),
+                         {'_id': 'sample/1', '_type': 'record'})
+        with self.assertRaises(SkygearException):
+            resource.get('missing')
+        self.assertEqual(container.calls, [['sample/1'], ['sample/missing']])
+
+    def test_container_reused(self):
+        resource = MockRestfulRecord()
+        self.assertIs(resource.container, resource.container)
+        self.assertEqual(resource.container.access_token, 'ACCESS_TOKEN')
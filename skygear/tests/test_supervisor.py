@@ -0,0 +1,110 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from ..supervisor import Supervisor
+from ..transmitter.zmq import ZmqTransport
+from ..utils import metrics
+
+
+class SleepingTransport:
+    def __init__(self):
+        self.stopper = threading.Event()
+
+    def run(self):
+        self.stopper.wait()
+
+    def stop(self):
+        self.stopper.set()
+
+    def busy_count(self):
+        return 1
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('condition not met before timeout')
+        time.sleep(0.1)
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = Supervisor(SleepingTransport, 2)
+        self.supervisor_t = threading.Thread(target=self.supervisor.run)
+        self.supervisor_t.start()
+        wait_until(lambda: self.supervisor.busy_count() == 2)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        self.supervisor_t.join()
+
+    def test_start_processes(self):
+        self.assertEqual(len(self.supervisor.children), 2)
+        self.assertNotIn(os.getpid(), self.supervisor.children)
+
+    def test_metrics(self):
+        wait_until(lambda: metrics.snapshot()['supervisor.busy'] == 2)
+        self.assertEqual(metrics.snapshot()['supervisor.processes'], 2)
+
+    def test_restart_crashed_process(self):
+        pid = list(self.supervisor.children)[0]
+        os.kill(pid, signal.SIGKILL)
+        restarts = self.supervisor.restarts.value
+        wait_until(lambda: self.supervisor.restart_count == 1)
+        self.assertEqual(self.supervisor.restarts.value, restarts + 1)
+        self.assertEqual(len(self.supervisor.children), 2)
+        self.assertNotIn(pid, self.supervisor.children)
+
+    def test_stop_processes(self):
+        pids = list(self.supervisor.children)
+        self.supervisor.stop()
+        self.supervisor_t.join()
+        self.assertEqual(self.supervisor.children, {})
+        for pid in pids:
+            with self.assertRaises(ChildProcessError):
+                os.waitpid(pid, os.WNOHANG)
+
+
+def crashing_transport():
+    raise RuntimeError('cannot start')
+
+
+class TestCrashLoop(unittest.TestCase):
+    @patch('skygear.supervisor.SUPERVISE_INTERVAL', 0.05)
+    @patch('skygear.supervisor.RESTART_BACKOFF', 0.1)
+    @patch('skygear.supervisor.MAX_FAST_FAILURES', 3)
+    def test_backoff_and_give_up(self):
+        supervisor = Supervisor(crashing_transport, 1)
+        started_at = time.time()
+        supervisor.run()
+        # Restarted after 0.1s, 0.2s and 0.4s
+        self.assertGreaterEqual(time.time() - started_at, 0.7)
+        self.assertEqual(supervisor.restart_count, 3)
+        self.assertTrue(supervisor.failed)
+        self.assertEqual(supervisor.children, {})
+
+
+class TestStopBeforeRun(unittest.TestCase):
+    def test_zmq_transport(self):
+        transport = ZmqTransport('tcp://127.0.0.1:23463', threading=1)
+        transport.stop()
+        transport.run()
+        self.assertEqual(transport.threads, [])
@@ -29,4 +29,20 @@ except ImportError:
                 'zmq transport is not installed. '
                 'Please install via `pip install --upgrade skygear[zmq]`')
 
-__all__ = ['ConsoleTransport', 'HttpTransport', 'ZmqTransport']
+try:
+    from .async_zmq import AsyncZmqTransport
+except ImportError:
+    from .common import CommonTransport
+
+    class AsyncZmqTransport(CommonTransport):
+        """A dummy AsyncZmqTransport class to raise a proper exception
+        """
+
+        def __init__(self, addr,
+                     context=None, registry=None, sockets=2, limit=10):
+            raise ImportError(
+                'zmq transport is not installed. '
+                'Please install via `pip install --upgrade skygear[zmq]`')
+
+__all__ = ['AsyncZmqTransport', 'ConsoleTransport', 'HttpTransport',
+           'ZmqTransport']
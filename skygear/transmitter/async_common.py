@@ -0,0 +1,149 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import functools
+import inspect
+import logging
+from functools import wraps
+
+from ..encoding import deserialize_or_none, serialize_record, serialize_value
+from ..error import SkygearException
+from ..utils import db
+from ..utils.context import start_context
+from ..utils.logging import setLoggerTag
+from .common import CommonTransport, _error_result
+
+log = logging.getLogger(__name__)
+setLoggerTag(log, 'plugin')
+
+
+def _wrap_result_async(f):
+    @wraps(f)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return dict(result=await f(self, *args, **kwargs))
+        except Exception as e:
+            return _error_result(e)
+    return wrapper
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncCommonTransport(CommonTransport):
+    """
+    AsyncCommonTransport dispatches requests on an asyncio event loop.
+
+    Extension points defined with `async def` are awaited on the event loop,
+    so many of them can be in flight at the same time. Other extension
+    points are run in the executor so that they do not block the event
+    loop.
+    """
+
+    def __init__(self, registry=None, executor=None):
+        super().__init__(registry)
+        self._executor = executor
+
+    def is_coroutine_target(self, kind, name, param):
+        """
+        Returns whether the extension point function handling the request
+        is a coroutine function.
+        """
+        try:
+            if kind in ('op', 'hook', 'timer'):
+                funcs = [self._registry.get_func(kind, name)]
+            elif kind == 'handler':
+                funcs = [self._registry.get_handler(name, param['method'])]
+            elif kind == 'event':
+                funcs = self._registry.get_event_funcs(name)
+            else:
+                return False
+        except (KeyError, TypeError):
+            return False
+        return any(asyncio.iscoroutinefunction(f) for f in funcs)
+
+    async def dispatch_call_async(self, kind, name, ctx, param):
+        """
+        Dispatches request to a plugin extension point function, awaiting
+        coroutine functions and running other functions in the executor.
+        """
+        if not self.is_coroutine_target(kind, name, param):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                functools.partial(self.dispatch_call, kind, name, ctx, param))
+
+        if kind == 'handler':
+            return await self.call_handler_async(ctx, name, param)
+        elif kind == 'event':
+            return await self.call_event_func_async(name, param)
+        else:
+            return await self.call_func_async(ctx, kind, name, param)
+
+    @_wrap_result_async
+    async def call_func_async(self, ctx, kind, name, param):
+        obj = self._registry.get_func(kind, name)
+        with start_context(ctx):
+            if kind == 'op':
+                return await self.op_async(obj, param.get('args', {}))
+            elif kind == 'hook':
+                return await self.hook_async(obj, param)
+            elif kind == 'timer':
+                return await obj()
+            else:
+                raise SkygearException("unknown plugin extension point")
+
+    @_wrap_result_async
+    async def call_event_func_async(self, name, param):
+        event_funcs = self._registry.get_event_funcs(name)
+        self._check_event_data(param)
+        if name == 'init':
+            # Only init event support returning data
+            return await _maybe_await(event_funcs[0](**param))
+        else:
+            for event_func in event_funcs:
+                await _maybe_await(event_func(**param))
+
+    @_wrap_result_async
+    async def call_handler_async(self, ctx, name, param):
+        func = self._registry.get_handler(name, param['method'])
+        with start_context(ctx):
+            request = self._handler_request(param)
+            return self._handler_response(
+                await func(request), raw='raw_body' in param,
+                accept_encoding=request.headers.get('Accept-Encoding'))
+
+    async def op_async(self, func, param):
+        args, kwargs = self._op_arguments(param)
+        return serialize_value(await func(*args, **kwargs))
+
+    async def hook_async(self, func, param):
+        """
+        Awaits an `async def` hook, which is given an AsyncConnection
+        running its statements in the executor.
+        """
+        original_record = deserialize_or_none(param.get('original', None),
+                                              lazy=True)
+        record = deserialize_or_none(param.get('record', None), lazy=True)
+        async with db.AsyncConnection(self._executor) as conn:
+            returned = await func(record, original_record, conn)
+
+            # If the hook function does not return a value, assume that
+            # the record in the first argument is to be returned.
+            if returned is None:
+                returned = record
+        return serialize_record(returned)
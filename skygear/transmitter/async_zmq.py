@@ -0,0 +1,380 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from random import randint
+
+import zmq
+import zmq.asyncio
+
+from .. import codec
+from ..encoding import _serialize_exc
+from ..utils.context import current_context
+from ..utils.logging import setLoggerTag
+from .async_common import AsyncCommonTransport
+from .compression import decompress_frame, is_compressed_frame
+from .zmq import (HEARTBEAT_INTERVAL, HEARTBEAT_LIVENESS, INTERVAL_INIT,
+                  INTERVAL_MAX, PPP_HEARTBEAT, PPP_READY, PPP_REQUEST,
+                  PPP_RESPONSE, PPP_SHUTDOWN, PREFIX, _advertise_capabilities,
+                  _attach_body, _compress_response, _recv_frames,
+                  _response_frames)
+
+log = logging.getLogger(__name__)
+setLoggerTag(log, 'plugin')
+
+# Milliseconds a closing socket waits to deliver PPP_SHUTDOWN
+SHUTDOWN_LINGER = 100
+
+
+class Channel:
+    """
+    Channel is a Paranoid-Pirate worker socket driven by an asyncio event
+    loop.
+
+    Unlike `Worker`, a channel does not wait for a request to finish before
+    reading the next message from its socket. Every request is handled in
+    its own task, so a channel can have many requests in flight.
+    """
+
+    def __init__(self, transport, context, addr):
+        self.transport = transport
+        self.context = context
+        self.addr = addr
+        self.socket = None
+        self.socket_name = None
+        self.tasks = set()
+        self.pending = {}
+        self.liveness = HEARTBEAT_LIVENESS
+        self.interval = INTERVAL_INIT
+
+    async def connect(self):
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket_name = "%04X-%04X" % (PREFIX, randint(0, 0x10000))
+        self.socket.setsockopt_string(zmq.IDENTITY, self.socket_name)
+        self.socket.connect(self.addr)
+        await self.socket.send(PPP_READY)
+        self.liveness = HEARTBEAT_LIVENESS
+
+    async def close(self, send_shutdown=True):
+        if send_shutdown:
+            await self.socket.send(PPP_SHUTDOWN)
+            # Give the queued PPP_SHUTDOWN a moment to reach the server.
+            self.socket.setsockopt(zmq.LINGER, SHUTDOWN_LINGER)
+        else:
+            self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.close()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError('zmq socket closed before response'))
+        self.pending.clear()
+
+    async def run(self, stopper):
+        loop = asyncio.get_event_loop()
+        await self.connect()
+        heartbeat_at = loop.time() + HEARTBEAT_INTERVAL
+        while not stopper.is_set():
+            events = await self.socket.poll(HEARTBEAT_INTERVAL * 1000)
+            if events & zmq.POLLIN:
+                frames = _recv_frames(
+                    await self.socket.recv_multipart(copy=False))
+                if self.handle_frames(frames):
+                    self.liveness = HEARTBEAT_LIVENESS
+                    self.interval = INTERVAL_INIT
+                else:
+                    log.warn(
+                        'Invalid message: %s, assuming socket dead', frames)
+                    await self.reconnect()
+            else:
+                await self.handle_heartbeat_timeout()
+
+            if loop.time() > heartbeat_at:
+                heartbeat_at = loop.time() + HEARTBEAT_INTERVAL
+                await self.socket.send(PPP_HEARTBEAT)
+
+        if self.tasks:
+            await asyncio.wait(self.tasks,
+                               timeout=HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS)
+        await self.close()
+
+    def handle_frames(self, frames):
+        #  Get message
+        #  - 7-part envelope + content -> request or response
+        #  - 7-part envelope + content + body -> handler request
+        #  - 1-part HEARTBEAT -> heartbeat
+        if len(frames) in (7, 8):
+            client = frames[0]
+            message_type = frames[2]
+            bounce_count = int(frames[3].decode('utf8'))
+            request_id = frames[4]
+            message = frames[6]
+            body = frames[7] if len(frames) == 8 else None
+            if message_type == PPP_REQUEST:
+                task = asyncio.ensure_future(self.handle_request(
+                    client, bounce_count, request_id, message, body))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                return True
+            elif message_type == PPP_RESPONSE:
+                future = self.pending.pop((request_id, bounce_count), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+                return True
+        elif len(frames) == 1 and frames[0] == PPP_HEARTBEAT:
+            return True
+        return False
+
+    async def handle_heartbeat_timeout(self):
+        self.liveness -= 1
+        if self.liveness == 0:
+            log.warn('Heartbeat failure, can\'t reach queue')
+            log.warn('Reconnecting in %0.2fs...' % self.interval)
+            await asyncio.sleep(self.interval)
+
+            if self.interval < INTERVAL_MAX:
+                self.interval *= 2
+            await self.reconnect()
+
+    async def reconnect(self):
+        await self.close(send_shutdown=False)
+        await self.connect()
+
+    async def handle_request(self, client, bounce_count, request_id,
+                             message, body=None):
+        ctx = {
+            'bounce_count': bounce_count,
+            'request_id': request_id.decode('utf8'),
+        }
+        # Nested requests made while handling this request are sent through
+        # this channel, as the server expects them from the same worker.
+        owner = self.transport.route_request(request_id, self)
+        compressed = is_compressed_frame(message)
+        try:
+            response = await self.transport.handle_message_frames_async(
+                decompress_frame(message), ctx, body)
+        except Exception as e:
+            # skygear-server waits for a response until it times out.
+            log.exception('Error occurred handling request')
+            response = [codec.dumpb(dict(error=_serialize_exc(e).as_dict()))]
+        finally:
+            if owner:
+                self.transport.unroute_request(request_id)
+        if compressed:
+            response = _compress_response(response)
+        await self.socket.send_multipart([
+            client,
+            b'',
+            PPP_RESPONSE,
+            str(bounce_count).encode('utf8'),
+            request_id,
+            b'',
+        ] + response, copy=False)
+
+    async def request(self, request_id, bounce_count, body, timeout):
+        future = asyncio.get_event_loop().create_future()
+        self.pending[(request_id, bounce_count)] = future
+        try:
+            await self.socket.send_multipart([
+                self.socket_name.encode('utf8'),
+                b'',
+                PPP_REQUEST,
+                str(bounce_count).encode('utf8'),
+                request_id,
+                b'',
+                body,
+            ])
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop((request_id, bounce_count), None)
+
+
+class AsyncZmqTransport(AsyncCommonTransport):
+    """
+    AsyncZmqTransport serves skygear-server over a small number of ZMQ
+    sockets driven by an asyncio event loop.
+
+    Requests are multiplexed over the sockets, so the number of requests
+    in flight is not limited by the number of sockets. Extension points
+    defined with `async def` run on the event loop; other extension points
+    run in a thread pool of at most `limit` threads.
+
+    This transport requires Python 3.7 or later, where the request context
+    is kept per asyncio task.
+    """
+
+    def __init__(self, addr, context=None, registry=None, sockets=2,
+                 limit=10):
+        if sys.version_info < (3, 7):
+            raise RuntimeError('AsyncZmqTransport requires Python 3.7 or '
+                               'later')
+        super().__init__(registry,
+                         executor=ThreadPoolExecutor(max_workers=limit))
+        self._addr = addr
+        self._context = context
+        self._socket_count = sockets
+        self._loop = None
+        self._loop_thread = None
+        self._stopper = None
+        self._stop_requested = False
+        self._next_channel = 0
+        self._routes = {}
+        self._request_locks = weakref.WeakValueDictionary()
+        self.channels = []
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.start()
+        serving = asyncio.ensure_future(self.serve_until_stopped())
+        try:
+            loop.run_until_complete(serving)
+        except KeyboardInterrupt:
+            log.info('Shutting down all sockets')
+            self._stopper.set()
+            loop.run_until_complete(serving)
+        finally:
+            loop.close()
+
+    async def serve(self):
+        """
+        Serves requests on the running event loop until the transport is
+        stopped.
+        """
+        self.start()
+        await self.serve_until_stopped()
+
+    def start(self):
+        """
+        Creates the channels on the running event loop. The channels are
+        started by `serve_until_stopped`.
+        """
+        if self._context is None:
+            self._context = zmq.asyncio.Context()
+        self._stopper = asyncio.Event()
+        if self._stop_requested:
+            self._stopper.set()
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.current_thread()
+        self.channels = [Channel(self, self._context, self._addr)
+                         for i in range(self._socket_count)]
+
+    async def serve_until_stopped(self):
+        await asyncio.gather(*[c.run(self._stopper) for c in self.channels])
+
+    def busy_count(self):
+        """
+        Returns the number of requests being handled.
+        """
+        return sum(len(c.tasks) for c in self.channels)
+
+    def stop(self):
+        """
+        Stops the transport. This method can be called from any thread,
+        and before the transport runs.
+        """
+        self._stop_requested = True
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stopper.set)
+
+    async def handle_message_async(self, message, extra_context):
+        frames = await self.handle_message_frames_async(message,
+                                                        extra_context)
+        return frames[0]
+
+    async def handle_message_frames_async(self, message, extra_context,
+                                          body=None):
+        """
+        Handles a request, whose raw body may be in its own frame,
+        returning the message frames of the response.
+        """
+        req = _attach_body(codec.loads(message), body)
+        ctx = req.get('context', {})
+        ctx.update(extra_context)
+        try:
+            retval = await self.dispatch_call_async(
+                req.get('kind'),
+                req.get('name'),
+                ctx,
+                req.get('param', {}))
+            return _response_frames(_advertise_capabilities(req, retval))
+        except ValueError as e:
+            log.error(str(e))
+            return [str(e).encode('utf-8')]
+
+    def route_request(self, request_id, channel):
+        if request_id in self._routes:
+            return False
+        self._routes[request_id] = channel
+        return True
+
+    def unroute_request(self, request_id):
+        self._routes.pop(request_id, None)
+
+    def _channel_for(self, request_id):
+        channel = self._routes.get(request_id)
+        if channel is None:
+            channel = self.channels[self._next_channel % len(self.channels)]
+            self._next_channel += 1
+        return channel
+
+    async def send_action_async(self, action_name, payload, url=None,
+                                timeout=60):
+        ctx = current_context()
+        result = await self._request(payload,
+                                     ctx.get('request_id'),
+                                     ctx.get('bounce_count'),
+                                     timeout)
+        return codec.loads(result)
+
+    async def _request(self, payload, request_id, bounce_count, timeout):
+        if request_id is None:
+            # Sending non-nested request
+            request_id = "%04X-%04X" % (PREFIX, randint(0, 0x10000))
+            bounce_count = 0
+        else:
+            bounce_count += 1
+        request_id = request_id.encode('utf8')
+        body = codec.dumpb({
+            'method': 'POST',
+            'payload': payload,
+        })
+
+        # Responses are matched to requests by request ID and bounce count.
+        # Requests sharing both are sent one at a time.
+        key = (request_id, bounce_count)
+        lock = self._request_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._request_locks[key] = lock
+        async with lock:
+            channel = self._channel_for(request_id)
+            return await channel.request(request_id, bounce_count, body,
+                                         timeout)
+
+    def send_action(self, action_name, payload, url=None, timeout=60):
+        if threading.current_thread() is self._loop_thread:
+            raise RuntimeError('send_action blocks the event loop, '
+                               'use send_action_async instead')
+        ctx = current_context()
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(payload,
+                          ctx.get('request_id'),
+                          ctx.get('bounce_count'),
+                          timeout),
+            self._loop)
+        return codec.loads(future.result())
@@ -0,0 +1,116 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..utils import db, metrics
+from ..utils.context import start_context
+from ..utils.logging import setLoggerTag
+
+log = logging.getLogger(__name__)
+setLoggerTag(log, 'plugin')
+
+
+class HookExecutor:
+    """
+    HookExecutor runs hooks registered with `async_=True` on a pool of
+    background threads, so that the transport can acknowledge them
+    without waiting for them to finish.
+
+    Up to `max_workers` hooks run at the same time, and up to `max_queue`
+    more wait for a thread. When the queue is full, `submit` blocks until
+    a hook finishes, which slows down the transport instead of queueing
+    without bound.
+
+    The number of hooks waiting and running, and of hooks completed and
+    failed, are reported as the `hooks.async.queued`,
+    `hooks.async.running`, `hooks.async.completed` and
+    `hooks.async.failed` metrics.
+    """
+
+    def __init__(self, max_workers=4, max_queue=1000):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.queued = metrics.gauge(
+            'hooks.async.queued', 'Async hooks waiting for a thread')
+        self.running = metrics.gauge(
+            'hooks.async.running', 'Async hooks running')
+        self.completed = metrics.counter(
+            'hooks.async.completed', 'Async hooks completed')
+        self.failed = metrics.counter(
+            'hooks.async.failed', 'Async hooks that raised an exception')
+
+    def submit(self, ctx, func, record, original_record):
+        """
+        Schedules a hook function to be called with the records and its
+        own database connection, in the request context `ctx`.
+        """
+        self._slots.acquire()
+        self.queued.inc()
+        try:
+            return self._executor.submit(self._run, ctx, func, record,
+                                         original_record)
+        except Exception:
+            self.queued.dec()
+            self._slots.release()
+            raise
+
+    def _run(self, ctx, func, record, original_record):
+        self.queued.dec()
+        self.running.inc()
+        try:
+            with start_context(ctx), db.lazy_conn() as conn:
+                func(record, original_record, conn)
+            self.completed.inc()
+        except Exception:
+            self.failed.inc()
+            log.exception('Error occurred running async hook')
+        finally:
+            self.running.dec()
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_hook_executor = None
+_hook_executor_options = {}
+_hook_executor_lock = threading.Lock()
+
+
+def configure_hook_executor(**kwargs):
+    """
+    Sets the options of the default HookExecutor, which is created again
+    with these options when it is next used.
+    """
+    global _hook_executor, _hook_executor_options
+    with _hook_executor_lock:
+        _hook_executor_options = kwargs
+        if _hook_executor is not None:
+            _hook_executor.shutdown(wait=False)
+            _hook_executor = None
+
+
+def get_hook_executor():
+    """
+    Returns the default HookExecutor shared by the transports.
+    """
+    global _hook_executor
+    with _hook_executor_lock:
+        if _hook_executor is None:
+            _hook_executor = HookExecutor(**_hook_executor_options)
+        return _hook_executor
@@ -11,22 +11,28 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import base64
-import json
+import io
 import logging
 import os
-from functools import wraps
+import sys
+from collections.abc import Iterator
+from functools import partial, wraps
+from urllib.parse import unquote
 
-from werkzeug.test import EnvironBuilder
 from werkzeug.wrappers import BaseResponse, Request
 
+from .. import codec
 from ..encoding import (_serialize_exc, deserialize_or_none, deserialize_value,
                         serialize_record, serialize_value)
 from ..error import SkygearException
 from ..registry import get_registry
 from ..utils import db
-from ..utils.context import start_context
+from ..utils.context import current_context, start_context
 from ..utils.logging import setLoggerTag
+from .background import get_hook_executor
+from .compression import get_compressor
 
 log = logging.getLogger(__name__)
 setLoggerTag(log, 'plugin')
@@ -42,19 +48,23 @@ def _wrap_result(f):
         try:
             return dict(result=f(self, *args, **kwargs))
         except Exception as e:
-            handler = get_registry().get_exception_handler(e.__class__)
-            if not handler:
-                handler = handle_exception
-            result = handler(e)
-            if result is None:
-                return dict(error=_serialize_exc(e).as_dict())
-            elif isinstance(result, Exception):
-                return dict(error=_serialize_exc(result).as_dict())
-            else:
-                return result
+            return _error_result(e)
     return wrapper
 
 
+def _error_result(e):
+    handler = get_registry().get_exception_handler(e.__class__)
+    if not handler:
+        handler = handle_exception
+    result = handler(e)
+    if result is None:
+        return dict(error=_serialize_exc(e).as_dict())
+    elif isinstance(result, Exception):
+        return dict(error=_serialize_exc(result).as_dict())
+    else:
+        return result
+
+
 def handle_exception(exc):
     if not isinstance(exc, SkygearException):
         log.exception("Error occurred processing request")
@@ -71,7 +81,7 @@ def encode_base64_json(data):
 
     This can be used to get dict-like data into HTTP headers / envvar.
     """
-    return base64.b64encode(bytes(json.dumps(data), 'utf-8'))
+    return base64.b64encode(codec.dumpb(data))
 
 
 def decode_base64_json(data):
@@ -80,7 +90,233 @@ def decode_base64_json(data):
 
     This can be used to get dict-like data into HTTP headers / envvar.
     """
-    return json.loads(base64.b64decode(data).decode('utf-8'))
+    return codec.loads(base64.b64decode(data))
+
+
+class _Base64Input:
+    """
+    WSGI input stream of a base64 encoded request body, which is only
+    decoded when the handler reads the body.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._stream = None
+
+    def _open(self):
+        if self._stream is None:
+            self._stream = io.BytesIO(base64.b64decode(self._data))
+            self._data = None
+        return self._stream
+
+    def read(self, size=-1):
+        return self._open().read(size)
+
+    def readline(self, size=-1):
+        return self._open().readline(size)
+
+    def readlines(self, hint=-1):
+        return self._open().readlines(hint)
+
+    def __iter__(self):
+        return iter(self._open())
+
+
+_READLINE_WINDOW = 8192
+
+
+class _BufferInput:
+    """
+    WSGI input stream of a request body received as raw bytes, such as a
+    ZMQ frame, which is only copied as far as the handler reads it.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        self._pos = 0
+
+    def _end(self, size):
+        if size is None or size < 0:
+            return len(self._buffer)
+        return min(self._pos + size, len(self._buffer))
+
+    def read(self, size=-1):
+        end = self._end(size)
+        data = self._buffer[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def readline(self, size=-1):
+        # The newline is searched for in bounded windows, so that reading
+        # line by line does not copy the rest of the buffer for each line.
+        end = self._end(size)
+        start = self._pos
+        while self._pos < end:
+            window_end = min(self._pos + _READLINE_WINDOW, end)
+            window = self._buffer[self._pos:window_end].tobytes()
+            newline = window.find(b'\n')
+            if newline >= 0:
+                self._pos += newline + 1
+                break
+            self._pos = window_end
+        return self._buffer[start:self._pos].tobytes()
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def _base64_length(data):
+    """
+    Returns the length of the data encoded in base64, without decoding it.
+    """
+    if not data:
+        return 0
+    padding = 0
+    if data[-2:] in ('==', b'=='):
+        padding = 2
+    elif data[-1:] in ('=', b'='):
+        padding = 1
+    return len(data) // 4 * 3 - padding
+
+
+def _input_environ(body, raw_body):
+    """
+    Returns the WSGI input stream and content length of a request body.
+    """
+    if raw_body is not None:
+        return {
+            'wsgi.input': _BufferInput(raw_body),
+            'CONTENT_LENGTH': str(len(memoryview(raw_body))),
+        }
+    return {
+        'wsgi.input': _Base64Input(body or b''),
+        'CONTENT_LENGTH': str(_base64_length(body)),
+    }
+
+
+def handler_environ(method, path, query_string, headers, body,
+                    raw_body=None):
+    """
+    Returns the WSGI environ of a handler request from skygear-server,
+    whose headers map each name to a list of values and whose body is
+    base64 encoded, or given as bytes in `raw_body`.
+    """
+    if query_string is None and '?' in path:
+        path, query_string = path.split('?', 1)
+    environ = {
+        'REQUEST_METHOD': method.upper(),
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path).encode('utf-8').decode('latin1'),
+        'QUERY_STRING': query_string or '',
+        'REQUEST_URI': path,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    environ.update(_input_environ(body, raw_body))
+    for name, values in (headers or {}).items():
+        if isinstance(values, list):
+            values = ', '.join(values)
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = values
+        elif key != 'CONTENT_LENGTH':
+            environ['HTTP_' + key] = values
+    return environ
+
+
+_END = object()
+
+
+class _StreamedBody:
+    """
+    Body of a handler response which is sent to skygear-server chunk by
+    chunk as the handler produces it, instead of being buffered.
+
+    The chunks are produced and closed in the request context `ctx`, as
+    the body is sent after the handler has returned.
+    """
+
+    def __init__(self, chunks, close=None, ctx=None):
+        self._chunks = chunks
+        self._close = close
+        self._ctx = ctx
+
+    def _in_context(self, func, *args):
+        if self._ctx is None:
+            return func(*args)
+        with start_context(self._ctx):
+            return func(*args)
+
+    def __iter__(self):
+        chunks = iter(self._chunks)
+        try:
+            while True:
+                chunk = self._in_context(next, chunks, _END)
+                if chunk is _END:
+                    break
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def base64_chunks(self):
+        """
+        Yields the body encoded in base64, splitting the chunks at
+        multiples of 3 bytes so that the encoded chunks can be joined.
+        """
+        rest = b''
+        for chunk in self:
+            if rest:
+                chunk = rest + chunk
+            end = len(chunk) - len(chunk) % 3
+            rest = chunk[end:]
+            if end:
+                yield base64.b64encode(chunk[:end])
+        if rest:
+            yield base64.b64encode(rest)
+
+    def close(self):
+        if self._close is not None:
+            close, self._close = self._close, None
+            self._in_context(close)
+
+
+def _compress_body(headers, body, accept_encoding):
+    """
+    Returns the body of a handler response compressed with an encoding in
+    `accept_encoding` if compression is enabled, updating the headers.
+    """
+    compressor = get_compressor()
+    if compressor is None or not accept_encoding:
+        return body
+    compressed = compressor.compress_response(headers, body, accept_encoding)
+    if compressed is not body and isinstance(body, _StreamedBody):
+        compressed = _StreamedBody(compressed, body.close)
+    return compressed
+
+
+def _streamed_body(output):
+    """
+    Returns the streamed body of a handler result, or None.
+    """
+    result = output.get('result') if isinstance(output, dict) else None
+    if isinstance(result, dict) and \
+            isinstance(result.get('body'), _StreamedBody):
+        return result['body']
+    return None
 
 
 def dict_from_base64_environ(name):
@@ -92,12 +328,43 @@ class CommonTransport:
     def __init__(self, registry=None):
         self._registry = registry or get_registry()
 
+    def dispatch_call(self, kind, name, ctx, param):
+        """
+        Dispatches request to a plugin extension point function.
+        """
+        if kind == 'init':
+            raise Exception('Init trigger is deprecated, '
+                            'use init event instead')
+        elif kind == 'provider':
+            action = param.pop('action')
+            return self.call_provider(ctx, name, action, param)
+        elif kind == 'handler':
+            return self.call_handler(ctx, name, param)
+        elif kind == 'event':
+            return self.call_event_func(name, param)
+        else:
+            return self.call_func(ctx, kind, name, param)
+
+    async def send_action_async(self, action_name, payload, url=None,
+                                timeout=60):
+        """
+        Sends an action with `send_action` in the default executor of the
+        event loop, so that many actions can be in flight at the same time.
+        The action is not nested in the request being handled.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, partial(self.send_action, action_name, payload, url,
+                          timeout))
+
     @_wrap_result
     def call_func(self, ctx, kind, name, param):
         obj = self._registry.get_func(kind, name)
         with start_context(ctx):
             if kind == 'op':
                 return self.op(obj, param.get('args', {}))
+            elif kind == 'hook' and self._registry.is_async_hook(name):
+                return self.async_hook(ctx, obj, param)
             elif kind == 'hook':
                 return self.hook(obj, param)
             elif kind == 'timer':
@@ -134,41 +401,91 @@ class CommonTransport:
             return self.handler(func, param)
 
     def handler(self, func, param):
-        builder = EnvironBuilder(
-            method=param['method'],
-            path=param['path'],
-            query_string=param.get('query_string'),
-            headers=param['header'],
-            data=base64.b64decode(param['body'])
-        )
-        environ = builder.get_environ()
-        request = Request(environ, populate_request=False, shallow=False)
-        response = func(request)
-        status = 200
+        request = self._handler_request(param)
+        return self._handler_response(
+            func(request), raw='raw_body' in param,
+            stream=self._can_stream(param),
+            accept_encoding=request.headers.get('Accept-Encoding'))
+
+    def _can_stream(self, param):
+        """
+        Returns whether the transport can send the body of the response
+        to the handler request `param` while the handler produces it.
+        """
+        return False
+
+    def _handler_request(self, param):
+        environ = handler_environ(param['method'], param['path'],
+                                  param.get('query_string'),
+                                  param['header'], param.get('body'),
+                                  param.get('raw_body'))
+        return Request(environ, populate_request=False, shallow=False)
+
+    def _handler_response(self, response, raw=False, stream=False,
+                          accept_encoding=None):
+        """
+        Returns the handler response for skygear-server, with the body
+        base64 encoded, or as bytes if `raw` is True.
+
+        The body of a streamed werkzeug response, or of a generator
+        returned by the handler, is a _StreamedBody if `stream` is True,
+        and is buffered otherwise.
+
+        If compression is enabled, the body is compressed with an
+        encoding in `accept_encoding`, the header of the request.
+        """
+        status, headers, body = self._response_body(response)
+        body = _compress_body(headers, body, accept_encoding)
+        if isinstance(body, _StreamedBody):
+            if stream:
+                return {
+                    'status': status,
+                    'header': headers,
+                    'body': body
+                }
+            body = b''.join(body)
+        if not raw:
+            body = base64.b64encode(body).decode('ascii')
+        return {
+            'status': status,
+            'header': headers,
+            'body': body
+        }
+
+    def _response_body(self, response):
+        """
+        Returns the status, headers and body of a handler response, whose
+        body is bytes or a _StreamedBody.
+        """
         if isinstance(response, BaseResponse):
             headers = {}
             for k, v in response.headers:
-                headers[k] = [v]
-            body_byte = response.get_data()
-            body = base64.b64encode(body_byte).decode('utf-8')
-            status = response.status_code
+                headers.setdefault(k, []).append(v)
+            if response.is_streamed:
+                body = _StreamedBody(response.iter_encoded(), response.close,
+                                     current_context())
+            else:
+                body = response.get_data()
+            return response.status_code, headers, body
         elif isinstance(response, str):
             headers = {'Content-Type': ['text/plain; charset=utf-8']}
-            body = base64.b64encode(
-                bytes(response, 'utf-8')
-            ).decode('utf-8')
+            return 200, headers, response.encode('utf-8')
+        elif isinstance(response, Iterator):
+            headers = {'Content-Type': ['application/octet-stream']}
+            body = _StreamedBody(response, getattr(response, 'close', None),
+                                 current_context())
+            return 200, headers, body
         else:
             headers = {
                 'Content-Type': ['application/json']
              }
-            body = encode_base64_json(response).decode('utf-8')
-        return {
-            'status': status,
-            'header': headers,
-            'body': body
-        }
+            return 200, headers, codec.dumpb(response)
 
     def op(self, func, param):
+        args, kwargs = self._op_arguments(param)
+        return serialize_value(func(*args, **kwargs))
+
+    def _op_arguments(self, param):
         if isinstance(param, list):
             args = deserialize_value(param)
             kwargs = {}
@@ -178,12 +495,13 @@ class CommonTransport:
         else:
             msg = "Unsupported args type '{0}'".format(type(param))
             raise ValueError(msg)
-        return serialize_value(func(*args, **kwargs))
+        return args, kwargs
 
     def hook(self, func, param):
-        original_record = deserialize_or_none(param.get('original', None))
-        record = deserialize_or_none(param.get('record', None))
-        with db.conn() as conn:
+        original_record = deserialize_or_none(param.get('original', None),
+                                              lazy=True)
+        record = deserialize_or_none(param.get('record', None), lazy=True)
+        with db.lazy_conn() as conn:
             returned = func(record, original_record, conn)
 
             # If the hook function does not return a value, assume that
@@ -192,14 +510,34 @@ class CommonTransport:
                 returned = record
         return serialize_record(returned)
 
+    def async_hook(self, ctx, func, param):
+        """
+        Runs an async hook in the background and returns the record
+        at once, since skygear-server does not wait for the result.
+
+        The request is answered by the time the hook runs, so the hook runs
+        without the request ID and bounce count of the request, and the
+        actions it sends are not nested in the request.
+        """
+        original_record = deserialize_or_none(param.get('original', None),
+                                              lazy=True)
+        record = deserialize_or_none(param.get('record', None), lazy=True)
+        ctx = {k: v for k, v in ctx.items()
+               if k not in ('request_id', 'bounce_count')}
+        get_hook_executor().submit(ctx, func, record, original_record)
+        return param.get('record')
+
     def timer(self, func):
         return func()
 
     def event(self, func, data):
+        self._check_event_data(data)
+        return func(**data)
+
+    def _check_event_data(self, data):
         if not isinstance(data, dict):
             msg = "Unsupported args type '{0}'".format(type(data))
             raise ValueError(msg)
-        return func(**data)
 
     def provider(self, provider, action, data):
         return provider.handle_action(action, data)
@@ -0,0 +1,291 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compression of the responses sent by the transports.
+
+Handler responses are compressed with the best encoding accepted by the
+`Accept-Encoding` header of the request, which is `br` if `brotli` is
+installed, `gzip` or `deflate`. The JSON payloads sent to skygear-server
+are compressed when skygear-server accepts it.
+
+Compression is off until it is enabled with `configure_compression`.
+"""
+import gzip
+import threading
+import time
+import zlib
+
+from ..utils import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# CPU time of the current thread, or of the process before Python 3.7
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+# Types of content which is already compressed are not in this list.
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def _is_compressible(content_type):
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype.startswith('text/') or \
+        mimetype in COMPRESSIBLE_TYPES or \
+        mimetype.endswith(('+json', '+xml'))
+
+
+def _parse_accept_encoding(value):
+    """
+    Returns the encodings in an `Accept-Encoding` header with their
+    quality values.
+    """
+    accepted = {}
+    for item in value.split(','):
+        encoding, _, params = item.partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, q = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        accepted[encoding] = quality
+    return accepted
+
+
+def _header(headers, name):
+    """
+    Returns the key of a header in a dict mapping header names to lists of
+    values, whatever its case, or None.
+    """
+    name = name.lower()
+    for key in headers:
+        if key.lower() == name:
+            return key
+    return None
+
+
+def _is_compressible_response(headers):
+    """
+    Returns whether a response with the headers is not compressed yet and
+    has a type of content which is worth compressing.
+    """
+    if _header(headers, 'Content-Encoding') is not None:
+        return False
+    content_type = _header(headers, 'Content-Type')
+    return content_type is not None and \
+        _is_compressible(headers[content_type][0])
+
+
+def _set_content_encoding(headers, encoding, size):
+    """
+    Updates the headers of a response compressed with `encoding` to
+    `size` bytes, or streamed if `size` is None.
+    """
+    content_length = _header(headers, 'Content-Length')
+    if content_length is not None:
+        del headers[content_length]
+    if size is not None:
+        headers['Content-Length'] = [str(size)]
+    headers['Content-Encoding'] = [encoding]
+    headers.setdefault(_header(headers, 'Vary') or 'Vary',
+                       []).append('Accept-Encoding')
+
+
+def decompress(data, encoding):
+    """
+    Returns data compressed with `encoding`, as in `Content-Encoding`.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    elif encoding == 'deflate':
+        return zlib.decompress(data)
+    elif encoding == 'br' and brotli is not None:
+        return brotli.decompress(data)
+    elif encoding == 'identity':
+        return data
+    raise ValueError('Unsupported content encoding "{}"'.format(encoding))
+
+
+def is_compressed_frame(frame):
+    return bytes(frame[:2]) == GZIP_MAGIC
+
+
+def decompress_frame(frame):
+    """
+    Returns a message frame, which skygear-server may have compressed with
+    gzip. JSON never starts with the gzip magic number, and a frame which
+    cannot be decompressed is returned as is to fail decoding as JSON.
+    """
+    if is_compressed_frame(frame):
+        try:
+            return gzip.decompress(frame)
+        except (OSError, EOFError, zlib.error):
+            pass
+    return frame
+
+
+class Compressor:
+    """
+    Compressor compresses responses of at least `min_size` bytes, with
+    compression `level` from 1 (fastest) to 9 (smallest). Streamed
+    responses, whose size is unknown, are always compressed.
+
+    The size of the data compressed, the bytes saved and the CPU time
+    spent are reported as the `compression.bytes_in`,
+    `compression.bytes_saved` and `compression.cpu_seconds` metrics.
+    """
+
+    def __init__(self, level=6, min_size=1024):
+        self.level = level
+        self.min_size = min_size
+        self.encodings = ('br', 'gzip', 'deflate') if brotli is not None \
+            else ('gzip', 'deflate')
+        self.bytes_in = metrics.counter(
+            'compression.bytes_in', 'Bytes of responses compressed')
+        self.bytes_saved = metrics.counter(
+            'compression.bytes_saved', 'Bytes saved by compression')
+        self.cpu_seconds = metrics.counter(
+            'compression.cpu_seconds', 'CPU time spent compressing')
+
+    def negotiate(self, accept_encoding, size=None):
+        """
+        Returns the encoding to compress `size` bytes with, which is
+        accepted by the `Accept-Encoding` header, or None.
+        """
+        if not accept_encoding:
+            return None
+        if size is not None and size < self.min_size:
+            return None
+        accepted = _parse_accept_encoding(accept_encoding)
+        for encoding in self.encodings:
+            if accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return None
+
+    def _compressobj(self, encoding):
+        if encoding == 'br':
+            # brotli quality goes from 0 to 11
+            return brotli.Compressor(quality=min(self.level, 11))
+        wbits = 31 if encoding == 'gzip' else zlib.MAX_WBITS
+        return zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+
+    def _flush(self, compressobj):
+        if brotli is not None and isinstance(compressobj, brotli.Compressor):
+            return compressobj.finish()
+        return compressobj.flush()
+
+    def _process(self, compressobj, data):
+        if brotli is not None and isinstance(compressobj, brotli.Compressor):
+            return compressobj.process(data)
+        return compressobj.compress(data)
+
+    def compress(self, data, encoding='gzip'):
+        start = _cpu_time()
+        compressobj = self._compressobj(encoding)
+        compressed = self._process(compressobj, data) + \
+            self._flush(compressobj)
+        self._record(len(data), len(compressed), start)
+        return compressed
+
+    def compress_chunks(self, chunks, encoding='gzip'):
+        """
+        Yields the chunks compressed with `encoding` as they are produced.
+        """
+        compressobj = self._compressobj(encoding)
+        for chunk in chunks:
+            start = _cpu_time()
+            compressed = self._process(compressobj, chunk)
+            self._record(len(chunk), len(compressed), start)
+            if compressed:
+                yield compressed
+        start = _cpu_time()
+        compressed = self._flush(compressobj)
+        self._record(0, len(compressed), start)
+        yield compressed
+
+    def _record(self, size, compressed_size, start):
+        self.cpu_seconds.inc(_cpu_time() - start)
+        self.bytes_in.inc(size)
+        self.bytes_saved.inc(size - compressed_size)
+
+    def compress_response(self, headers, body, accept_encoding):
+        """
+        Returns the body of a handler response compressed with the
+        encoding accepted by the request, updating the headers of the
+        response. The body is bytes, or an iterable of chunks which is
+        compressed chunk by chunk.
+        """
+        if not _is_compressible_response(headers):
+            return body
+        size = len(body) if isinstance(body, bytes) else None
+        encoding = self.negotiate(accept_encoding, size)
+        if encoding is None:
+            return body
+
+        if size is not None:
+            compressed = self.compress(body, encoding)
+            if len(compressed) >= size:
+                return body
+            body = compressed
+        else:
+            body = self.compress_chunks(body, encoding)
+        _set_content_encoding(headers, encoding,
+                              len(body) if size is not None else None)
+        return body
+
+    def compress_frame(self, frame):
+        """
+        Returns a message frame compressed with gzip, if it is at least
+        `min_size` bytes.
+        """
+        if len(frame) < self.min_size:
+            return frame
+        return self.compress(frame, 'gzip')
+
+
+_compressor = None
+_compressor_lock = threading.Lock()
+
+
+def configure_compression(enabled=True, **kwargs):
+    """
+    Enables compression with the options of Compressor, or disables it.
+    """
+    global _compressor
+    with _compressor_lock:
+        _compressor = Compressor(**kwargs) if enabled else None
+
+
+def get_compressor():
+    """
+    Returns the Compressor of the transports, or None if compression is
+    disabled.
+    """
+    return _compressor
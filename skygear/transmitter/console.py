@@ -11,10 +11,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 import logging
 import sys
 
+from .. import codec
 from .. import error as skyerr
 from ..utils.logging import setLoggerTag
 from .common import CommonTransport, dict_from_base64_environ
@@ -85,7 +85,7 @@ class ConsoleTransport(CommonTransport):
         if not data:
             return {}
         try:
-            return json.loads(data)
+            return codec.loads(data)
         except ValueError:
             msg = "unable to parse JSON string"
             logging.exception(msg)
@@ -93,7 +93,7 @@ class ConsoleTransport(CommonTransport):
 
     def writeJSON(self, data):
         try:
-            self.write(json.dumps(data))
+            self.write(codec.dumps(data))
         except TypeError:
             msg = "unable to serialize obj to JSON string"
             logging.exception(msg)
@@ -11,46 +11,222 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import datetime
-import json
 import logging
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-import strict_rfc3339
 from werkzeug.routing import Map, Rule
-from werkzeug.serving import run_simple
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, run_simple
 from werkzeug.wrappers import Request, Response
 
+from .. import codec
 from ..__version__ import __version__
 from ..encoding import _serialize_exc
+from ..utils.http import IDEMPOTENT_ACTIONS, get_client
 from ..utils.logging import setLoggerTag
-from .common import CommonTransport
+from .common import CommonTransport, _streamed_body
+from .compression import decompress, get_compressor
 
 log = logging.getLogger(__name__)
 setLoggerTag(log, 'plugin')
 
 
-class PayloadEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime.datetime):
-            ts = obj.timestamp()
-            return strict_rfc3339.timestamp_to_rfc3339_utcoffset(ts)
-
-
-def send_action(url, payload, timeout=60):
+def send_action(url, payload, timeout=60, client=None):
+    """
+    Sends an action to skygear-server with `client`, or the default
+    HTTPClient.
+    """
+    if client is None:
+        client = get_client()
     headers = {'Content-type': 'application/json',
                'Accept': 'application/json',
                'X-Skygear-SDK-Version': 'py-skygear/' + __version__}
 
-    _data = json.dumps(payload, cls=PayloadEncoder)
-    return requests.post(url, data=_data, headers=headers, timeout=timeout) \
-        .json()
+    _data = codec.dumpb(payload)
+    resp = client.post(url, _data, headers=headers, timeout=timeout,
+                       idempotent=payload.get('action') in IDEMPOTENT_ACTIONS)
+    return codec.loads(resp.content)
+
+
+def listen_socket(hostname, port, backlog=128):
+    """
+    Returns a listening socket, which is shared by the HttpTransport of
+    each worker process when passed as `fd`.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((hostname, port))
+    sock.listen(backlog)
+    return sock
+
+
+# Set in the environ of a request whose response is sent with chunked
+# transfer encoding, to True once the last chunk is sent.
+_CHUNKED = 'skygear.chunked'
+
+
+def _chunk_responses(app):
+    """
+    Returns a WSGI application which sends the responses of `app` that
+    have no Content-Length with chunked transfer encoding, so that a
+    streamed response does not close the HTTP/1.1 connection.
+    """
+    def application(environ, start_response):
+        def start(status, headers, exc_info=None):
+            names = {k.lower() for k, _ in headers}
+            code = int(status.split(None, 1)[0])
+            if environ.get('SERVER_PROTOCOL') == 'HTTP/1.1' and \
+                    environ['REQUEST_METHOD'] != 'HEAD' and \
+                    code >= 200 and code not in (204, 304) and \
+                    not names & {'content-length', 'transfer-encoding'}:
+                headers = list(headers) + [('Transfer-Encoding', 'chunked')]
+                environ[_CHUNKED] = False
+            return start_response(status, headers, exc_info)
+
+        return _chunks(environ, app(environ, start))
+    return application
+
+
+def _chunks(environ, app_iter):
+    try:
+        for data in app_iter:
+            if _CHUNKED not in environ:
+                yield data
+            elif data:
+                yield b'%x\r\n' % len(data) + data + b'\r\n'
+        if _CHUNKED in environ:
+            yield b'0\r\n\r\n'
+            environ[_CHUNKED] = True
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Keeps HTTP/1.1 connections from skygear-server open between requests,
+    closing them after the idle timeout of the server.
+
+    The handler relies on how werkzeug 0.11 to 0.16 closes connections
+    after a response without Content-Length.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.request_timeout
+        super().setup()
+        # Headers and body are written separately, which Nagle's algorithm
+        # would delay on a kept-alive connection.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle_one_request(self):
+        if not self.wait_for_request():
+            self.close_connection = True
+            return
+        super().handle_one_request()
+
+    def wait_for_request(self):
+        """
+        Returns whether a request arrives on the connection within the idle
+        timeout, which is shorter than the time the request is given to be
+        read once it has started.
+        """
+        self.connection.settimeout(self.server.idle_timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except socket.timeout:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def send_header(self, keyword, value):
+        environ = getattr(self, 'environ', {})
+        if keyword.lower() == 'connection' and value == 'close' and \
+                environ.get(_CHUNKED) is False:
+            # werkzeug closes the connection after a response without
+            # Content-Length, which chunked encoding makes unnecessary.
+            self.close_connection = \
+                self.headers.get('Connection', '').lower() == 'close'
+            if not self.close_connection:
+                return
+        super().send_header(keyword, value)
+
+    def run_wsgi(self):
+        super().run_wsgi()
+        # A chunked response that failed before its last chunk leaves the
+        # connection in the middle of the response.
+        if self.environ.get(_CHUNKED) is False:
+            self.close_connection = True
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    PooledWSGIServer serves each connection on a pool of `threads`
+    threads, instead of starting a thread for every connection.
+
+    Up to `queue_size` accepted connections wait for a thread. When the
+    queue is full, the server stops accepting connections, which wait in
+    the listen backlog of `backlog` connections instead.
+
+    A keep-alive connection holds its thread until it is idle for
+    `idle_timeout` seconds, which is kept short so that idle connections
+    do not keep the connections waiting in the queue from being served.
+    A request which has started is given `timeout` seconds to be read.
+    Responses without Content-Length, such as streamed handler responses,
+    are sent with chunked transfer encoding to keep the connection open.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads=16, queue_size=64,
+                 backlog=128, timeout=30, idle_timeout=2, fd=None):
+        self.request_queue_size = backlog
+        self.request_timeout = timeout
+        self.idle_timeout = idle_timeout
+        super().__init__(host, port, _chunk_responses(app),
+                         handler=_KeepAliveRequestHandler, fd=fd)
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._slots = threading.BoundedSemaphore(threads + queue_size)
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+
+    def busy_count(self):
+        """
+        Returns the number of connections being served or waiting for a
+        thread.
+        """
+        return self._busy
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        with self._busy_lock:
+            self._busy += 1
+        self._executor.submit(self._process_request, request,
+                              client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._busy_lock:
+                self._busy -= 1
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
 
 
 class HttpTransport(CommonTransport):
     """
     HttpTransport implements a transport protocol between skygear and
     plugin that communicates over a HTTP connection.
+
+    With `threads`, requests are served by a PooledWSGIServer. Otherwise,
+    or in debug mode, the werkzeug development server is used.
     """
 
     def _url_map(self):
@@ -61,8 +237,19 @@ class HttpTransport(CommonTransport):
             Rule('/', endpoint='_'),
             ])
 
-    def __init__(self, addr, registry=None, debug=False):
+    def __init__(self, addr, registry=None, debug=False, client=None,
+                 threads=None, queue_size=64, backlog=128, timeout=30,
+                 idle_timeout=2, fd=None):
         super().__init__(registry)
+        self.client = client
+        self.threads = threads
+        self.queue_size = queue_size
+        self.backlog = backlog
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.fd = fd
+        self.server = None
+        self._stopped = threading.Event()
         self.url_map = self._url_map()
         if ':' in addr:
             hostname, port = addr.split(':', 2)
@@ -88,25 +275,51 @@ class HttpTransport(CommonTransport):
         except Exception as e:
             log.exception("exception while handling request")
             output = dict(error=_serialize_exc(e).as_dict())
-        return Response(json.dumps(output), mimetype="application/json")
+        body = _streamed_body(output)
+        if body is not None:
+            return Response(self._stream_output(output['result'], body),
+                            mimetype="application/json")
+        return self._output_response(request, codec.dumpb(output))
+
+    def _output_response(self, request, data):
+        """
+        Returns the response of a JSON payload, compressed if compression
+        is enabled and accepted by skygear-server.
+        """
+        compressor = get_compressor()
+        encoding = None
+        if compressor is not None:
+            encoding = compressor.negotiate(
+                request.headers.get('Accept-Encoding'), len(data))
+        if encoding is None:
+            return Response(data, mimetype="application/json")
+        response = Response(compressor.compress(data, encoding),
+                            mimetype="application/json")
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _stream_output(self, result, body):
+        """
+        Yields the JSON of a handler result whose body is streamed, encoding
+        the body in base64 as the handler produces it.
+        """
+        result = dict(result)
+        del result['body']
+        head = codec.dumpb({'result': result})
+        yield head[:-2] + b',"body":"'
+        yield from body.base64_chunks()
+        yield b'"}}'
+
+    def _can_stream(self, param):
+        return True
 
     def _dispatch(self, request):
         """
         Dispatches request to a plugin extension point function.
         """
         kind, name, ctx, param = self.read_request(request)
-        if kind == 'init':
-            raise Exception('Init trigger is deprecated, '
-                            'use init event instead')
-        elif kind == 'provider':
-            action = param.pop('action')
-            return self.call_provider(ctx, name, action, param)
-        elif kind == 'handler':
-            return self.call_handler(ctx, name, param)
-        elif kind == 'event':
-            return self.call_event_func(name, param)
-        else:
-            return self.call_func(ctx, kind, name, param)
+        return self.dispatch_call(kind, name, ctx, param)
 
     def read_request(self, request):
         """
@@ -115,8 +328,9 @@ class HttpTransport(CommonTransport):
         adapter = self.url_map.bind_to_environ(request.environ)
         _, values = adapter.match()
 
-        request_data = request.get_data(as_text=True)
-        req = json.loads(request_data) if request_data else {}
+        request_data = decompress(request.get_data(),
+                                  request.headers.get('Content-Encoding'))
+        req = codec.loads(request_data) if request_data else {}
 
         kind = req.get('kind')
         name = req.get('name')
@@ -129,11 +343,46 @@ class HttpTransport(CommonTransport):
         """
         Start the web server.
         """
-        run_simple(self.hostname, self.port, self.dispatch,
-                   threaded=True,
-                   use_reloader=self.debug)
+        if self.debug or not self.threads:
+            run_simple(self.hostname, self.port, self.dispatch,
+                       threaded=True,
+                       use_reloader=self.debug)
+            return
+
+        self.server = PooledWSGIServer(self.hostname, self.port,
+                                       self.dispatch,
+                                       threads=self.threads,
+                                       queue_size=self.queue_size,
+                                       backlog=self.backlog,
+                                       timeout=self.timeout,
+                                       idle_timeout=self.idle_timeout,
+                                       fd=self.fd)
+        if self._stopped.is_set():
+            # Stopped before the server was created
+            self.server.server_close()
+            return
+        log.info('Serving on http://%s:%d with %d threads',
+                 self.hostname, self.server.server_address[1],
+                 self.threads)
+        self.server.serve_forever()
+
+    def stop(self):
+        self._stopped.set()
+        if self.server is not None:
+            # shutdown waits for serve_forever to return, which may be
+            # running in the thread calling stop.
+            threading.Thread(target=self.server.shutdown).start()
+
+    def busy_count(self):
+        """
+        Returns the number of connections being served.
+        """
+        if self.server is None:
+            return 0
+        return self.server.busy_count()
 
     def send_action(self, action_name, payload, url, timeout):
         return send_action(url,
                            payload,
-                           timeout=timeout)
+                           timeout=timeout,
+                           client=self.client)
@@ -0,0 +1,210 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import sys
+import threading
+import time
+import unittest
+
+import zmq
+
+from ...registry import Registry
+from ...transmitter.async_zmq import AsyncZmqTransport
+from ...transmitter.zmq import (PPP_HEARTBEAT, PPP_READY, PPP_REQUEST,
+                                PPP_RESPONSE, PPP_SHUTDOWN)
+from ...utils.context import current_context
+
+
+@unittest.skipIf(sys.version_info < (3, 7),
+                 'AsyncZmqTransport requires Python 3.7')
+class TestAsyncZmq(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.router = self.context.socket(zmq.ROUTER)
+        self.router.bind('tcp://127.0.0.1:45678')
+        self.registry = Registry()
+        self.transport = AsyncZmqTransport('tcp://127.0.0.1:45678',
+                                           registry=self.registry,
+                                           sockets=1)
+        self.transport_t = threading.Thread(target=self.transport.run)
+
+    def tearDown(self):
+        self.transport.stop()
+        self.transport_t.join()
+        self.router.close(linger=0)
+        self.context.destroy()
+
+    def start(self):
+        self.transport_t.start()
+        frames = self.recv()
+        self.assertEqual(frames[1], PPP_READY)
+        return frames[0]
+
+    def recv(self):
+        while True:
+            self.assertTrue(self.router.poll(5000))
+            frames = self.router.recv_multipart()
+            if frames[1:] != [PPP_HEARTBEAT]:
+                return frames
+
+    def send_request(self, address, request_id, body):
+        self.router.send_multipart([
+            address,
+            address,
+            b'',
+            PPP_REQUEST,
+            b'0',
+            request_id,
+            b'',
+            json.dumps(body).encode('utf8'),
+        ])
+
+    def test_shutdown(self):
+        address = self.start()
+        self.transport.stop()
+        frames = self.recv()
+        self.assertEqual(frames, [address, PPP_SHUTDOWN])
+
+    def test_sync_op(self):
+        self.registry.register_op('hello', lambda name: 'hello ' + name)
+        address = self.start()
+        self.send_request(address, b'REQ-ID', {
+            'kind': 'op',
+            'name': 'hello',
+            'param': {'args': {'name': 'world'}},
+        })
+        frames = self.recv()
+        self.assertEqual(frames[3], PPP_RESPONSE)
+        self.assertEqual(frames[5], b'REQ-ID')
+        self.assertEqual(json.loads(frames[7].decode('utf8')),
+                         {'result': 'hello world'})
+
+    def test_unexpected_error(self):
+        async def fail(*args, **kwargs):
+            raise RuntimeError('unexpected')
+
+        self.transport.handle_message_frames_async = fail
+        address = self.start()
+        self.send_request(address, b'REQ-ID', {'kind': 'op', 'name': 'x'})
+        frames = self.recv()
+        self.assertEqual(frames[3], PPP_RESPONSE)
+        self.assertEqual(frames[5], b'REQ-ID')
+        error = json.loads(frames[7].decode('utf8'))['error']
+        self.assertEqual(error['message'], 'unexpected')
+
+    def test_async_requests_in_flight(self):
+        async def slow(index):
+            await asyncio.sleep(0.5)
+            return current_context()['request_id']
+
+        self.registry.register_op('slow', slow)
+        address = self.start()
+        started_at = time.time()
+        for i in range(5):
+            self.send_request(address, 'REQ-{}'.format(i).encode('utf8'), {
+                'kind': 'op',
+                'name': 'slow',
+                'param': {'args': {'index': i}},
+            })
+        responses = {}
+        for i in range(5):
+            frames = self.recv()
+            responses[frames[5]] = json.loads(frames[7].decode('utf8'))
+        self.assertLess(time.time() - started_at, 2)
+        for i in range(5):
+            request_id = 'REQ-{}'.format(i)
+            self.assertEqual(responses[request_id.encode('utf8')],
+                             {'result': request_id})
+
+    def test_nested_send_action(self):
+        async def fetch():
+            return await self.transport.send_action_async(
+                'record:fetch', {'ids': ['note/1']})
+
+        self.registry.register_op('fetch', fetch)
+        address = self.start()
+        self.send_request(address, b'REQ-ID', {
+            'kind': 'op',
+            'name': 'fetch',
+            'param': {'args': {}},
+        })
+
+        frames = self.recv()
+        self.assertEqual(frames[3], PPP_REQUEST)
+        self.assertEqual(frames[4], b'1')
+        self.assertEqual(frames[5], b'REQ-ID')
+        self.assertEqual(json.loads(frames[7].decode('utf8')), {
+            'method': 'POST',
+            'payload': {'ids': ['note/1']},
+        })
+        frames[3] = PPP_RESPONSE
+        frames[7] = b'{"result": [{"_id": "note/1"}]}'
+        self.router.send_multipart(frames)
+
+        frames = self.recv()
+        self.assertEqual(frames[3], PPP_RESPONSE)
+        self.assertEqual(frames[4], b'0')
+        self.assertEqual(json.loads(frames[7].decode('utf8')),
+                         {'result': {'result': [{'_id': 'note/1'}]}})
+
+    def test_sync_send_action_from_executor(self):
+        def fetch():
+            return self.transport.send_action('record:fetch', {})
+
+        self.registry.register_op('fetch', fetch)
+        address = self.start()
+        self.send_request(address, b'REQ-ID', {
+            'kind': 'op',
+            'name': 'fetch',
+            'param': {'args': {}},
+        })
+
+        frames = self.recv()
+        self.assertEqual(frames[3], PPP_REQUEST)
+        self.assertEqual(frames[4], b'1')
+        frames[3] = PPP_RESPONSE
+        frames[7] = b'{"result": "ok"}'
+        self.router.send_multipart(frames)
+
+        frames = self.recv()
+        self.assertEqual(json.loads(frames[7].decode('utf8')),
+                         {'result': {'result': 'ok'}})
+
+    def test_async_hook_send_action_is_not_nested(self):
+        def after(record, original_record, db):
+            return self.transport.send_action('record:fetch', {})
+
+        self.registry.register_hook('after', after, type='note',
+                                    trigger='afterSave', async_=True)
+        address = self.start()
+        self.send_request(address, b'REQ-ID', {
+            'kind': 'hook',
+            'name': 'after',
+            'param': {'record': None, 'original': None},
+        })
+
+        # The hook runs in the background, its request is sent as a request
+        # of its own, before or after the response.
+        messages = {}
+        for i in range(2):
+            frames = self.recv()
+            messages[frames[3]] = frames
+        self.assertEqual(messages[PPP_RESPONSE][5], b'REQ-ID')
+        frames = messages[PPP_REQUEST]
+        self.assertEqual(frames[4], b'0')
+        self.assertNotEqual(frames[5], b'REQ-ID')
+        frames[3] = PPP_RESPONSE
+        frames[7] = b'{"result": "ok"}'
+        self.router.send_multipart(frames)
@@ -0,0 +1,67 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest
+from unittest.mock import patch
+
+from ...utils.context import current_context
+from ..background import HookExecutor
+
+
+@patch('skygear.utils.db.conn')
+class TestHookExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = HookExecutor(max_workers=1, max_queue=1)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_submit(self, conn):
+        calls = []
+
+        def hook(record, original_record, db):
+            calls.append((record, original_record, current_context(),
+                          threading.current_thread()))
+
+        completed = self.executor.completed.value
+        self.executor.submit({'state': 'happy'}, hook, 'new', 'old').result()
+        record, original, ctx, thread = calls[0]
+        assert (record, original) == ('new', 'old')
+        assert ctx == {'state': 'happy'}
+        assert thread is not threading.current_thread()
+        assert self.executor.completed.value - completed == 1
+        conn.assert_not_called()
+
+    def test_failed(self, conn):
+        def hook(record, original_record, db):
+            raise ValueError()
+
+        failed = self.executor.failed.value
+        self.executor.submit({}, hook, None, None).result()
+        assert self.executor.failed.value - failed == 1
+
+    def test_backpressure(self, conn):
+        release = threading.Event()
+
+        def hook(record, original_record, db):
+            release.wait()
+
+        self.executor.submit({}, hook, None, None)
+        self.executor.submit({}, hook, None, None)
+        blocked = threading.Thread(
+            target=self.executor.submit, args=({}, hook, None, None))
+        blocked.start()
+        blocked.join(0.1)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join(1)
+        assert not blocked.is_alive()
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import base64
+import json
 import os
 import unittest
 from unittest.mock import MagicMock, patch
@@ -22,7 +23,7 @@ from ...error import SkygearException
 from ...models import Record, RecordID
 from ...registry import Registry
 from ...utils.context import current_context
-from ..common import CommonTransport
+from ..common import CommonTransport, _StreamedBody
 
 
 class TestCommonTransport(unittest.TestCase):
@@ -147,7 +148,103 @@ class TestCommonTransport(unittest.TestCase):
         })
         assert response['header']['Content-Type'] == ['application/json']
         assert response['status'] == 200
-        assert base64.b64decode(response['body']) == b'{"hello": "world"}'
+        assert json.loads(base64.b64decode(response['body']).decode()) == \
+            {'hello': 'world'}
+
+    def testHandlerRequest(self):
+        from werkzeug.test import EnvironBuilder
+        from werkzeug.wrappers import Request
+
+        body = b'{"hello": "world"}'
+        param = {
+            'path': '/a%20b/c',
+            'method': 'post',
+            'query_string': 'x=1&y=2',
+            'header': {'Content-Type': ['application/json'],
+                       'X-Skygear-Api-Key': ['secret'],
+                       'Accept': ['text/html', 'application/json']},
+            'body': base64.b64encode(body).decode('ascii'),
+        }
+        request = self.transport._handler_request(param)
+        expected = Request(EnvironBuilder(
+            method='POST', path='/a%20b/c', query_string='x=1&y=2',
+            headers=param['header'], data=body).get_environ())
+
+        for attr in ('method', 'path', 'args', 'content_type',
+                     'content_length', 'url'):
+            assert getattr(request, attr) == getattr(expected, attr), attr
+        assert request.headers['X-Skygear-Api-Key'] == 'secret'
+        assert request.headers['Accept'] == 'text/html, application/json'
+        assert json.loads(request.get_data().decode()) == {'hello': 'world'}
+
+    def testHandlerBodyDecodedLazily(self):
+        def handler(request):
+            return request.path
+
+        with patch('skygear.transmitter.common.base64.b64decode') as decode:
+            response = self.transport.handler(handler, {
+                'path': '/path?x=1',
+                'method': 'GET',
+                'header': {},
+                'body': 'aGVsbG8=',
+            })
+        decode.assert_not_called()
+        assert base64.b64decode(response['body']) == b'/path'
+
+    def testHandlerStreamedResponse(self):
+        from werkzeug.wrappers import Response
+
+        def handler(request):
+            return Response((bytes([i]) * 1000 for i in range(4)),
+                            content_type='application/octet-stream')
+
+        param = {'path': '/', 'method': 'GET', 'header': {}}
+        with patch.object(self.transport, '_can_stream', return_value=True):
+            response = self.transport.handler(handler, param)
+        assert isinstance(response['body'], _StreamedBody)
+        encoded = b''.join(response['body'].base64_chunks())
+        assert base64.b64decode(encoded) == \
+            b''.join(bytes([i]) * 1000 for i in range(4))
+
+        response = self.transport.handler(handler, param)
+        assert base64.b64decode(response['body']) == \
+            b''.join(bytes([i]) * 1000 for i in range(4))
+
+    def testHandlerWithGeneratorReturn(self):
+        closed = []
+
+        def handler(request):
+            try:
+                yield b'hello '
+                yield 'world'
+            finally:
+                closed.append(True)
+
+        response = self.transport.handler(handler, {
+            'path': '/', 'method': 'GET', 'header': {}})
+        assert response['header']['Content-Type'] == \
+            ['application/octet-stream']
+        assert base64.b64decode(response['body']) == b'hello world'
+        assert closed == [True]
+
+    def testHandlerStreamedInContext(self):
+        request_ids = []
+
+        def handler(request):
+            try:
+                for i in range(2):
+                    request_ids.append(current_context().get('request_id'))
+                    yield b'chunk'
+            finally:
+                request_ids.append(current_context().get('request_id'))
+
+        param = {'path': '/', 'method': 'GET', 'header': {}}
+        with patch.object(self.transport, '_can_stream', return_value=True):
+            with common.start_context({'request_id': 'REQUEST_ID'}):
+                response = self.transport.handler(handler, param)
+            assert b''.join(response['body']) == b'chunkchunk'
+        assert request_ids == ['REQUEST_ID'] * 3
+        assert current_context() == {}
 
     def testHandlerWithResponseReturn(self):
         from werkzeug.utils import redirect
@@ -180,6 +277,25 @@ class TestCommonTransport(unittest.TestCase):
         assert args[1].data == old_record.data
         assert deserialize_or_none(returned_record).data == updated_record.data
 
+    @patch('skygear.transmitter.common.get_hook_executor')
+    def testAsyncHook(self, get_hook_executor):
+        mock = MagicMock()
+        self.registry.register_hook('after', mock, type='note',
+                                    trigger='afterSave', async_=True)
+        record = Record(RecordID('note', 'note1'), 'owner', None,
+                        data={'data': 'new'})
+        param = {'record': serialize_record(record), 'original': None}
+        result = self.transport.call_func(self.ctx, 'hook', 'after', param)
+        assert result == {'result': param['record']}
+        mock.assert_not_called()
+
+        executor = get_hook_executor.return_value
+        ctx, func, submitted, original = executor.submit.call_args[0]
+        assert ctx == self.ctx
+        assert func is mock
+        assert submitted.data == record.data
+        assert original is None
+
     def testTimer(self):
         mock = MagicMock()
         self.transport.timer(mock)
@@ -209,6 +325,22 @@ class TestBase64Encoding(unittest.TestCase):
         assert common.decode_base64_json('e30=') == {}
 
 
+class TestBufferInput(unittest.TestCase):
+    @patch.object(common, '_READLINE_WINDOW', 4)
+    def testReadline(self):
+        stream = common._BufferInput(bytearray(b'first line\n\nlast'))
+        assert stream.readline(3) == b'fir'
+        assert stream.readline() == b'st line\n'
+        assert list(stream) == [b'\n', b'last']
+        assert stream.readline() == b''
+
+    def testReadlineLongBuffer(self):
+        lines = [b'line %d\n' % i for i in range(10000)]
+        stream = common._BufferInput(b''.join(lines))
+        assert stream.readlines() == lines
+        assert stream.read() == b''
+
+
 class TestHandleException(unittest.TestCase):
     def testHandleException(self):
         exc = Exception()
@@ -0,0 +1,128 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import gzip
+import json
+import unittest
+import zlib
+from unittest.mock import patch
+
+from ...registry import Registry
+from ..common import CommonTransport
+from ..compression import Compressor, decompress, decompress_frame
+
+
+class TestCompressor(unittest.TestCase):
+    def setUp(self):
+        self.compressor = Compressor(min_size=100)
+
+    def test_negotiate(self):
+        negotiate = self.compressor.negotiate
+        assert negotiate('gzip, deflate') == 'gzip'
+        assert negotiate('deflate') == 'deflate'
+        assert negotiate('gzip;q=0, deflate;q=0.5') == 'deflate'
+        assert negotiate('*') == self.compressor.encodings[0]
+        assert negotiate('identity') is None
+        assert negotiate(None) is None
+        assert negotiate('gzip', size=99) is None
+        assert negotiate('gzip', size=100) == 'gzip'
+
+    def test_compress(self):
+        data = b'hello world ' * 100
+        saved = self.compressor.bytes_saved.value
+        for encoding in ('gzip', 'deflate'):
+            compressed = self.compressor.compress(data, encoding)
+            assert decompress(compressed, encoding) == data
+        assert self.compressor.bytes_saved.value > saved
+
+    def test_compress_chunks(self):
+        chunks = [b'hello world ' * 100 for _ in range(5)]
+        compressed = b''.join(self.compressor.compress_chunks(chunks))
+        assert gzip.decompress(compressed) == b''.join(chunks)
+
+    def test_compress_response(self):
+        body = json.dumps({'text': 'hello ' * 100}).encode('utf8')
+        headers = {'Content-Type': ['application/json'],
+                   'Content-Length': [str(len(body))]}
+        compressed = self.compressor.compress_response(headers, body,
+                                                       'gzip')
+        assert gzip.decompress(compressed) == body
+        assert headers['Content-Encoding'] == ['gzip']
+        assert headers['Content-Length'] == [str(len(compressed))]
+        assert headers['Vary'] == ['Accept-Encoding']
+
+    def test_compress_response_skipped(self):
+        body = b'\x00' * 1000
+        for headers in ({'Content-Type': ['image/png']},
+                        {'Content-Type': ['text/plain'],
+                         'Content-Encoding': ['gzip']},
+                        {}):
+            assert self.compressor.compress_response(
+                dict(headers), body, 'gzip') is body
+        assert self.compressor.compress_response(
+            {'Content-Type': ['text/plain']}, b'short', 'gzip') == b'short'
+
+    def test_compress_frame(self):
+        frame = json.dumps({'result': 'x' * 1000}).encode('utf8')
+        compressed = self.compressor.compress_frame(frame)
+        assert len(compressed) < len(frame)
+        assert decompress_frame(compressed) == frame
+        assert self.compressor.compress_frame(b'{}') == b'{}'
+        assert decompress_frame(b'{}') == b'{}'
+
+
+class TestHandlerCompression(unittest.TestCase):
+    def setUp(self):
+        self.transport = CommonTransport(Registry())
+        patcher = patch('skygear.transmitter.common.get_compressor',
+                        return_value=Compressor(min_size=100))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def param(self, accept_encoding):
+        header = {}
+        if accept_encoding:
+            header['Accept-Encoding'] = [accept_encoding]
+        return {'path': '/', 'method': 'GET', 'header': header}
+
+    def test_compressed(self):
+        result = {'items': ['item %d' % i for i in range(100)]}
+        response = self.transport.handler(lambda request: result,
+                                          self.param('gzip, deflate'))
+        assert response['header']['Content-Encoding'] == ['gzip']
+        body = gzip.decompress(base64.b64decode(response['body']))
+        assert json.loads(body.decode('utf8')) == result
+
+    def test_not_accepted(self):
+        result = {'items': ['item %d' % i for i in range(100)]}
+        response = self.transport.handler(lambda request: result,
+                                          self.param(None))
+        assert 'Content-Encoding' not in response['header']
+        assert json.loads(base64.b64decode(response['body']).decode()) == \
+            result
+
+    def test_streamed(self):
+        from werkzeug.wrappers import Response
+
+        def handler(request):
+            return Response((b'line %d\n' % i for i in range(1000)),
+                            content_type='text/plain')
+
+        with patch.object(self.transport, '_can_stream', return_value=True):
+            response = self.transport.handler(handler,
+                                              self.param('deflate'))
+        assert response['header']['Content-Encoding'] == ['deflate']
+        body = b''.join(response['body'])
+        assert zlib.decompress(body) == \
+            b''.join(b'line %d\n' % i for i in range(1000))
@@ -12,13 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from datetime import datetime
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import pytest
 
 from skygear.models import (Asset, Location, PublicAccessControlEntry, Record,
                             RecordID, Reference, RoleAccessControlEntry,
                             UnknownValue)
 
-from ...encoding import (deserialize_record, deserialize_value,
+from ...encoding import (LazyRecord, deserialize_lazy_record,
+                         deserialize_record, deserialize_value,
                          serialize_record, serialize_value)
 
 
@@ -92,6 +97,78 @@ class TestsDeserializeRecord():
         assert result['_created_at'] == "2014-09-27T17:40:00Z"
 
 
+class TestsDeserializeLazyRecord():
+    rdata = {
+        "_access": None,
+        "_id": "note/99D92DBA-74D5-477F-B35E-F735E21B2DD5",
+        "_ownerID": "OWNER_ID",
+        "_created_at": "2016-12-08T08:38:33Z",
+        "content": "Hello World!",
+        "due_at": {"$type": "date", "$date": "2016-12-08T16:38:33+08:00"},
+        "location": {"$type": "geo", "$lng": 1, "$lat": 2},
+    }
+
+    def test_metadata(self):
+        r = deserialize_lazy_record(self.rdata)
+        assert isinstance(r, LazyRecord)
+        assert r.id == RecordID("note", "99D92DBA-74D5-477F-B35E-F735E21B2DD5")
+        assert r.owner_id == "OWNER_ID"
+        assert r.created_at == datetime(2016, 12, 8, 8, 38, 33,
+                                        tzinfo=timezone.utc)
+
+    def test_fields(self):
+        r = deserialize_lazy_record(self.rdata)
+        assert len(r) == 3
+        assert list(r) == ["content", "due_at", "location"]
+        assert "location" in r
+        assert "_ownerID" not in r
+        assert r["location"] == Location(1, 2)
+        assert r.get("missing") is None
+        assert r.data == deserialize_record(self.rdata).data
+
+    def test_decode_on_access(self):
+        r = deserialize_lazy_record(self.rdata)
+        assert r._data._values == {}
+        r.get("location")
+        assert list(r._data._values) == ["location"]
+        assert r.is_lazy
+
+    def test_data_is_dict(self):
+        r = deserialize_lazy_record(self.rdata)
+        r["content"] = "Bye"
+        assert isinstance(r.data, dict)
+        assert not r.is_lazy
+        assert r.data["location"] == Location(1, 2)
+        assert json.loads(json.dumps(r.data, default=repr))["content"] == \
+            "Bye"
+        assert serialize_value(r.data) == \
+            serialize_value(dict(deserialize_record(self.rdata).data,
+                                 content="Bye"))
+        assert serialize_record(r)["content"] == "Bye"
+
+    def test_serialize_untouched_fields(self):
+        r = deserialize_lazy_record(self.rdata)
+        r["location"]
+        r["content"] = "Bye"
+        del r["due_at"]
+        r["done"] = True
+        data = serialize_record(r)
+        assert "due_at" not in data
+        assert data["content"] == "Bye"
+        assert data["done"] is True
+        assert data["location"] == {"$type": "geo", "$lng": 1, "$lat": 2}
+
+        r["due_at"] = datetime(2016, 12, 8, 8, 38, 33, tzinfo=timezone.utc)
+        assert serialize_record(r)["due_at"] == \
+            {"$type": "date", "$date": "2016-12-08T08:38:33Z"}
+
+    def test_serialize_passes_wire_value(self):
+        r = deserialize_lazy_record(self.rdata)
+        data = serialize_record(r)
+        assert data["due_at"] is self.rdata["due_at"]
+        assert data["_id"] == self.rdata["_id"]
+
+
 class TestsSerializeRecord():
     def test_normal(self):
         r = Record(
@@ -126,7 +203,23 @@ class TestsDeserializeValue():
 
     def test_date(self):
         value = {"$type": "date", "$date": "2016-12-08T08:38:33Z"}
-        assert deserialize_value(value) == datetime.fromtimestamp(1481186313)
+        assert deserialize_value(value) == \
+            datetime.fromtimestamp(1481186313, timezone.utc)
+
+    def test_date_with_fraction(self):
+        value = {"$type": "date", "$date": "2016-12-08T08:38:33.123456789Z"}
+        assert deserialize_value(value) == \
+            datetime(2016, 12, 8, 8, 38, 33, 123456, timezone.utc)
+
+    def test_date_with_offset(self):
+        value = {"$type": "date", "$date": "2016-12-08T16:38:33.5+08:00"}
+        assert deserialize_value(value) == \
+            datetime(2016, 12, 8, 8, 38, 33, 500000, timezone.utc)
+
+    def test_invalid_date(self):
+        value = {"$type": "date", "$date": "2016-12-08 08:38:33"}
+        with pytest.raises(ValueError):
+            deserialize_value(value)
 
     def test_asset(self):
         value = {
@@ -183,6 +276,18 @@ class TestsDeserializeValue():
             "location": Location(1, 2)
         }
 
+    def test_dict_with_unhashable_type(self):
+        value = {"$type": ["geo"], "location": {"$type": "geo",
+                                                "$lng": 1, "$lat": 2}}
+        assert deserialize_value(value) == {
+            "$type": ["geo"],
+            "location": Location(1, 2)
+        }
+
+    def test_dict_subclass(self):
+        value = OrderedDict([("$type", "geo"), ("$lng", 1), ("$lat", 2)])
+        assert deserialize_value(value) == Location(1, 2)
+
 
 class TestsSerializeValue():
     def test_integer(self):
@@ -199,6 +304,25 @@ class TestsSerializeValue():
         assert serialize_value(value) == \
             {"$type": "date", "$date": "2016-12-08T08:38:33Z"}
 
+    def test_naive_date_in_local_time(self):
+        class NaiveDatetime(datetime):
+            # As in Python 3.5, which rejects naive datetimes
+            def astimezone(self, tz=None):
+                if self.tzinfo is None:
+                    raise ValueError('astimezone() cannot be applied to '
+                                     'a naive datetime')
+                return super().astimezone(tz)
+
+        value = NaiveDatetime.fromtimestamp(1481186313.25)
+        assert serialize_value(value) == \
+            {"$type": "date", "$date": "2016-12-08T08:38:33.25Z"}
+
+    def test_date_with_timezone(self):
+        value = datetime(2016, 12, 8, 16, 38, 33, 120000,
+                         timezone(timedelta(hours=8)))
+        assert serialize_value(value) == \
+            {"$type": "date", "$date": "2016-12-08T08:38:33.12Z"}
+
     def test_asset(self):
         value = Asset("c1d0e8d4-648c-4c88-86c6-22feb1a6e734", "text/html")
         assert serialize_value(value) == \
@@ -261,3 +385,19 @@ class TestsSerializeValue():
                 "distance": 42,
                 "location": {"$type": "geo", "$lng": 1, "$lat": 2}
             }
+
+    def test_subclasses(self):
+        class Point(Location):
+            pass
+
+        class Tags(list):
+            pass
+
+        value = Tags([Point(1, 2), datetime.fromtimestamp(1481186313)])
+        assert serialize_value(value) == [
+            {"$type": "geo", "$lng": 1, "$lat": 2},
+            {"$type": "date", "$date": "2016-12-08T08:38:33Z"},
+        ]
+
+    def test_tuple(self):
+        assert serialize_value((1, 2)) == (1, 2)
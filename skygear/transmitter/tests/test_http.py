@@ -11,7 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import base64
+import gzip
+import http.client
 import json
+import threading
 import unittest
 from unittest.mock import ANY, patch
 
@@ -20,7 +24,8 @@ from werkzeug.wrappers import BaseResponse
 
 from ...registry import Registry
 from ..common import encode_base64_json
-from ..http import HttpTransport
+from ..compression import Compressor
+from ..http import HttpTransport, listen_socket
 
 
 def headers_with_context(data):
@@ -48,6 +53,17 @@ class TestHttpTransport(unittest.TestCase):
                                        threaded=True,
                                        use_reloader=False)
 
+    @patch('skygear.transmitter.http.PooledWSGIServer')
+    def testRunPooled(self, mocker):
+        transport = HttpTransport('127.0.0.1:8888', Registry(), threads=4,
+                                  queue_size=8, backlog=16, timeout=5,
+                                  idle_timeout=1)
+        transport.run()
+        mocker.assert_called_once_with('127.0.0.1', 8888, transport.dispatch,
+                                       threads=4, queue_size=8, backlog=16,
+                                       timeout=5, idle_timeout=1, fd=None)
+        mocker.return_value.serve_forever.assert_called_once_with()
+
     @patch('skygear.transmitter.http.HttpTransport.call_func')
     def testCallFuncWithData(self, mocker):
         mocker.return_value = {'data': 'hello'}
@@ -134,3 +150,91 @@ class TestHttpTransport(unittest.TestCase):
         resp = self.get_client().post('/', data=json.dumps(data))
         assert resp.status_code == 200
         mocker.assert_called_once_with(ANY, 'apple/pie', ANY)
+
+    @patch('skygear.transmitter.http.get_compressor')
+    def testCompressedOp(self, get_compressor):
+        get_compressor.return_value = Compressor(min_size=100)
+        self.transport._registry.register_op('echo', lambda value: value)
+        data = gzip.compress(json.dumps({
+            'kind': 'op',
+            'name': 'echo',
+            'param': {'args': ['x' * 1000]},
+        }).encode('utf8'))
+        resp = self.get_client().post('/', data=data, headers={
+            'Content-Encoding': 'gzip',
+            'Accept-Encoding': 'gzip',
+        })
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(resp.data).decode('utf8')) == \
+            {'result': 'x' * 1000}
+
+
+class TestPooledWSGIServer(unittest.TestCase):
+    def setUp(self):
+        registry = Registry()
+        registry.register_op('echo', lambda value: value)
+        registry.register_handler('download', self.download,
+                                  method=['GET'])
+        self.sock = listen_socket('127.0.0.1', 0)
+        self.addCleanup(self.sock.close)
+        self.transport = HttpTransport('127.0.0.1:0', registry, threads=2,
+                                       idle_timeout=0.5,
+                                       fd=self.sock.fileno())
+        thread = threading.Thread(target=self.transport.run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.transport.stop)
+        while self.transport.server is None:
+            thread.join(0.01)
+
+    def download(self, request):
+        for i in range(64):
+            yield bytes([i]) * 1000
+
+    def post(self, conn, value):
+        body = json.dumps({'kind': 'op', 'name': 'echo',
+                           'param': {'args': [value]}})
+        conn.request('POST', '/', body,
+                     {'Content-Type': 'application/json'})
+        return json.loads(conn.getresponse().read().decode('utf-8'))
+
+    def testKeepAlive(self):
+        conn = http.client.HTTPConnection(*self.sock.getsockname())
+        self.addCleanup(conn.close)
+        assert self.post(conn, 'a') == {'result': 'a'}
+        sock = conn.sock
+        assert self.post(conn, 'b') == {'result': 'b'}
+        assert conn.sock is sock
+
+    def testStreamedHandler(self):
+        conn = http.client.HTTPConnection(*self.sock.getsockname())
+        self.addCleanup(conn.close)
+        body = json.dumps({'kind': 'handler', 'name': 'download',
+                           'param': {'method': 'GET', 'path': '/download',
+                                     'header': {}}})
+        conn.request('POST', '/', body,
+                     {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        assert resp.getheader('Transfer-Encoding') == 'chunked'
+        result = json.loads(resp.read().decode('utf-8'))['result']
+        assert result['status'] == 200
+        assert base64.b64decode(result['body']) == \
+            b''.join(bytes([i]) * 1000 for i in range(64))
+
+        sock = conn.sock
+        assert self.post(conn, 'a') == {'result': 'a'}
+        assert conn.sock is sock
+
+    def testIdleConnectionReleasesThread(self):
+        idle = [http.client.HTTPConnection(*self.sock.getsockname())
+                for i in range(2)]
+        for conn in idle:
+            self.addCleanup(conn.close)
+            conn.connect()
+        # Both threads are held by the idle connections until they time out
+        conn = http.client.HTTPConnection(*self.sock.getsockname(),
+                                          timeout=5)
+        self.addCleanup(conn.close)
+        assert self.post(conn, 'a') == {'result': 'a'}
+        for conn in idle:
+            assert conn.sock.recv(1) == b''
@@ -11,16 +11,29 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import gzip
 import json
 import threading
 import time
 import unittest
+import unittest.mock
+from concurrent.futures import TimeoutError
 
 import zmq
+from werkzeug.wrappers import Response
 
-from ...transmitter.zmq import (HEARTBEAT_INTERVAL, HEARTBEAT_LIVENESS,
-                                PPP_HEARTBEAT, PPP_REQUEST, PPP_RESPONSE,
-                                ZmqTransport)
+from ...registry import Registry
+from ...transmitter.common import handle_init_event
+from ...transmitter.compression import Compressor
+from ...transmitter.zmq import (BODY_FRAME_CAPABILITY,
+                                CHUNKED_RESPONSE_CAPABILITY,
+                                GZIP_FRAME_CAPABILITY,
+                                HEARTBEAT_INTERVAL, HEARTBEAT_LIVENESS,
+                                PPP_HEARTBEAT, PPP_READY,
+                                PPP_REQUEST, PPP_RESPONSE, PPP_SHUTDOWN,
+                                OutboundChannel, Worker, ZmqTransport)
+from ...utils import metrics
 
 
 class TestZmq(unittest.TestCase):
@@ -111,6 +124,107 @@ class TestZmq(unittest.TestCase):
         transport_t.join()
         context.destroy()
 
+    def test_scale_up_on_backlog(self):
+        context = zmq.Context()
+        transport = ZmqTransport('tcp://0.0.0.0:23459',
+                                 context=context,
+                                 threading=2,
+                                 limit=3)
+        transport.start()
+        transport.adjust_workers_count()
+        self.assertEqual(len(transport.threads), 2)
+        transport.backlog_counter.inc()
+        transport.adjust_workers_count()
+        self.assertEqual(len(transport.threads), 3)
+        transport.backlog_counter.inc()
+        transport.adjust_workers_count()
+        self.assertEqual(len(transport.threads), 3)
+        self.assertEqual(transport.scale_up_counter.value, 1)
+        self.assertEqual(transport.size_gauge.value, 3)
+        transport.stop()
+        context.destroy()
+
+    def test_backlog_counts_queued_requests(self):
+        counter = metrics.Counter('test.backlog')
+        worker = Worker(None, 'tcp://0.0.0.0:23461', threading.Event(),
+                        backlog_counter=counter)
+        worker.socket = unittest.mock.Mock()
+        request = [b'client', b'', PPP_REQUEST, b'0', b'id', b'', b'{}']
+
+        # A heartbeat waiting alone when the worker became free
+        worker.queued = True
+        worker.socket.getsockopt.return_value = 0
+        worker.count_backlog([PPP_HEARTBEAT])
+        worker.count_backlog(request)
+        self.assertEqual(counter.value, 0)
+
+        # A request queued up behind a heartbeat
+        worker.queued = True
+        worker.socket.getsockopt.return_value = zmq.POLLIN
+        worker.count_backlog([PPP_HEARTBEAT])
+        worker.count_backlog(request)
+        self.assertEqual(counter.value, 1)
+        self.assertEqual(worker.queued, False)
+
+    @unittest.mock.patch('skygear.transmitter.zmq.POOL_SCALE_DOWN_DELAY', 30)
+    def test_scale_down_after_sustained_low_utilization(self):
+        context = zmq.Context()
+        transport = ZmqTransport('tcp://0.0.0.0:23462',
+                                 context=context,
+                                 threading=1)
+        transport.start()
+        transport.scale_up()
+        with unittest.mock.patch('time.time') as now:
+            now.return_value = 1000
+            transport.adjust_workers_count()
+            now.return_value = 1020
+            transport.adjust_workers_count()
+            self.assertEqual(len(transport.threads), 2)
+
+            # Utilization going up restarts the window
+            transport.utilization = 0.9
+            transport.adjust_workers_count()
+            now.return_value = 1040
+            transport.utilization = 0.0
+            transport.adjust_workers_count()
+            self.assertEqual(len(transport.threads), 2)
+            now.return_value = 1070
+            transport.adjust_workers_count()
+            self.assertEqual(len(transport.threads), 1)
+        transport.stop()
+        context.destroy()
+
+    @unittest.mock.patch('skygear.transmitter.zmq.POOL_SCALE_DOWN_DELAY', 0)
+    def test_scale_down_idle_workers(self):
+        context = zmq.Context()
+        router = context.socket(zmq.ROUTER)
+        router.bind('tcp://0.0.0.0:23460')
+        transport = ZmqTransport('tcp://0.0.0.0:23460',
+                                 context=context,
+                                 threading=1)
+        transport.start()
+        transport.scale_up()
+        transport.scale_up()
+        self.assertEqual(len(transport.threads), 3)
+        for i in range(10):
+            transport.adjust_workers_count()
+        self.assertEqual(len(transport.threads), 1)
+        self.assertEqual(transport.scale_down_counter.value, 2)
+
+        shutdown = set()
+        while len(shutdown) < 2:
+            self.assertTrue(router.poll(HEARTBEAT_INTERVAL * 3000))
+            frames = router.recv_multipart()
+            if frames[1] == PPP_SHUTDOWN:
+                shutdown.add(frames[0])
+        for t in transport.retired_threads:
+            t.join()
+            self.assertEqual(t.is_alive(), False)
+        self.assertEqual(transport.threads[0].is_alive(), True)
+        transport.stop()
+        router.close()
+        context.destroy()
+
     def test_one_off_worker(self):
         context = zmq.Context()
         expected_body = {'method': 'POST', 'payload': {'key': 'value'}}
@@ -133,6 +247,376 @@ class TestZmq(unittest.TestCase):
         t.join()
         context.destroy()
 
+    def test_outbound_channel_shared_by_threads(self):
+        context = zmq.Context()
+        t = threading.Thread(target=reversing_router,
+                             args=(context, 'tcp://0.0.0.0:23457', 5))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23457',
+                                 context=context,
+                                 threading=0,
+                                 outbound_pool=1)
+        transport.start()
+        results = {}
+
+        def send(i):
+            results[i] = transport.send_action('action_name', {'index': i})
+
+        callers = [threading.Thread(target=send, args=(i,))
+                   for i in range(5)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        self.assertEqual(results, {i: {'result': i} for i in range(5)})
+        self.assertEqual(len(transport.outbound.channels), 1)
+        self.assertEqual(transport.outbound.channels[0].pending, {})
+        t.join()
+        transport.stop()
+        context.destroy()
+
+    def test_outbound_channel_not_ready(self):
+        context = zmq.Context()
+        messages = []
+        t = threading.Thread(target=broker_router,
+                             args=(context, 'tcp://0.0.0.0:23465', messages))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23465',
+                                 context=context,
+                                 threading=0,
+                                 outbound_pool=1)
+        transport.start()
+        with unittest.mock.patch.object(OutboundChannel,
+                                        'dispatch_call') as dispatch_call:
+            result = transport.send_action('action_name', {'index': 1})
+            t.join()
+        transport.stop()
+        context.destroy()
+
+        self.assertEqual(result, {'result': 1})
+        self.assertNotIn([PPP_READY], [m[1:] for m in messages])
+        dispatch_call.assert_not_called()
+
+    def test_outbound_channel_nested_response_first(self):
+        context = zmq.Context()
+        messages = []
+        t = threading.Thread(target=bouncing_router,
+                             args=(context, 'tcp://0.0.0.0:23466', messages))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23466',
+                                 context=context,
+                                 threading=0,
+                                 outbound_pool=1)
+        transport.start()
+        results = {}
+
+        def hook(kind, name, ctx, param):
+            # Queued by another caller while the hook is running, it is
+            # sent while the hook waits for the nested response.
+            channel = threading.current_thread()
+            results['other'] = channel.submit({'index': 'other'})[1]
+            results['nested'] = transport.send_action('nested',
+                                                      {'index': 'nested'})
+            return {'result': 'hook'}
+
+        with unittest.mock.patch.object(OutboundChannel, 'dispatch_call',
+                                        side_effect=hook):
+            result = transport.send_action('action_name', {'index': 'outer'})
+            t.join()
+        transport.stop()
+        context.destroy()
+
+        self.assertEqual(result, {'result': 'outer'})
+        self.assertEqual(results['nested'], {'result': 'nested'})
+        self.assertEqual(json.loads(results['other'].result(1).decode()),
+                         {'result': 'other'})
+        self.assertEqual([m[4] for m in messages],
+                         [b'0', b'2', b'0', b'1'])
+
+    def test_send_action_timeout(self):
+        context = zmq.Context()
+        router = context.socket(zmq.ROUTER)
+        router.bind('tcp://0.0.0.0:23458')
+        transport = ZmqTransport('tcp://0.0.0.0:23458',
+                                 context=context,
+                                 threading=0)
+        transport.start()
+        started_at = time.time()
+        with self.assertRaises(TimeoutError):
+            transport.send_action('action_name', {}, timeout=0.5)
+        self.assertLess(time.time() - started_at, HEARTBEAT_INTERVAL)
+        transport.stop()
+        router.close()
+        context.destroy()
+
+    def test_send_action_async(self):
+        context = zmq.Context()
+        t = threading.Thread(target=reversing_router,
+                             args=(context, 'tcp://0.0.0.0:23461', 5))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23461',
+                                 context=context,
+                                 threading=0)
+        transport.start()
+
+        async def send_all():
+            # The router only responds when all requests are in flight.
+            return await asyncio.gather(*[
+                transport.send_action_async('action_name', {'index': i},
+                                            timeout=HEARTBEAT_INTERVAL * 5)
+                for i in range(5)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(send_all())
+        finally:
+            loop.close()
+        self.assertEqual(results, [{'result': i} for i in range(5)])
+        for channel in transport.outbound.channels:
+            self.assertTrue(channel is None or channel.pending == {})
+        t.join()
+        transport.stop()
+        context.destroy()
+
+    def test_send_action_async_timeout(self):
+        context = zmq.Context()
+        router = context.socket(zmq.ROUTER)
+        router.bind('tcp://0.0.0.0:23462')
+        transport = ZmqTransport('tcp://0.0.0.0:23462',
+                                 context=context,
+                                 threading=0)
+        transport.start()
+        loop = asyncio.new_event_loop()
+        try:
+            with self.assertRaises(asyncio.TimeoutError):
+                loop.run_until_complete(
+                    transport.send_action_async('action_name', {},
+                                                timeout=0.5))
+        finally:
+            loop.close()
+        channel = transport.outbound.channels[0]
+        self.assertEqual(channel.pending, {})
+        transport.stop()
+        router.close()
+        context.destroy()
+
+    def test_handler_body_frame(self):
+        registry = Registry()
+        registry.register_handler(
+            'upload', lambda request: Response(request.get_data()[::-1]),
+            method=['POST'])
+        context = zmq.Context()
+        body = bytes(range(256)) * 4096
+        message = {
+            'kind': 'handler',
+            'name': 'upload',
+            'param': {'method': 'POST', 'path': '/upload', 'header': {}},
+        }
+        responses = []
+        t = threading.Thread(target=request_router,
+                             args=(context, 'tcp://0.0.0.0:23461', message,
+                                   [body], responses))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23461',
+                                 context=context,
+                                 registry=registry,
+                                 threading=1)
+        transport.start()
+        t.join()
+        transport.stop()
+        context.destroy()
+
+        frames = responses[0]
+        self.assertEqual(len(frames), 9)
+        result = json.loads(frames[7].decode('utf8'))['result']
+        self.assertEqual(result['status'], 200)
+        self.assertNotIn('body', result)
+        self.assertEqual(frames[8], body[::-1])
+
+    def test_init_advertises_body_frame(self):
+        registry = Registry()
+        registry.register_event('init', handle_init_event)
+        context = zmq.Context()
+        responses = []
+        t = threading.Thread(target=request_router,
+                             args=(context, 'tcp://0.0.0.0:23462',
+                                   {'kind': 'event', 'name': 'init',
+                                    'param': {}},
+                                   [], responses))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23462',
+                                 context=context,
+                                 registry=registry,
+                                 threading=1)
+        transport.start()
+        t.join()
+        transport.stop()
+        context.destroy()
+
+        result = json.loads(responses[0][7].decode('utf8'))['result']
+        self.assertEqual(result['capabilities'],
+                         [BODY_FRAME_CAPABILITY, CHUNKED_RESPONSE_CAPABILITY,
+                          GZIP_FRAME_CAPABILITY])
+
+    @unittest.mock.patch('skygear.transmitter.zmq.get_compressor')
+    def test_gzip_frame(self, get_compressor):
+        get_compressor.return_value = Compressor(min_size=100)
+        registry = Registry()
+        registry.register_op('echo', lambda value: value)
+        context = zmq.Context()
+        message = gzip.compress(json.dumps({
+            'kind': 'op',
+            'name': 'echo',
+            'param': {'args': ['x' * 1000]},
+        }).encode('utf8'))
+        responses = []
+        t = threading.Thread(target=request_router,
+                             args=(context, 'tcp://0.0.0.0:23464', message,
+                                   [], responses))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23464',
+                                 context=context,
+                                 registry=registry,
+                                 threading=1)
+        transport.start()
+        t.join()
+        transport.stop()
+        context.destroy()
+
+        response = json.loads(gzip.decompress(responses[0][7]).decode())
+        self.assertEqual(response, {'result': 'x' * 1000})
+
+    def test_handler_chunked_response(self):
+        def download(request):
+            for i in range(3):
+                yield bytes([i]) * 1024
+
+        registry = Registry()
+        registry.register_handler('download', download, method=['GET'])
+        context = zmq.Context()
+        message = {
+            'kind': 'handler',
+            'name': 'download',
+            'param': {'method': 'GET', 'path': '/download', 'header': {},
+                      'chunked': True},
+        }
+        responses = []
+        t = threading.Thread(target=request_router,
+                             args=(context, 'tcp://0.0.0.0:23463', message,
+                                   [b''], responses, True))
+        t.start()
+        transport = ZmqTransport('tcp://0.0.0.0:23463',
+                                 context=context,
+                                 registry=registry,
+                                 threading=1)
+        transport.start()
+        t.join()
+        transport.stop()
+        context.destroy()
+
+        result = json.loads(responses[0][7].decode('utf8'))['result']
+        self.assertEqual(result['status'], 200)
+        self.assertTrue(result['chunked'])
+        self.assertNotIn('body', result)
+        self.assertEqual([f[7:] for f in responses[1:]], [
+            [b'1', b'\x00' * 1024],
+            [b'2', b'\x01' * 1024],
+            [b'3', b'\x02' * 1024],
+            [b'4', b''],
+        ])
+
+
+def reversing_router(context, addr, count):
+    """
+    This router waits for a number of requests and responds to them in
+    reverse order with the index in the request payload
+    """
+    router = context.socket(zmq.ROUTER)
+    router.bind(addr)
+    requests = []
+    while len(requests) < count:
+        router.poll()
+        frames = router.recv_multipart()
+        if len(frames) == 2:
+            continue
+        requests.append(frames)
+    for frames in reversed(requests):
+        body = json.loads(frames[7].decode('utf8'))
+        frames[3] = PPP_RESPONSE
+        frames[7] = json.dumps({
+            'result': body['payload']['index'],
+        }).encode('utf8')
+        router.send_multipart(frames)
+    router.close()
+
+
+def broker_router(context, addr, messages):
+    """
+    This router sends a request to every socket which is ready, as
+    skygear-server does, and responds to the first request it receives.
+    The messages received are collected in `messages`.
+    """
+    router = context.socket(zmq.ROUTER)
+    router.bind(addr)
+    while True:
+        router.poll()
+        frames = router.recv_multipart()
+        messages.append(frames)
+        if frames[1:] == [PPP_READY]:
+            router.send_multipart([
+                frames[0], frames[0], b'', PPP_REQUEST, b'0', b'SERVER-REQ',
+                b'', json.dumps({'kind': 'op', 'name': 'op'}).encode('utf8'),
+            ])
+        elif len(frames) == 8 and frames[3] == PPP_REQUEST:
+            body = json.loads(frames[7].decode('utf8'))
+            frames[3] = PPP_RESPONSE
+            frames[7] = json.dumps({
+                'result': body['payload']['index'],
+            }).encode('utf8')
+            router.send_multipart(frames)
+            # Give a request routed to the channel time to arrive.
+            time.sleep(HEARTBEAT_INTERVAL)
+            break
+    router.close()
+
+
+def bouncing_router(context, addr, messages):
+    """
+    This router bounces a request back to the socket which sent the first
+    request, responds to the requests made while handling it, and then
+    to the first request. The responses to the nested requests are sent
+    before the response to the first request.
+    """
+    router = context.socket(zmq.ROUTER)
+    router.bind(addr)
+    outer = None
+    while True:
+        router.poll()
+        frames = router.recv_multipart()
+        if len(frames) != 8:
+            continue
+        messages.append(frames)
+        if frames[3] == PPP_RESPONSE:
+            # The bounced request is handled, respond to the first one
+            outer[3] = PPP_RESPONSE
+            outer[7] = json.dumps({'result': 'outer'}).encode('utf8')
+            router.send_multipart(outer)
+            break
+        if outer is None:
+            outer = frames
+            router.send_multipart([
+                frames[0], frames[1], b'', PPP_REQUEST, b'1', frames[5],
+                b'', json.dumps({'kind': 'op', 'name': 'op'}).encode('utf8'),
+            ])
+            continue
+        body = json.loads(frames[7].decode('utf8'))
+        frames[3] = PPP_RESPONSE
+        frames[7] = json.dumps({
+            'result': body['payload']['index'],
+        }).encode('utf8')
+        router.send_multipart(frames)
+    router.close()
+
 
 def dead_router(context, addr, count):
     """
@@ -174,9 +658,12 @@ def response_router(context, addr, expected_body, response):
         break
 
 
-def request_router(context, addr, body):
+def request_router(context, addr, body, extra_frames=(), responses=None,
+                   chunked=False):
     """
-    This router will send predefined request body to the worker
+    This router will send predefined request body to the worker, followed
+    by `extra_frames`, and collect the response in `responses`, followed
+    by the chunks of the response body if `chunked`
     """
     router = context.socket(zmq.ROUTER)
     router.bind(addr)
@@ -193,10 +680,17 @@ def request_router(context, addr, body):
         b'0',
         b'REQ-ID',
         b'',
-        json.dumps(body).encode('utf8')
-    ]
+        body if isinstance(body, bytes) else json.dumps(body).encode('utf8')
+    ] + list(extra_frames)
     router.send_multipart(frames)
 
-    router.poll()
-    router.recv_multipart()
+    while True:
+        router.poll()
+        frames = router.recv_multipart()
+        if len(frames) <= 2:
+            continue
+        if responses is not None:
+            responses.append(frames)
+        if not chunked or len(frames) > 8 and frames[8] == b'':
+            break
     router.close()
@@ -11,16 +11,26 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
+import asyncio
+import itertools
 import logging
+import os
+import queue
 import threading
 import time
+from concurrent.futures import Future
 from random import randint
+from threading import Event
 
 import zmq
 
+from .. import codec
+from ..encoding import _serialize_exc
+from ..utils import metrics
 from ..utils.logging import setLoggerTag
-from .common import CommonTransport
+from .common import CommonTransport, _StreamedBody, _streamed_body
+from .compression import (decompress_frame, get_compressor,
+                          is_compressed_frame)
 
 log = logging.getLogger(__name__)
 setLoggerTag(log, 'plugin')
@@ -28,20 +38,93 @@ setLoggerTag(log, 'plugin')
 
 def _encoded(func):
     def encoded(self, input, *args):
-        decoded = input.decode('utf-8')
-        deserialized = json.loads(decoded)
+        deserialized = codec.loads(input)
 
         try:
             retval = func(self, deserialized, *args)
-            response_string = json.dumps(retval)
+            return codec.dumpb(retval)
         except ValueError as e:
-            response_string = str(e)
             log.error(str(e))
-        out = response_string.encode('utf-8')
-        return out
+            return str(e).encode('utf-8')
     return encoded
 
 
+def _recv_frames(frames):
+    """
+    Returns the frames received with `copy=False`, with the envelope and
+    message as bytes and the body frame, if any, as a memoryview of the
+    received data.
+    """
+    return [f.bytes for f in frames[:7]] + [f.buffer for f in frames[7:]]
+
+
+# A request may carry the raw body of a handler request in an 8th frame,
+# after the 7-part envelope and the JSON message, instead of base64 in the
+# message. The plugin advertises the capability in the result of the init
+# event, and skygear-server opts in per request by sending the 8th frame.
+# The response to such a request carries the raw body of the handler
+# response in an 8th frame. Other requests and responses keep 7 frames.
+BODY_FRAME_CAPABILITY = 'zmq-body-frame'
+
+# The body of a handler response can also be streamed when skygear-server
+# sets `chunked` in the param of a request with a body frame. The response
+# then carries `chunked: true` in its result instead of a body frame, and
+# is followed by messages with the same envelope, each carrying a sequence
+# number from 1 and a chunk of the body. A chunk that is empty ends the
+# body, followed by the JSON of the error if the handler failed midway.
+CHUNKED_RESPONSE_CAPABILITY = 'zmq-chunked-response'
+
+# skygear-server may compress the JSON message of a request with gzip, which
+# also opts in to a compressed message in the response when compression is
+# enabled and the message is large enough.
+GZIP_FRAME_CAPABILITY = 'zmq-gzip-frame'
+
+
+def _compress_response(response):
+    compressor = get_compressor()
+    if compressor is not None:
+        response = [compressor.compress_frame(response[0])] + response[1:]
+    return response
+
+
+def _attach_body(req, body):
+    if body is not None and req.get('kind') == 'handler':
+        req.setdefault('param', {})['raw_body'] = body
+    return req
+
+
+def _advertise_capabilities(req, retval,
+                            capabilities=(BODY_FRAME_CAPABILITY,
+                                          GZIP_FRAME_CAPABILITY)):
+    if req.get('kind') == 'event' and req.get('name') == 'init' and \
+            isinstance(retval, dict) and isinstance(retval.get('result'),
+                                                    dict):
+        retval = dict(retval)
+        retval['result'] = dict(retval['result'],
+                                capabilities=list(capabilities))
+    return retval
+
+
+def _response_frames(retval):
+    """
+    Returns the message frames of a response, moving the raw body of a
+    handler response into its own frame. A streamed body is returned in
+    place of the body frame, to be sent in chunks after the response.
+    """
+    result = retval.get('result') if isinstance(retval, dict) else None
+    body = _streamed_body(retval)
+    if body is not None:
+        result = dict(result, chunked=True)
+        del result['body']
+        return [codec.dumpb(dict(retval, result=result)), body]
+    if isinstance(result, dict) and \
+            isinstance(result.get('body'), (bytes, bytearray, memoryview)):
+        result = dict(result)
+        body = result.pop('body')
+        return [codec.dumpb(dict(retval, result=result)), body]
+    return [codec.dumpb(retval)]
+
+
 HEARTBEAT_LIVENESS = 3
 HEARTBEAT_INTERVAL = 1
 INTERVAL_INIT = 1
@@ -55,6 +138,12 @@ PPP_RESPONSE = b'\x05'
 
 PREFIX = randint(0, 0x10000)
 
+POOL_CONTROL_INTERVAL = HEARTBEAT_INTERVAL
+POOL_SCALE_DOWN_DELAY = 30
+POOL_SCALE_DOWN_UTILIZATION = 0.5
+# Weight of the latest sample in the rolling utilization
+POOL_UTILIZATION_WEIGHT = 0.2
+
 
 LISTEN_MESSAGE_RESULT_TIMEOUT = 0
 LISTEN_MESSAGE_RESULT_INVALID = 1
@@ -62,13 +151,14 @@ LISTEN_MESSAGE_RESULT_HEARTBEAT = 2
 LISTEN_MESSAGE_RESULT_HANDLED_REQUEST = 3
 
 
-def worker_socket(addr, context, poller):
+def worker_socket(addr, context, poller, ready=True):
     socket = context.socket(zmq.DEALER)
     identity = "%04X-%04X" % (PREFIX, randint(0, 0x10000))
     socket.setsockopt_string(zmq.IDENTITY, identity)
     poller.register(socket, zmq.POLLIN)
     socket.connect(addr)
-    socket.send(PPP_READY)
+    if ready:
+        socket.send(PPP_READY)
     return socket
 
 
@@ -79,15 +169,24 @@ class Worker(threading.Thread, CommonTransport):
     refs:
     http://zguide.zeromq.org/py:all#Robust-Reliable-Queuing-Paranoid-Pirate-Pattern
     """
-    def __init__(self, z_context, addr, stopper, registry=None):
+    # Whether the socket sends PPP_READY, so that skygear-server routes
+    # requests to it.
+    ready = True
+
+    def __init__(self, z_context, addr, stopper, registry=None,
+                 busy_gauge=None, backlog_counter=None):
         threading.Thread.__init__(self)
         CommonTransport.__init__(self, registry)
         self.addr = addr
         self.z_context = z_context
         self.stopper = stopper
+        self.retiring = threading.Event()
         self.bounce_count = -1
         self.request_id = None
         self.busy_lock = threading.Lock()
+        self.busy_gauge = busy_gauge
+        self.backlog_counter = backlog_counter
+        self.queued = False
 
     def generate_request_id(self):
         prefix = self.socket_name[5:]
@@ -96,7 +195,8 @@ class Worker(threading.Thread, CommonTransport):
 
     def setup_zmq_sockets(self):
         self.poller = zmq.Poller()
-        self.socket = worker_socket(self.addr, self.z_context, self.poller)
+        self.socket = worker_socket(self.addr, self.z_context, self.poller,
+                                    ready=self.ready)
         self.socket_name = self.socket.getsockopt_string(zmq.IDENTITY)
         self.liveness = HEARTBEAT_LIVENESS
         self.interval = INTERVAL_INIT
@@ -138,21 +238,50 @@ class Worker(threading.Thread, CommonTransport):
                 # We have a response
                 return result
 
-            if self.stopper.is_set():
+            if self.should_stop(send_heartbeat):
                 self.shutdown_socket()
                 return None
 
+    def should_stop(self, send_heartbeat=True):
+        """
+        Returns whether the message loop should close the socket. A retiring
+        worker only stops in the outermost loop, not while waiting for the
+        response to an action of the request it is handling.
+        """
+        return self.stopper.is_set() or \
+            (send_heartbeat and self.retiring.is_set())
+
     def listen_to_message_once(self, timeout=None):
         poller = self.poller
         socks = dict(poller.poll(timeout))
         if socks.get(self.socket) != zmq.POLLIN:
             return LISTEN_MESSAGE_RESULT_TIMEOUT
-
+        frames = _recv_frames(self.socket.recv_multipart(copy=False))
+        self.count_backlog(frames)
+        return self.handle_frames(frames)
+
+    def count_backlog(self, frames):
+        """
+        Counts a request which was already queued up when the worker
+        finished the previous request. Messages were waiting all along if
+        more are still queued after a heartbeat, so a request behind the
+        heartbeats is counted but a heartbeat alone is not.
+        """
+        if not self.queued:
+            return
+        if len(frames) in (7, 8) and frames[2] == PPP_REQUEST:
+            self.queued = False
+            if self.backlog_counter is not None:
+                self.backlog_counter.inc()
+        elif not self.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            self.queued = False
+
+    def handle_frames(self, frames):
         #  Get message
         #  - 7-part envelope + content -> request
+        #  - 7-part envelope + content + body -> handler request
         #  - 1-part HEARTBEAT -> heartbeat
-        frames = self.socket.recv_multipart()
-        if len(frames) == 7:
+        if len(frames) in (7, 8):
             client = frames[0]
             assert frames[1] == b''
             message_type = frames[2]
@@ -160,6 +289,7 @@ class Worker(threading.Thread, CommonTransport):
             request_id = frames[4]
             assert frames[5] == b''
             message = frames[6]
+            body = frames[7] if len(frames) == 8 else None
 
             self.request_id = request_id
             self.bounce_count = bounce_count
@@ -167,26 +297,29 @@ class Worker(threading.Thread, CommonTransport):
 
             if message_type == PPP_REQUEST:
                 self.mark_as_busy_if_needed()
-                ctx = {
-                    'bounce_count': bounce_count,
-                    'request_id': request_id.decode('utf8'),
-                }
-                response = self.handle_message(message, ctx)
-                self.socket.send_multipart([
+                envelope = [
                     client,
                     b'',
                     PPP_RESPONSE,
                     str(bounce_count).encode('utf8'),
                     request_id,
                     b'',
-                    response,
-                ])
+                ]
+                response = self.handle_request_frames(message, body, {
+                    'bounce_count': bounce_count,
+                    'request_id': request_id.decode('utf8'),
+                })
+                if isinstance(response[-1], _StreamedBody):
+                    self.send_chunks(envelope, response[0], response[-1])
+                else:
+                    self.socket.send_multipart(envelope + response,
+                                               copy=False)
                 self.mark_as_not_busy_if_needed()
                 return LISTEN_MESSAGE_RESULT_HANDLED_REQUEST
             elif message_type == PPP_RESPONSE:
                 self.mark_as_not_busy_if_needed()
                 self.bounce_count -= 1
-                return message.decode('utf8')
+                return message
         elif len(frames) == 1 and frames[0] == PPP_HEARTBEAT:
             return LISTEN_MESSAGE_RESULT_HEARTBEAT
         else:
@@ -194,13 +327,63 @@ class Worker(threading.Thread, CommonTransport):
                 'Invalid message: %s, assuming socket dead', frames)
             return LISTEN_MESSAGE_RESULT_INVALID
 
+    def handle_request_frames(self, message, body, ctx):
+        """
+        Returns the response frames to a request, which is compressed if
+        skygear-server compressed the request.
+        """
+        compressed = is_compressed_frame(message)
+        if compressed:
+            message = decompress_frame(message)
+        if body is None:
+            response = [self.handle_message(message, ctx)]
+        else:
+            response = self.handle_message_frames(message, ctx, body)
+        if compressed:
+            response = _compress_response(response)
+        return response
+
+    def send_chunks(self, envelope, message, body):
+        """
+        Sends a response followed by its streamed body in chunks. Sending
+        blocks when the socket reaches its high water mark, so that the
+        handler is not read ahead of skygear-server.
+        """
+        self.socket.send_multipart(envelope + [message], copy=False)
+        seq = 0
+        end = []
+        try:
+            for seq, chunk in enumerate(body, 1):
+                self.socket.send_multipart(
+                    envelope + [str(seq).encode('utf8'), chunk], copy=False)
+        except Exception as e:
+            log.exception('Error occurred streaming handler response')
+            end = [codec.dumpb(dict(error=_serialize_exc(e).as_dict()))]
+        self.socket.send_multipart(
+            envelope + [str(seq + 1).encode('utf8'), b''] + end)
+
     def mark_as_busy_if_needed(self):
         if self.bounce_count == 0:
             self.busy_lock.acquire()
+            if self.busy_gauge is not None:
+                self.busy_gauge.inc()
 
     def mark_as_not_busy_if_needed(self):
         if self.bounce_count == 0:
             self.busy_lock.release()
+            if self.busy_gauge is not None:
+                self.busy_gauge.dec()
+            # The waiting message may be a heartbeat, count_backlog tells
+            # whether a request was queued up.
+            self.queued = bool(self.socket.getsockopt(zmq.EVENTS) &
+                               zmq.POLLIN)
+
+    def retire(self):
+        """
+        Asks the worker to close its socket with PPP_SHUTDOWN after the
+        request being handled, if any, is finished.
+        """
+        self.retiring.set()
 
     def handle_heartbeat_timeout(self):
         self.liveness -= 1
@@ -215,7 +398,8 @@ class Worker(threading.Thread, CommonTransport):
             self.socket = worker_socket(
                 self.addr,
                 self.z_context,
-                self.poller
+                self.poller,
+                ready=self.ready
             )
             self.socket_name = self.socket.getsockopt_string(
                 zmq.IDENTITY
@@ -236,25 +420,33 @@ class Worker(threading.Thread, CommonTransport):
 
     @_encoded
     def handle_message(self, req, extraContext={}):
-        kind = req.get('kind')
-        if kind == 'init':
-            raise Exception('Init trigger is deprecated, '
-                            'use init event instead')
+        return self._handle_request(req, extraContext)
 
+    def handle_message_frames(self, message, extraContext, body):
+        """
+        Handles a request whose raw body is in its own frame, returning
+        the message frames of the response.
+        """
+        try:
+            req = _attach_body(codec.loads(message), body)
+            return _response_frames(self._handle_request(req, extraContext))
+        except ValueError as e:
+            log.error(str(e))
+            return [str(e).encode('utf-8')]
+
+    def _handle_request(self, req, extraContext):
+        kind = req.get('kind')
         name = req.get('name')
         param = req.get('param', {})
         ctx = req.get('context', {})
         ctx.update(extraContext)
+        return _advertise_capabilities(
+            req, self.dispatch_call(kind, name, ctx, param),
+            (BODY_FRAME_CAPABILITY, CHUNKED_RESPONSE_CAPABILITY,
+             GZIP_FRAME_CAPABILITY))
 
-        if kind == 'provider':
-            action = param.pop('action')
-            return self.call_provider(ctx, name, action, param)
-        elif kind == 'handler':
-            return self.call_handler(ctx, name, param)
-        elif kind == 'event':
-            return self.call_event_func(name, param)
-        else:
-            return self.call_func(ctx, kind, name, param)
+    def _can_stream(self, param):
+        return 'raw_body' in param and bool(param.get('chunked'))
 
     def send_action(self, action_name, payload):
         if self.request_id is None:
@@ -273,27 +465,214 @@ class Worker(threading.Thread, CommonTransport):
             str(self.bounce_count).encode('utf8'),
             self.request_id,
             b'',
-            json.dumps(message).encode('utf8')
+            codec.dumpb(message)
         ])
         return self.run_message_loop(send_heartbeat=False)
 
 
-class OneOffWorker(Worker):
+class OutboundChannel(Worker):
+    """
+    OutboundChannel keeps a worker socket open for requests sent to
+    skygear-server by threads which are not workers, such as threads
+    started by the plugin.
+
+    The channel does not send PPP_READY, so skygear-server never routes
+    requests to it other than those nested in the requests it sent, and
+    does not exchange heartbeats with it. skygear-server sends responses
+    and bounced requests to the socket identity in the envelope of the
+    request, which does not depend on the socket being ready, as for the
+    one-off workers sending actions before.
+
+    Requests are queued by the calling threads and sent by the channel
+    thread. Responses are matched to the calling threads by request ID, so
+    that many threads can wait for responses on the same channel.
+
+    Requests bounced back to the channel are handled on the channel
+    thread. Until the handler returns, requests queued by other threads
+    are sent and their responses matched only while the handler waits
+    for the response to a nested request.
+    """
+    ready = False
 
-    def __init__(self, z_context, addr, stopper, registry=None,
-                 action_name=None, payload={}):
-        Worker.__init__(self, z_context, addr, stopper, registry=None)
-        self.action_name = action_name
-        self.payload = payload
+    def __init__(self, z_context, addr, stopper, registry=None):
+        Worker.__init__(self, z_context, addr, stopper, registry)
+        self.daemon = True
+        self.id_prefix = ("%04X-%04X" % (PREFIX, randint(0, 0x10000))) \
+            .encode('utf8')
+        self.request_count = itertools.count()
+        self.outbox = queue.Queue()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.waker_r, self.waker_w = os.pipe()
+        os.set_blocking(self.waker_w, False)
 
     def run(self):
         self.setup_zmq_sockets()
-        self._result = self.send_action(self.action_name, self.payload)
-        self.shutdown_socket()
+        self.poller.register(self.waker_r, zmq.POLLIN)
+        try:
+            self.run_message_loop()
+        finally:
+            self.fail_pending(
+                ConnectionError('outbound channel stopped before response'))
+
+    def close(self):
+        os.close(self.waker_r)
+        os.close(self.waker_w)
+
+    def request(self, payload, timeout=None):
+        """
+        Sends a request through the channel and waits for the response.
+
+        Raises `concurrent.futures.TimeoutError` if there is no response
+        within `timeout` seconds.
+        """
+        request_id, future = self.submit(payload)
+        try:
+            return future.result(timeout)
+        finally:
+            self.forget(request_id)
+
+    def submit(self, payload):
+        """
+        Sends a request through the channel without waiting for the
+        response. Returns the request ID and a `concurrent.futures.Future`
+        of the response. `forget` must be called with the request ID when
+        the caller stops waiting for the response.
+        """
+        request_id = b'%s-%08X' % (self.id_prefix, next(self.request_count))
+        message = {
+            'method': 'POST',
+            'payload': payload,
+        }
+        future = Future()
+        # The future is resolved by the channel thread only, it cannot be
+        # cancelled by the caller.
+        future.set_running_or_notify_cancel()
+        with self.pending_lock:
+            self.pending[request_id] = future
+        self.outbox.put((request_id, codec.dumpb(message)))
+        self.wake()
+        return request_id, future
+
+    def forget(self, request_id):
+        with self.pending_lock:
+            self.pending.pop(request_id, None)
+
+    def wake(self):
+        try:
+            os.write(self.waker_w, b'\0')
+        except BlockingIOError:
+            # The pipe is full, the channel thread is going to wake up.
+            pass
+        except OSError:
+            raise ConnectionError('outbound channel is closed')
+
+    def listen_to_message_once(self, timeout=None):
+        socks = dict(self.poller.poll(timeout))
+        if socks.get(self.waker_r) == zmq.POLLIN:
+            os.read(self.waker_r, 4096)
+            self.send_queued_requests()
+        if socks.get(self.socket) == zmq.POLLIN:
+            return self.handle_frames(
+                _recv_frames(self.socket.recv_multipart(copy=False)))
+        elif socks:
+            return LISTEN_MESSAGE_RESULT_HANDLED_REQUEST
+        return LISTEN_MESSAGE_RESULT_TIMEOUT
+
+    def send_queued_requests(self):
+        while True:
+            try:
+                request_id, body = self.outbox.get_nowait()
+            except queue.Empty:
+                return
+            with self.pending_lock:
+                if request_id not in self.pending:
+                    # The caller stopped waiting for the response
+                    continue
+            self.socket.send_multipart([
+                self.socket_name.encode('utf8'),
+                b'',
+                PPP_REQUEST,
+                b'0',
+                request_id,
+                b'',
+                body,
+            ])
+
+    def handle_frames(self, frames):
+        # Responses to requests sent by this channel, other messages
+        # are requests bounced to this channel and the responses to
+        # the nested requests made while handling them, which share the
+        # request ID with a higher bounce count.
+        if len(frames) == 7 and frames[2] == PPP_RESPONSE \
+                and frames[3] == b'0' \
+                and frames[4].startswith(self.id_prefix):
+            self.liveness = HEARTBEAT_LIVENESS
+            with self.pending_lock:
+                future = self.pending.pop(frames[4], None)
+            if future is not None:
+                future.set_result(frames[6])
+            return LISTEN_MESSAGE_RESULT_HANDLED_REQUEST
+        return Worker.handle_frames(self, frames)
+
+    def send_heartbeat(self):
+        self.heartbeat_at = time.time() + HEARTBEAT_INTERVAL
+
+    def handle_heartbeat_timeout(self):
+        # skygear-server does not send heartbeats to a socket that is not
+        # ready, requests through the channel time out instead.
+        self.liveness = HEARTBEAT_LIVENESS
+
+    def shutdown_socket(self, send_shutdown=True):
+        Worker.shutdown_socket(self, send_shutdown=False)
+
+    def fail_pending(self, exception):
+        with self.pending_lock:
+            futures = list(self.pending.values())
+            self.pending.clear()
+        for future in futures:
+            future.set_exception(exception)
+
+
+class OutboundChannelPool:
+    """
+    OutboundChannelPool sends requests through a fixed number of outbound
+    channels in turn. Channels are started when they are first used and
+    replaced when they die.
+    """
+
+    def __init__(self, z_context, addr, stopper, registry=None, size=2):
+        self.z_context = z_context
+        self.addr = addr
+        self.stopper = stopper
+        self.registry = registry
+        self.channels = [None] * size
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def channel(self):
+        with self._lock:
+            index = self._next % len(self.channels)
+            self._next += 1
+            channel = self.channels[index]
+            if channel is not None and channel.is_alive():
+                return channel
+            if channel is not None:
+                log.warn('Outbound channel dead, starting a new one')
+                channel.close()
+            channel = OutboundChannel(self.z_context, self.addr,
+                                      self.stopper, self.registry)
+            channel.start()
+            self.channels[index] = channel
+            return channel
+
+    def request(self, payload, timeout=None):
+        return self.channel().request(payload, timeout)
 
     def join(self):
-        threading.Thread.join(self)
-        return self._result
+        for channel in self.channels:
+            if channel is not None:
+                channel.join()
 
 
 class ZmqTransport(CommonTransport):
@@ -302,10 +681,15 @@ class ZmqTransport(CommonTransport):
     Since the zmq socket is not thread safe, the worker will be responabile for
     doing their own heartbeat to the keep alive. To skygear-server it just
     like multiple worker process.
+
+    The number of workers is adjusted between `threading` and `limit`.
+    A worker is added when all workers are busy or when requests are queuing
+    up for busy workers. An idle worker is retired when the rolling
+    utilization of the workers stays low.
     """
 
     def __init__(self, addr, context=None,
-                 registry=None, threading=4, limit=10):
+                 registry=None, threading=4, limit=10, outbound_pool=2):
         super().__init__(registry)
         if context is None:
             context = zmq.Context()
@@ -313,11 +697,35 @@ class ZmqTransport(CommonTransport):
         self._addr = addr
         self._context = context
         self._threading = threading
+        self._min_threading = threading
         self.threads = []
+        self.retired_threads = []
         self.threads_opened = 0
         self.limit = limit
+        self._outbound_pool = outbound_pool
+        self.utilization = 0.0
+        self._low_since = None
+        self._backlog_seen = 0
+        # Created here so that the transport can be stopped before it runs
+        self.stopper = Event()
+        self.outbound = None
+
+        self.size_gauge = metrics.Gauge(
+            'zmq.pool.size', 'Number of workers')
+        self.busy_gauge = metrics.Gauge(
+            'zmq.pool.busy', 'Number of workers handling a request')
+        self.utilization_gauge = metrics.Gauge(
+            'zmq.pool.utilization', 'Rolling utilization of the workers')
+        self.backlog_counter = metrics.Counter(
+            'zmq.pool.backlog', 'Requests queued up for a busy worker')
+        self.scale_up_counter = metrics.Counter(
+            'zmq.pool.scale_up', 'Number of workers added')
+        self.scale_down_counter = metrics.Counter(
+            'zmq.pool.scale_down', 'Number of workers retired')
 
     def run(self):
+        if self.stopper.is_set():
+            return
         self.start()
         try:
             self.maintain_workers_count()
@@ -326,35 +734,99 @@ class ZmqTransport(CommonTransport):
             self.stop()
 
     def start(self):
-        self.stopper = threading.Event()
+        self.outbound = OutboundChannelPool(self._context,
+                                            self._addr,
+                                            self.stopper,
+                                            self._registry,
+                                            self._outbound_pool)
+        for metric in [self.size_gauge, self.busy_gauge,
+                       self.utilization_gauge, self.backlog_counter,
+                       self.scale_up_counter, self.scale_down_counter]:
+            metrics.register(metric)
         for i in range(self._threading):
             self.start_worker_at_index(i)
+        self.size_gauge.set(self._threading)
 
     def maintain_workers_count(self):
-        i = 0
-        while True:
-            t = self.threads[i]
-            t.join(HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS)
-            if self.stopper.is_set():
-                log.info(
-                    'Workers are shutting down, stop maintain workers loop')
-                return
-            if not t.is_alive():
-                log.warn(
-                    'Worker Thread dead, starting a new one')
-                self.start_worker_at_index(i)
-            i = i + 1
-            if i >= self._threading:
-                i = 0
-            busy_count = len(
-                [t for t in self.threads if t.busy_lock.locked()]
-            )
-            if busy_count == self._threading and busy_count < self.limit:
-                self.start_worker_at_index(self._threading)
-                self._threading += 1
+        while not self.stopper.wait(POOL_CONTROL_INTERVAL):
+            self.replace_dead_workers()
+            self.adjust_workers_count()
+        log.info('Workers are shutting down, stop maintain workers loop')
+
+    def replace_dead_workers(self):
+        for i, t in enumerate(self.threads):
+            if t.is_alive():
+                continue
+            log.warn('Worker Thread dead, starting a new one')
+            if t.busy_lock.locked():
+                self.busy_gauge.dec()
+            self.start_worker_at_index(i)
+        self.retired_threads = [t for t in self.retired_threads
+                                if t.is_alive()]
+
+    def adjust_workers_count(self):
+        busy_count = self.busy_count()
+        utilization = busy_count / self._threading if self._threading else 0
+        self.utilization += \
+            POOL_UTILIZATION_WEIGHT * (utilization - self.utilization)
+        self.utilization_gauge.set(round(self.utilization, 3))
+
+        backlog = self.backlog_counter.value - self._backlog_seen
+        self._backlog_seen += backlog
+
+        if self._threading < self.limit \
+                and (busy_count >= self._threading or backlog):
+            self.scale_up()
+        elif self._threading > self._min_threading \
+                and self.low_utilization_for() >= POOL_SCALE_DOWN_DELAY:
+            self.scale_down()
+
+    def low_utilization_for(self):
+        """
+        Returns the number of seconds for which the rolling utilization has
+        stayed below POOL_SCALE_DOWN_UTILIZATION since the last scaling,
+        or -1 if it is not low.
+        """
+        if self.utilization >= POOL_SCALE_DOWN_UTILIZATION:
+            self._low_since = None
+            return -1
+        if self._low_since is None:
+            self._low_since = time.time()
+        return time.time() - self._low_since
+
+    def scale_up(self):
+        self.start_worker_at_index(self._threading)
+        self._threading += 1
+        self._low_since = None
+        self.size_gauge.set(self._threading)
+        self.scale_up_counter.inc()
+        log.info('Scaled up to %d workers', self._threading)
+
+    def scale_down(self):
+        idle = [t for t in self.threads if not t.busy_lock.locked()]
+        if not idle:
+            return
+        t = idle[-1]
+        t.retire()
+        self.threads.remove(t)
+        self.retired_threads.append(t)
+        self._threading -= 1
+        self._low_since = None
+        self.size_gauge.set(self._threading)
+        self.scale_down_counter.inc()
+        log.info('Scaled down to %d workers', self._threading)
+
+    def busy_count(self):
+        """
+        Returns the number of workers handling a request.
+        """
+        return self.busy_gauge.value
 
     def start_worker_at_index(self, index):
-        t = Worker(self._context, self._addr, self.stopper)
+        t = Worker(self._context, self._addr, self.stopper,
+                   registry=self._registry,
+                   busy_gauge=self.busy_gauge,
+                   backlog_counter=self.backlog_counter)
         if index < len(self.threads):
             self.threads[index] = t
         else:
@@ -364,23 +836,33 @@ class ZmqTransport(CommonTransport):
 
     def stop(self):
         self.stopper.set()
-        for t in self.threads:
+        for t in self.threads + self.retired_threads:
             t.join()
+        if self.outbound is not None:
+            self.outbound.join()
 
     def send_action(self, action_name, payload, url=None, timeout=60):
         worker = threading.current_thread()
         if isinstance(worker, Worker):
             # Nested request
             result = worker.send_action(action_name, payload)
-            return json.loads(result)
-
-        new_worker = OneOffWorker(
-            self._context,
-            self._addr,
-            self.stopper,
-            action_name=action_name,
-            payload=payload,
-        )
-        new_worker.start()
-        result = new_worker.join()
-        return json.loads(result)
+            return codec.loads(result)
+
+        result = self.outbound.request(payload, timeout)
+        return codec.loads(result)
+
+    async def send_action_async(self, action_name, payload, url=None,
+                                timeout=60):
+        """
+        Sends a request through an outbound channel without blocking the
+        event loop. Requests are never nested in the request being
+        handled, so that they can be in flight at the same time.
+        """
+        channel = self.outbound.channel()
+        request_id, future = channel.submit(payload)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future),
+                                            timeout)
+        finally:
+            channel.forget(request_id)
+        return codec.loads(result)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import inspect
+import io
 import logging
 import os.path
 import shutil
@@ -40,6 +41,16 @@ class StaticAssetsLoader:
         """
         return None
 
+    def open_asset(self, name):
+        """
+        Open a static asset by name as a binary file, so that it can be
+        served without reading all of it into memory.
+        """
+        content = self.get_asset(name)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return io.BytesIO(content or b'')
+
     def copy_into(self, path):
         """
         Copy the content of all static assets into a directory.
@@ -90,6 +101,9 @@ class DirectoryStaticAssetsLoader(StaticAssetsLoader):
         with open(filename, 'rb') as f:
             return f.read()
 
+    def open_asset(self, path):
+        return open(os.path.join(self.dirpath, path), 'rb')
+
     def copy_into(self, dest):
         shutil.copytree(self.dirpath, dest, symlinks=True)
 
@@ -117,6 +131,10 @@ class PackageStaticAssetsLoader(StaticAssetsLoader):
         return self.provider.get_resource_string(self.manager,
                                                  self.resource_name(name))
 
+    def open_asset(self, name):
+        return self.provider.get_resource_stream(self.manager,
+                                                 self.resource_name(name))
+
     def copy_into(self, dest):
         def _walk(subpath=None):
             """
@@ -14,18 +14,57 @@
 import contextlib
 import threading
 
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    contextvars = None
 
-class RequestContextManager(threading.local):
+
+class RequestContextManager:
+    """
+    RequestContextManager keeps a stack of request contexts.
+
+    When `contextvars` is available, the stack is stored in a context
+    variable so that each asyncio task sees its own stack. Otherwise the
+    stack is local to the current thread.
+    """
     def __init__(self):
+        if contextvars is not None:
+            self._var = contextvars.ContextVar('skygear_request_context',
+                                               default=None)
+        else:
+            self._local = threading.local()
         self.clear()
 
+    @property
+    def stack(self):
+        if contextvars is not None:
+            stack = self._var.get()
+        else:
+            stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = ({},)
+            self.stack = stack
+        return stack
+
+    @stack.setter
+    def stack(self, value):
+        # The stack is stored as a tuple so that a task never mutates
+        # the stack it inherited from its parent.
+        if contextvars is not None:
+            self._var.set(tuple(value))
+        else:
+            self._local.stack = tuple(value)
+
     def push(self, context):
-        self.stack.append(context)
+        self.stack = self.stack + (context,)
 
     def pop(self):
-        if len(self.stack) == 1:
+        stack = self.stack
+        if len(stack) == 1:
             raise Exception("Cannot pop the top-most context.")
-        return self.stack.pop()
+        self.stack = stack[:-1]
+        return stack[-1]
 
     def current(self):
         return self.stack[-1]
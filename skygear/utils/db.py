@@ -11,68 +11,301 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import contextlib
+import functools
 import logging
 import os
+import pickle
 import re
+import stat
+import sys
+import tempfile
+import threading
+import time
 
 import sqlalchemy as sa
 from sqlalchemy import schema
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.dialects.postgresql.base import ischema_names
 
+from .. import codec
 from ..container import SkygearContainer
 from .logging import setLoggerTag
 
 _app_name_pattern = re.compile('[.:]')
 _engine = None
+_engine_options = {}
+_engine_lock = threading.Lock()
+_forked_engines = []
 _metadata = None
+_metadata_schema = None
+_metadata_fingerprint = None
+_metadata_checked_at = 0
+_missing_tables = set()
+_metadata_lock = threading.RLock()
+_schema_cache_dir = None
 _logger = logging.getLogger(__name__)
 setLoggerTag(_logger, 'plugin')
 
 # Register CIText to SQLAlchemy's Postgres reflection subsystem.
 ischema_names['citext'] = sa.types.TEXT
 
+# Seconds after which the reflected tables are checked against the schema
+SCHEMA_CHECK_INTERVAL = 60
+
 
 def quotedIdentifier(s):
     return '"%s"' % s.replace('"', '""')
 
 
+def configure_engine(pool_size=5, max_overflow=10, pool_recycle=-1,
+                     pool_pre_ping=False):
+    """
+    Sets the connection pool options of the engine, which is created again
+    with these options when it is next used.
+
+    Connections older than `pool_recycle` seconds are replaced when they
+    are checked out, and with `pool_pre_ping` a connection is tested
+    before it is used.
+    """
+    global _engine, _engine_options
+    with _engine_lock:
+        _engine_options = {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_recycle': pool_recycle,
+        }
+        if pool_pre_ping:
+            _engine_options['pool_pre_ping'] = True
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def reset_engine_after_fork():
+    """
+    Forgets the engine inherited from the parent process in a forked
+    process, which creates its own engine when it is next used. The
+    connections of the inherited engine are not closed, as they are still
+    used by the parent process.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            return
+        try:
+            _engine.dispose(close=False)
+        except TypeError:
+            # Before SQLAlchemy 1.4.33, the connections would be closed, so
+            # the engine is kept from being garbage collected instead.
+            _forked_engines.append(_engine)
+        _engine = None
+
+
 def _get_engine():
     global _engine
-    if _engine is None:
-        db_url = os.getenv('DATABASE_URL')
-        if not db_url:
-            raise ValueError('empty environment variable "DATABASE_URL"')
+    with _engine_lock:
+        if _engine is None:
+            db_url = os.getenv('DATABASE_URL')
+            if not db_url:
+                raise ValueError(
+                    'empty environment variable "DATABASE_URL"')
 
-        _engine = sa.create_engine(db_url)
+            _engine = sa.create_engine(db_url, **_engine_options)
+            sa.event.listen(_engine, 'connect', _on_connect)
 
     return _engine
 
 
+def _on_connect(dbapi_conn, connection_record):
+    """
+    Sets the search path once for each new database connection, instead of
+    every time a connection is checked out of the pool.
+    """
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute(_search_path_sql())
+    finally:
+        cursor.close()
+    # Commit so that the search path is not reverted when the pool rolls
+    # back the connection on return.
+    dbapi_conn.commit()
+
+
 def _get_schema_name():
     app_name = SkygearContainer.get_default_app_name()
     return 'app_' + _app_name_pattern.sub('_', app_name)
 
 
-def _get_metadata():
+def configure_schema_cache(path):
+    """
+    Sets the directory where reflected tables are saved, so that tables
+    do not have to be reflected again after the plugin restarts. Set to
+    None to disable the cache on disk.
+
+    A saved schema is only used while the columns of the schema have not
+    changed since it was saved, and only if the file is owned by the user
+    of the plugin and not writable by other users.
+    """
+    global _schema_cache_dir
+    with _metadata_lock:
+        _schema_cache_dir = path
+    invalidate_schema()
+
+
+def invalidate_schema():
+    """
+    Forgets the reflected tables, which are reflected again when they are
+    next used.
+    """
     global _metadata
-    if _metadata:
-        return _metadata
+    with _metadata_lock:
+        _metadata = None
 
-    _metadata = _reflect_tables()
-    return _metadata
 
+def _get_metadata():
+    """
+    Returns the metadata of the reflected tables. The reflected tables,
+    and the tables known to be missing, are forgotten when the columns of
+    the schema have changed, which is checked every SCHEMA_CHECK_INTERVAL
+    seconds.
+
+    The schema is checked without holding the lock, so that other threads
+    keep using the reflected tables in the meantime.
+    """
+    global _metadata_checked_at
+    schema_name = _get_schema_name()
+    now = time.monotonic()
+    with _metadata_lock:
+        current = _metadata is not None and _metadata_schema == schema_name
+        if current and now - _metadata_checked_at < SCHEMA_CHECK_INTERVAL:
+            return _metadata
+        if current:
+            # Other threads do not check the schema at the same time.
+            _metadata_checked_at = now
+
+    fingerprint = _schema_fingerprint(schema_name)
+    with _metadata_lock:
+        _metadata_checked_at = time.monotonic()
+        if _metadata is not None and _metadata_schema == schema_name:
+            if fingerprint == _metadata_fingerprint:
+                return _metadata
+            _logger.info("Schema '{}' has changed, reflecting tables again."
+                         .format(schema_name))
+        return _reset_metadata(schema_name, fingerprint)
+
+
+def _reset_metadata(schema_name, fingerprint):
+    global _metadata, _metadata_schema, _metadata_fingerprint
+    _metadata_schema = schema_name
+    _metadata_fingerprint = fingerprint
+    _metadata = None
+    _missing_tables.clear()
+    if _schema_cache_dir:
+        _metadata = _load_schema_cache(schema_name, fingerprint)
+    if _metadata is None:
+        _metadata = schema.MetaData()
+    return _metadata
 
-def _reflect_tables():
-    meta = schema.MetaData()
 
+def _get_table(name):
+    """
+    Returns the table with the specified name, reflecting it from the
+    database if it is not reflected yet, or None if there is no such table.
+    """
     schema_name = _get_schema_name()
-    _logger.info("Reflecting database schema from postgres schema '{}'."
-                 .format(schema_name))
-    meta.reflect(bind=_get_engine(), schema=schema_name, views=True)
+    meta = _get_metadata()
+    with _metadata_lock:
+        table = meta.tables.get(_full_table_name(schema_name, name))
+        if table is not None or name in _missing_tables:
+            return table
+
+        _logger.info("Reflecting table '{}' from postgres schema '{}'."
+                     .format(name, schema_name))
+        try:
+            table = sa.Table(name, meta, schema=schema_name, autoload=True,
+                             autoload_with=_get_engine())
+        except sa.exc.NoSuchTableError:
+            _missing_tables.add(name)
+            return None
+        if _schema_cache_dir and meta is _metadata:
+            _save_schema_cache(meta, schema_name, _metadata_fingerprint)
+        return table
+
+
+def _schema_fingerprint(schema_name):
+    """
+    Returns a digest of the columns of all tables in the schema, which
+    changes whenever skygear-server migrates the schema.
+    """
+    sql = sa.text("""
+        SELECT md5(string_agg(
+            table_name || '.' || column_name || ':' || data_type, ','
+            ORDER BY table_name, ordinal_position))
+        FROM information_schema.columns
+        WHERE table_schema = :schema_name
+        """)
+    with _get_engine().connect() as conn:
+        fingerprint = conn.execute(sql, schema_name=schema_name).scalar()
+    return fingerprint or 'empty'
+
+
+def _schema_cache_path(schema_name, fingerprint):
+    return os.path.join(_schema_cache_dir,
+                        '{}-{}.pickle'.format(schema_name, fingerprint))
+
+
+def _load_schema_cache(schema_name, fingerprint):
+    """
+    Returns the metadata saved in the schema cache, or None if it is not
+    saved. Unpickling a file can run arbitrary code, so the file is only
+    loaded if it is owned by the user of the plugin and cannot be written
+    by other users.
+    """
+    path = _schema_cache_path(schema_name, fingerprint)
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except FileNotFoundError:
+        return None
+    except OSError:
+        _logger.exception("Failed to open schema cache '{}'.".format(path))
+        return None
+    with os.fdopen(fd, 'rb') as f:
+        if not _is_private(os.fstat(f.fileno())):
+            _logger.warning("Ignored schema cache '{}', which is not owned "
+                            "by the user or is writable by other users."
+                            .format(path))
+            return None
+        try:
+            meta = pickle.load(f)
+        except Exception:
+            _logger.exception("Failed to load schema cache '{}'."
+                              .format(path))
+            return None
+    _logger.info("Loaded {} tables from schema cache '{}'."
+                 .format(len(meta.tables), path))
     return meta
 
 
+def _is_private(st):
+    return st.st_uid == os.getuid() and \
+        not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _save_schema_cache(meta, schema_name, fingerprint):
+    path = _schema_cache_path(schema_name, fingerprint)
+    try:
+        os.makedirs(_schema_cache_dir, mode=0o700, exist_ok=True)
+        # The file is created readable and writable by the user only.
+        fd, tmp_path = tempfile.mkstemp(dir=_schema_cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(meta, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        _logger.exception("Failed to save schema cache '{}'.".format(path))
+
+
 def _search_path_sql():
     app_name = quotedIdentifier(_get_schema_name())
     return "SET search_path TO {0}, public;".format(app_name)
@@ -93,16 +326,15 @@ def _full_table_name(schema_name, name):
 def get_table(name):
     """
     Returns the table object with the specified name from the reflected
-    database.
+    database. Tables are reflected when they are first used.
 
     An exception is raised if the table does not exist.
     """
-    schema_name = _get_schema_name()
-    try:
-        return _get_metadata().tables[_full_table_name(schema_name, name)]
-    except KeyError:
+    table = _get_table(name)
+    if table is None:
         raise Exception("No table of name '{}' exists in schema '{}'.".format(
-                        name, schema_name))
+                        name, _get_schema_name()))
+    return table
 
 
 def has_table(name):
@@ -110,13 +342,335 @@ def has_table(name):
     Returns whether a table with the specified name exists in the reflected
     database schema.
     """
-    schema_name = _get_schema_name()
-    return _full_table_name(schema_name, name) in _get_metadata().tables
+    return _get_table(name) is not None
 
 
 @contextlib.contextmanager
 def conn():
-    sql = _search_path_sql()
     with _get_engine().begin() as conn:
-        conn.execute(sql)
         yield conn
+
+
+class LazyConnection:
+    """
+    LazyConnection is a proxy of the connection of `conn`, which is only
+    checked out of the pool when the proxy is first used.
+
+    The transaction is committed when the proxy is closed without an
+    exception, and rolled back otherwise.
+    """
+
+    def __init__(self):
+        self._context = None
+        self._conn = None
+
+    @property
+    def opened(self):
+        return self._conn is not None
+
+    @property
+    def connection(self):
+        if self._conn is None:
+            context = conn()
+            self._conn = context.__enter__()
+            self._context = context
+        return self._conn
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def close(self, exc_info=(None, None, None)):
+        context, self._context, self._conn = self._context, None, None
+        if context is not None:
+            context.__exit__(*exc_info)
+
+
+class AsyncConnection:
+    """
+    AsyncConnection is a LazyConnection for coroutines. Statements run with
+    `await conn.execute(...)`, and the connection is checked out, committed
+    and returned to the pool, in `executor`, so that the event loop is not
+    blocked by the database.
+
+    Use it with `async with`, which closes it like `lazy_conn`.
+    """
+
+    def __init__(self, executor=None):
+        self._lazy = LazyConnection()
+        self._executor = executor
+
+    @property
+    def opened(self):
+        return self._lazy.opened
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def execute(self, *args, **kwargs):
+        return await self._run(self._lazy.execute, *args, **kwargs)
+
+    async def close(self, exc_info=(None, None, None)):
+        if self._lazy.opened:
+            await self._run(self._lazy.close, exc_info)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close(exc_info)
+
+
+@contextlib.contextmanager
+def lazy_conn():
+    """
+    Yields a LazyConnection, so that a database connection is only checked
+    out if the connection is used.
+    """
+    lazy = LazyConnection()
+    try:
+        yield lazy
+    except BaseException:
+        lazy.close(sys.exc_info())
+        raise
+    lazy.close()
+
+
+@contextlib.contextmanager
+def _using(db):
+    if db is not None:
+        yield db
+        return
+    with conn() as db:
+        yield db
+
+
+def _cursor(db):
+    if isinstance(db, LazyConnection):
+        db = db.connection
+    return db.connection.cursor()
+
+
+def _as_table(table):
+    if isinstance(table, str):
+        return get_table(table)
+    return table
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_insert(table, rows, batch_size=1000, db=None):
+    """
+    Inserts rows into a table, sending `batch_size` rows in each
+    statement with executemany.
+
+    Args:
+        table: Table, or name of a table in the app schema
+        rows: Iterable of dicts, all with the same keys
+        batch_size (int): Number of rows inserted in each statement
+        db: Connection to use, a new connection is opened if None
+
+    Returns:
+        int: Number of rows inserted
+    """
+    table = _as_table(table)
+    count = 0
+    with _using(db) as db:
+        for batch in _batches(rows, batch_size):
+            db.execute(table.insert(), batch)
+            count += len(batch)
+    return count
+
+
+def bulk_upsert(table, rows, index_elements=None, update_columns=None,
+                batch_size=1000, db=None):
+    """
+    Inserts rows into a table, updating the existing rows that conflict
+    with them, with `INSERT ... ON CONFLICT DO UPDATE`.
+
+    Args:
+        table: Table, or name of a table in the app schema
+        rows: Iterable of dicts, all with the same keys
+        index_elements (list): Columns of the unique index that rows
+            conflict on. Defaults to the primary key.
+        update_columns (list): Columns updated on conflict. Defaults to
+            the columns of the rows that are not in `index_elements`.
+        batch_size (int): Number of rows sent in each statement
+        db: Connection to use, a new connection is opened if None
+
+    Returns:
+        int: Number of rows inserted or updated, as reported by the
+        database. Rows skipped by `ON CONFLICT DO NOTHING` are not counted.
+    """
+    table = _as_table(table)
+    if index_elements is None:
+        index_elements = [c.name for c in table.primary_key.columns]
+    count = 0
+    with _using(db) as db:
+        for batch in _batches(rows, batch_size):
+            stmt = pg_insert(table)
+            columns = update_columns
+            if columns is None:
+                columns = [k for k in batch[0] if k not in index_elements]
+            if columns:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=index_elements,
+                    set_={c: stmt.excluded[c] for c in columns})
+            else:
+                stmt = stmt.on_conflict_do_nothing(
+                    index_elements=index_elements)
+            count += db.execute(stmt, batch).rowcount
+    return count
+
+
+def _copy_target(table, columns):
+    name = quotedIdentifier(table.name)
+    if table.schema:
+        name = quotedIdentifier(table.schema) + '.' + name
+    if columns:
+        name += ' ({})'.format(', '.join(quotedIdentifier(c)
+                                         for c in columns))
+    return name
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea in hex format, whose backslash is escaped
+        return '\\\\x' + bytes(value).hex()
+    if isinstance(value, (dict, list)):
+        value = codec.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CopyStream:
+    """
+    File-like object that reads rows from an iterable in the text format
+    of COPY, so that the rows are never all held in memory.
+    """
+
+    def __init__(self, rows, columns):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._buffer = ''
+
+    def _line(self, row):
+        if isinstance(row, dict):
+            row = [row.get(c) for c in self._columns]
+        return '\t'.join([_copy_value(v) for v in row]) + '\n'
+
+    def read(self, size=-1):
+        lines = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = self._line(row)
+            lines.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(lines)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(table, rows, columns=None, db=None):
+    """
+    Loads rows into a table with `COPY ... FROM STDIN`, which is much
+    faster than inserting them for large numbers of rows.
+
+    Args:
+        table: Table, or name of a table in the app schema
+        rows: Iterable of dicts, or of sequences in the order of
+            `columns`
+        columns (list): Columns loaded. Defaults to all columns of the
+            table.
+        db: Connection to use, a new connection is opened if None
+
+    Returns:
+        int: Number of rows loaded
+    """
+    table = _as_table(table)
+    if columns is None:
+        columns = [c.name for c in table.columns]
+    sql = 'COPY {} FROM STDIN'.format(_copy_target(table, columns))
+    with _using(db) as db:
+        cursor = _cursor(db)
+        try:
+            cursor.copy_expert(sql, _CopyStream(rows, columns))
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+
+def copy_csv(table, f, columns=None, header=False, db=None):
+    """
+    Loads rows into a table from a CSV file with `COPY ... FROM STDIN`.
+
+    Args:
+        table: Table, or name of a table in the app schema
+        f: File object of the CSV file
+        columns (list): Columns of the CSV file, in order. Defaults to all
+            columns of the table.
+        header (bool): Skip the first line of the file
+        db: Connection to use, a new connection is opened if None
+
+    Returns:
+        int: Number of rows loaded
+    """
+    table = _as_table(table)
+    sql = 'COPY {} FROM STDIN WITH (FORMAT csv, HEADER {})'.format(
+        _copy_target(table, columns), 'true' if header else 'false')
+    with _using(db) as db:
+        cursor = _cursor(db)
+        try:
+            cursor.copy_expert(sql, f)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+
+def stream(query, chunk_size=1000, db=None):
+    """
+    Iterates over the rows of a SELECT with a server-side cursor, fetching
+    `chunk_size` rows at a time instead of loading every row into memory.
+
+    Example:
+
+    >>> for row in stream(get_table('note').select()):
+    ...     export(row)
+
+    Args:
+        query: Selectable or SQL string
+        chunk_size (int): Number of rows fetched at a time
+        db: Connection to use, a new connection is opened if None
+    """
+    with _using(db) as db:
+        result = db.execution_options(stream_results=True).execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            result.close()
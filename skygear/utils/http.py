@@ -11,8 +11,128 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import logging
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
 from werkzeug.wrappers import BaseResponse
 
+from .logging import setLoggerTag
+
+log = logging.getLogger(__name__)
+setLoggerTag(log, 'plugin')
+
+# Actions that do not change anything on skygear-server, and so can be
+# sent again when the request fails.
+IDEMPOTENT_ACTIONS = frozenset([
+    'asset:get',
+    'me',
+    'record:fetch',
+    'record:query',
+    'role:get',
+    'schema:fetch',
+    'user:query',
+])
+RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
 
 class Response(BaseResponse):
     pass
+
+
+class HTTPClient:
+    """
+    HTTPClient sends requests to skygear-server over pooled keep-alive
+    connections.
+
+    At most `pool_size` connections are kept open to each host, and a
+    request waits for a free connection when all of them are in use. The
+    client is safe to share between threads.
+
+    Requests marked as idempotent are retried up to `retries` times when
+    the connection fails or the server is unavailable, waiting
+    `backoff * 2 ** n` seconds before the n-th retry. Other requests are
+    never retried, as they may have been handled by the server already.
+    """
+
+    def __init__(self, pool_size=10, retries=2, backoff=0.1, hosts=10):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        # Cookies are not used by skygear-server, and the cookie jar is
+        # not safe to share between threads.
+        self.session.cookies.set_policy(_NoCookies())
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size,
+                              pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, url, data, headers=None, timeout=60, idempotent=False):
+        """
+        Sends a POST request and returns the `requests.Response`.
+
+        Raises:
+            requests.RequestException: If the request failed after all
+                retries.
+        """
+        retries = self.retries if idempotent else 0
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.post(url, data=data, headers=headers,
+                                         timeout=timeout)
+                if attempt >= retries or \
+                        resp.status_code not in RETRY_STATUS_CODES:
+                    return resp
+                log.warning('%s responded with %d, retrying', url,
+                            resp.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= retries:
+                    raise
+                log.warning('Request to %s failed, retrying: %s', url, e)
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+
+class _NoCookies(DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+_client = None
+_client_options = {}
+_client_lock = threading.Lock()
+
+
+def configure_client(**kwargs):
+    """
+    Sets the options of the default HTTPClient, which is created again
+    with these options when it is next used.
+    """
+    global _client, _client_options
+    with _client_lock:
+        _client_options = kwargs
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_client():
+    """
+    Returns the default HTTPClient shared by the transports.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient(**_client_options)
+        return _client
@@ -0,0 +1,114 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+In-process metrics of the plugin runtime.
+
+Metrics are registered by name in the default registry, and the current
+values of all metrics can be read with `snapshot`:
+
+>>> from skygear.utils import metrics
+>>> requests = metrics.counter('myplugin.requests')
+>>> requests.inc()
+>>> metrics.snapshot()['myplugin.requests']
+1
+"""
+import threading
+
+
+class Counter:
+    """
+    Counter is a metric whose value only goes up.
+    """
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+
+class Gauge(Counter):
+    """
+    Gauge is a metric whose value can go up and down.
+    """
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Registers the metric, replacing the metric of the same name.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get_or_create(self, cls, name, description=''):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, description)
+                self._metrics[name] = metric
+            elif type(metric) is not cls:
+                raise TypeError('metric {} is a {}'.format(
+                    name, type(metric).__name__))
+            return metric
+
+    def snapshot(self):
+        """
+        Returns a dict of the current values of all metrics, keyed by
+        metric name.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.value for m in metrics}
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def counter(name, description=''):
+    return _registry.get_or_create(Counter, name, description)
+
+
+def gauge(name, description=''):
+    return _registry.get_or_create(Gauge, name, description)
+
+
+def register(metric):
+    return _registry.register(metric)
+
+
+def snapshot():
+    return _registry.snapshot()
@@ -11,9 +11,16 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import os
+import tempfile
+import threading
 import unittest
+from unittest.mock import MagicMock, patch
 
-from sqlalchemy.schema import Table
+from sqlalchemy import Column, Text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import MetaData, Table
 from sqlalchemy.sql import text
 
 from skygear.container import SkygearContainer
@@ -82,3 +89,218 @@ class TestReflectTable(BaseTestCase):
 
     def test_has_table_nonexistent(self):
         assert db.has_table('something') is False
+
+
+class TestLazyConnection(unittest.TestCase):
+    def setUp(self):
+        self.conn = MagicMock()
+        self.context = MagicMock()
+        self.context.__enter__.return_value = self.conn
+        patcher = patch('skygear.utils.db.conn', return_value=self.context)
+        self.db_conn = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unused(self):
+        with db.lazy_conn() as conn:
+            assert not conn.opened
+        self.db_conn.assert_not_called()
+
+    def test_used(self):
+        with db.lazy_conn() as conn:
+            conn.execute('SELECT 1')
+            conn.execute('SELECT 2')
+        self.db_conn.assert_called_once_with()
+        assert self.conn.execute.call_count == 2
+        self.context.__exit__.assert_called_once_with(None, None, None)
+
+    def test_exception(self):
+        with self.assertRaises(ValueError):
+            with db.lazy_conn() as conn:
+                conn.execute('SELECT 1')
+                raise ValueError()
+        args = self.context.__exit__.call_args[0]
+        assert args[0] is ValueError
+
+
+class TestAsyncConnection(unittest.TestCase):
+    def setUp(self):
+        self.conn = MagicMock()
+        self.context = MagicMock()
+        self.context.__enter__.return_value = self.conn
+        patcher = patch('skygear.utils.db.conn', return_value=self.context)
+        self.db_conn = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_runs_in_executor(self):
+        threads = []
+        self.conn.execute.side_effect = \
+            lambda sql: threads.append(threading.current_thread())
+
+        async def run():
+            async with db.AsyncConnection() as conn:
+                await conn.execute('SELECT 1')
+
+        self.loop.run_until_complete(run())
+        assert threads and threads[0] is not threading.current_thread()
+        self.context.__exit__.assert_called_once_with(None, None, None)
+
+    def test_unused(self):
+        async def run():
+            async with db.AsyncConnection() as conn:
+                assert not conn.opened
+
+        self.loop.run_until_complete(run())
+        self.db_conn.assert_not_called()
+
+
+class TestSchemaCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        db.configure_schema_cache(self.dir.name)
+        self.addCleanup(db.configure_schema_cache, None)
+
+    def test_save_and_load(self):
+        meta = MetaData()
+        Table('note', meta, Column('id', Text, primary_key=True),
+              schema='app_db')
+        db._save_schema_cache(meta, 'app_db', 'abc')
+
+        loaded = db._load_schema_cache('app_db', 'abc')
+        assert list(loaded.tables) == ['app_db.note']
+        assert list(loaded.tables['app_db.note'].c.keys()) == ['id']
+
+    def test_fingerprint_changed(self):
+        db._save_schema_cache(MetaData(), 'app_db', 'abc')
+        assert db._load_schema_cache('app_db', 'def') is None
+
+    def test_writable_by_others(self):
+        db._save_schema_cache(MetaData(), 'app_db', 'abc')
+        path = db._schema_cache_path('app_db', 'abc')
+        os.chmod(path, 0o666)
+        assert db._load_schema_cache('app_db', 'abc') is None
+
+    @patch('skygear.utils.db._schema_fingerprint', return_value='abc')
+    def test_metadata_from_cache(self, fingerprint):
+        SkygearContainer.set_default_app_name('db')
+        meta = MetaData()
+        Table('note', meta, Column('id', Text), schema='app_db')
+        db._save_schema_cache(meta, 'app_db', 'abc')
+
+        db.invalidate_schema()
+        assert db.has_table('note') is True
+        fingerprint.assert_called_once_with('app_db')
+
+
+@patch('skygear.utils.db._get_engine')
+@patch('skygear.utils.db._schema_fingerprint', return_value='abc')
+class TestSchemaCheck(unittest.TestCase):
+    def setUp(self):
+        SkygearContainer.set_default_app_name('db')
+        db.invalidate_schema()
+        self.addCleanup(db.invalidate_schema)
+
+    @patch('skygear.utils.db.sa.Table',
+           side_effect=db.sa.exc.NoSuchTableError('note'))
+    def test_missing_table_cached(self, table, fingerprint, engine):
+        assert db.has_table('note') is False
+        assert db.has_table('note') is False
+        assert table.call_count == 1
+
+    @patch('skygear.utils.db.SCHEMA_CHECK_INTERVAL', 0)
+    @patch('skygear.utils.db.sa.Table',
+           side_effect=db.sa.exc.NoSuchTableError('note'))
+    def test_schema_changed(self, table, fingerprint, engine):
+        assert db.has_table('note') is False
+        assert db.has_table('note') is False
+        assert table.call_count == 1
+
+        fingerprint.return_value = 'def'
+        table.side_effect = None
+        assert db.has_table('note') is True
+        assert table.call_count == 2
+
+    @patch('skygear.utils.db.SCHEMA_CHECK_INTERVAL', 0)
+    @patch('skygear.utils.db.sa.Table')
+    def test_schema_checked_without_lock(self, table, fingerprint, engine):
+        acquired = []
+
+        def acquire():
+            if db._metadata_lock.acquire(timeout=1):
+                db._metadata_lock.release()
+                acquired.append(True)
+            else:
+                acquired.append(False)
+
+        def check(schema_name):
+            # Other threads can use the tables while the schema is checked
+            t = threading.Thread(target=acquire)
+            t.start()
+            t.join()
+            return 'abc'
+
+        fingerprint.side_effect = check
+        assert db.has_table('note') is True
+        assert db.has_table('note') is True
+        assert acquired == [True, True]
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.table = Table('note', MetaData(),
+                           Column('id', Text, primary_key=True),
+                           Column('content', Text),
+                           schema='app_db')
+
+    def test_bulk_insert(self):
+        conn = MagicMock()
+        rows = ({'id': str(i), 'content': 'x'} for i in range(5))
+        assert db.bulk_insert(self.table, rows, batch_size=2, db=conn) == 5
+        batches = [args[1] for args, _ in conn.execute.call_args_list]
+        assert [len(b) for b in batches] == [2, 2, 1]
+
+    def test_bulk_upsert(self):
+        conn = MagicMock()
+        conn.execute.return_value.rowcount = 1
+        rows = [{'id': '1', 'content': 'x'}]
+        assert db.bulk_upsert(self.table, rows, db=conn) == 1
+        stmt = conn.execute.call_args[0][0]
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        assert 'ON CONFLICT (id) DO UPDATE SET content = ' \
+            'excluded.content' in sql
+
+    def test_copy_rows(self):
+        conn = MagicMock()
+        cursor = conn.connection.cursor.return_value
+        data = []
+        cursor.copy_expert.side_effect = \
+            lambda sql, f: data.append((sql, f.read(8) + f.read()))
+        rows = [{'id': '1', 'content': 'a\tb'}, ('2', None)]
+        db.copy_rows(self.table, rows, db=conn)
+        sql, body = data[0]
+        assert sql == 'COPY "app_db"."note" ("id", "content") FROM STDIN'
+        assert body == '1\ta\\tb\n2\t\\N\n'
+        cursor.close.assert_called_once_with()
+
+    def test_bulk_upsert_count(self):
+        conn = MagicMock()
+        # One row of each batch conflicts and is skipped
+        conn.execute.side_effect = lambda stmt, batch: MagicMock(
+            rowcount=len(batch) - 1)
+        rows = [{'id': str(i)} for i in range(5)]
+        assert db.bulk_upsert(self.table, rows, batch_size=2, db=conn) == 2
+
+    def test_copy_bytes(self):
+        stream = db._CopyStream([('1', b'\x00\xff\\')], ['id', 'data'])
+        assert stream.read() == '1\t\\\\x00ff5c\n'
+
+    def test_stream(self):
+        conn = MagicMock()
+        result = conn.execution_options.return_value.execute.return_value
+        result.fetchmany.side_effect = [[1, 2], [3], []]
+        assert list(db.stream('SELECT 1', chunk_size=2, db=conn)) == \
+            [1, 2, 3]
+        conn.execution_options.assert_called_once_with(stream_results=True)
+        result.close.assert_called_once_with()
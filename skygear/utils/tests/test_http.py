@@ -0,0 +1,124 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from ..http import HTTPClient, configure_client, get_client
+
+
+class CountingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), CountingHandler)
+        self.connections = set()
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            self.server.requests += 1
+            fail = self.server.failures > 0
+            self.server.failures -= 1
+        body = b'{}'
+        self.send_response(503 if fail else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'session=1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+    def setUp(self):
+        self.server = CountingServer()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.client = HTTPClient(pool_size=2, retries=2, backoff=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for i in range(5):
+            resp = self.client.post(self.url, b'{}')
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.requests, 5)
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(len(self.client.session.cookies), 0)
+
+    def test_pool_size(self):
+        threads = [threading.Thread(
+            target=lambda: [self.client.post(self.url, b'{}')
+                            for i in range(5)])
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.server.requests, 20)
+        self.assertLessEqual(len(self.server.connections), 2)
+
+    def test_retry_idempotent(self):
+        self.server.failures = 2
+        resp = self.client.post(self.url, b'{}', idempotent=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_retry_exhausted(self):
+        self.server.failures = 3
+        resp = self.client.post(self.url, b'{}', idempotent=True)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_no_retry(self):
+        self.server.failures = 1
+        resp = self.client.post(self.url, b'{}')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_connection_error(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(requests.ConnectionError):
+            self.client.post(self.url, b'{}', idempotent=True)
+
+
+class TestDefaultClient(unittest.TestCase):
+    def tearDown(self):
+        configure_client()
+
+    def test_configure_client(self):
+        client = get_client()
+        self.assertIs(get_client(), client)
+        configure_client(pool_size=3, retries=0)
+        self.assertIsNot(get_client(), client)
+        self.assertEqual(get_client().pool_size, 3)
+        self.assertEqual(get_client().retries, 0)
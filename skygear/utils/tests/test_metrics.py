@@ -0,0 +1,48 @@
+# Copyright 2015 Oursky Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from ..metrics import Counter, Gauge, MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.get_or_create(Counter, 'requests')
+        counter.inc()
+        counter.inc(2)
+        self.assertIs(self.registry.get_or_create(Counter, 'requests'),
+                      counter)
+        self.assertEqual(self.registry.snapshot(), {'requests': 3})
+
+    def test_gauge(self):
+        gauge = self.registry.get_or_create(Gauge, 'busy')
+        gauge.inc(3)
+        gauge.dec()
+        self.assertEqual(gauge.value, 2)
+        gauge.set(5)
+        self.assertEqual(self.registry.snapshot(), {'busy': 5})
+
+    def test_register_replaces_metric(self):
+        self.registry.get_or_create(Gauge, 'busy').set(1)
+        gauge = self.registry.register(Gauge('busy'))
+        self.assertEqual(self.registry.snapshot(), {'busy': 0})
+        self.assertIs(self.registry.get_or_create(Gauge, 'busy'), gauge)
+
+    def test_type_mismatch(self):
+        self.registry.get_or_create(Counter, 'requests')
+        with self.assertRaises(TypeError):
+            self.registry.get_or_create(Gauge, 'requests')